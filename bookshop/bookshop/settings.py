@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'core',
     'drf_yasg',   
@@ -63,6 +64,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.AuditContextMiddleware',  # Текущий запрос для записей аудита (сигналы моделей)
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'core.middleware.AuditMiddleware',  # Middleware для аудита действий пользователей
@@ -83,6 +85,7 @@ TEMPLATES = [
                 'core.context_processors.cart_context',
                 'core.context_processors.wishlist_context',
                 'core.context_processors.categories_context',
+                'core.context_processors.page_skeleton_context',
             ],
         },
     },
@@ -183,3 +186,112 @@ DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', EMAIL_HOST_USER or 'noreply
 # Настройки для сброса пароля
 # Срок действия ссылки для сброса пароля (в секундах, по умолчанию 3 дня)
 PASSWORD_RESET_TIMEOUT = 259200
+
+# Кэш
+# По умолчанию — память процесса; для нескольких процессов укажите общий
+# бэкенд, например django.core.cache.backends.redis.RedisCache
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'bookshop'),
+    }
+}
+
+# Кэширование страниц каталога для анонимных посетителей (core.page_cache)
+# Сколько секунд страница хранится в кэше приложения (0 — не кэшировать)
+PAGE_CACHE_TIMEOUT = int(os.getenv('PAGE_CACHE_TIMEOUT', 300))
+# max-age в Cache-Control для браузеров и прокси
+PAGE_CACHE_MAX_AGE = int(os.getenv('PAGE_CACHE_MAX_AGE', 60))
+
+# Каталог
+# Количество книг на одной странице каталога (курсорная пагинация)
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', 24))
+
+# Поиск книг (core.search)
+# postgres — полнотекстовый поиск PostgreSQL, index — встроенный индекс BM25
+# (на других СУБД всегда используется встроенный индекс)
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'postgres')
+# Конфигурация PostgreSQL для полнотекстового поиска
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'russian')
+# Файл встроенного индекса (строится командой build_search_index)
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', str(BASE_DIR / 'search_index.bin'))
+# Максимальное количество результатов встроенного индекса
+SEARCH_INDEX_MAX_RESULTS = int(os.getenv('SEARCH_INDEX_MAX_RESULTS', 1000))
+# Через сколько секунд после изменения книг перестраивать файл индекса (задача rebuild_search_index)
+SEARCH_INDEX_REBUILD_DELAY = int(os.getenv('SEARCH_INDEX_REBUILD_DELAY', 60))
+
+# Автодополнение поиска (core.autocomplete)
+# Количество подсказок каждого вида (книги, авторы, жанры, издатели)
+AUTOCOMPLETE_LIMIT = int(os.getenv('AUTOCOMPLETE_LIMIT', 5))
+# Через сколько секунд индекс подсказок перестраивается в фоне
+AUTOCOMPLETE_MAX_AGE = int(os.getenv('AUTOCOMPLETE_MAX_AGE', 300))
+
+# Фасеты каталога (core.facets): границы ценовых диапазонов, ₽
+FACET_PRICE_BOUNDS = [300, 500, 1000, 2000]
+
+# Журнал аудита (core.audit_writer)
+# False — записи сохраняются сразу в запросе
+AUDIT_ASYNC = os.getenv('AUDIT_ASYNC', 'True').lower() == 'true'
+# Сколько записей сохранять одним INSERT и максимальная задержка записи, мс
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', 100))
+AUDIT_FLUSH_INTERVAL = int(os.getenv('AUDIT_FLUSH_INTERVAL', 500))
+# Размер очереди и поведение при ее заполнении: drop, block или sync
+AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', 10000))
+AUDIT_OVERFLOW = os.getenv('AUDIT_OVERFLOW', 'drop')
+# Сколько ждать места в очереди при AUDIT_OVERFLOW=block, мс
+AUDIT_BLOCK_TIMEOUT = int(os.getenv('AUDIT_BLOCK_TIMEOUT', 50))
+# Сколько значений User-Agent и URL держать в кэше процесса (core.audit_lookups)
+AUDIT_LOOKUP_CACHE_SIZE = int(os.getenv('AUDIT_LOOKUP_CACHE_SIZE', 5000))
+# Месячные партиции журнала (PostgreSQL, core.audit_partitions, команда audit_partitions)
+# На сколько месяцев вперед создавать партиции
+AUDIT_PARTITIONS_AHEAD = int(os.getenv('AUDIT_PARTITIONS_AHEAD', 3))
+# Сколько месяцев хранить журнал (0 — хранить все) и что делать со старыми
+# партициями: detach — отключить от таблицы (данные остаются), drop — удалить
+AUDIT_RETENTION_MONTHS = int(os.getenv('AUDIT_RETENTION_MONTHS', 12))
+AUDIT_EXPIRED_PARTITIONS = os.getenv('AUDIT_EXPIRED_PARTITIONS', 'detach')
+# Архив журнала (core.audit_archive, команда archive_audit_log)
+# Каталог сегментов архива
+AUDIT_ARCHIVE_DIR = os.getenv('AUDIT_ARCHIVE_DIR', str(BASE_DIR / 'audit_archive'))
+# Записи старше скольких дней переносятся в архив
+AUDIT_ARCHIVE_AFTER_DAYS = int(os.getenv('AUDIT_ARCHIVE_AFTER_DAYS', 180))
+# Максимальное количество записей в одном сегменте и размер пачки удаления
+AUDIT_ARCHIVE_SEGMENT_ROWS = int(os.getenv('AUDIT_ARCHIVE_SEGMENT_ROWS', 100000))
+AUDIT_ARCHIVE_DELETE_CHUNK = int(os.getenv('AUDIT_ARCHIVE_DELETE_CHUNK', 5000))
+
+# Счетчики просмотров (core.view_counters)
+# Как часто процесс сохраняет накопленные просмотры, секунды
+VIEW_COUNTER_FLUSH_INTERVAL = int(os.getenv('VIEW_COUNTER_FLUSH_INTERVAL', 10))
+# Доля просмотров, которые дополнительно пишутся в журнал аудита (0 — не писать)
+VIEW_AUDIT_SAMPLE_RATE = float(os.getenv('VIEW_AUDIT_SAMPLE_RATE', 0))
+
+# Резерв товаров в корзине (core.reservations, команда release_stock_holds)
+# Сколько минут товар удерживается за корзиной без обращения к ней
+STOCK_HOLD_TTL = int(os.getenv('STOCK_HOLD_TTL', 20))
+
+# Фоновые задачи (core.jobs, команда run_workers)
+# Сколько попыток у задачи до статуса failed
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+# Пауза перед повтором: JOB_RETRY_DELAY * 2^(попытка-1), не больше JOB_RETRY_MAX_DELAY, секунды
+JOB_RETRY_DELAY = int(os.getenv('JOB_RETRY_DELAY', 30))
+JOB_RETRY_MAX_DELAY = int(os.getenv('JOB_RETRY_MAX_DELAY', 3600))
+# Через сколько секунд задача без ответа обработчика возвращается в очередь
+JOB_LOCK_TIMEOUT = int(os.getenv('JOB_LOCK_TIMEOUT', 300))
+
+# Очередь исходящих писем (core.outbox, команда dispatch_outbox)
+# Сколько писем отправлять через одно соединение с почтовым сервером
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', 50))
+# Не больше стольких писем в секунду (0 — без ограничения)
+EMAIL_OUTBOX_RATE = float(os.getenv('EMAIL_OUTBOX_RATE', 0))
+# Попыток отправки и пауза перед повтором: EMAIL_OUTBOX_RETRY_DELAY * 2^(попытка-1), секунды
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+EMAIL_OUTBOX_RETRY_DELAY = int(os.getenv('EMAIL_OUTBOX_RETRY_DELAY', 60))
+# Через сколько секунд письма пропавшего диспетчера возвращаются в очередь
+EMAIL_OUTBOX_LOCK_TIMEOUT = int(os.getenv('EMAIL_OUTBOX_LOCK_TIMEOUT', 600))
+
+# Номера карт лояльности (core.card_numbers, команда issue_loyalty_cards)
+# Первая цифра номера и ключ перестановки порядковых номеров (по умолчанию — SECRET_KEY).
+# Ключ и префикс нельзя менять после выпуска карт: новые номера могут совпасть со старыми
+LOYALTY_CARD_PREFIX = os.getenv('LOYALTY_CARD_PREFIX', '7')
+LOYALTY_CARD_KEY = os.getenv('LOYALTY_CARD_KEY', '')
+# Сколько порядковых номеров процесс получает из последовательности за один запрос
+LOYALTY_CARD_BLOCK_SIZE = int(os.getenv('LOYALTY_CARD_BLOCK_SIZE', 20))
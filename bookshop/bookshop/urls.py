@@ -13,6 +13,8 @@ from core.views import (
     books_by_author,
     books_by_publisher,
     search_books,
+    search_autocomplete,
+    page_personalization,
     cart_view,
     home,
     product_detail,
@@ -20,6 +22,7 @@ from core.views import (
     checkout,
     order_success,
     stationery_list,
+    update_cart_batch,
     update_cart_quantity,
     author_detail,
 )
@@ -97,6 +100,8 @@ urlpatterns = [
     path('', home, name='home'),
     path('books/', books_list, name='books_list'),
     path('books/search/', search_books, name='search_books'),
+    path('books/autocomplete/', search_autocomplete, name='search_autocomplete'),
+    path('personalization/', page_personalization, name='page_personalization'),
     path('books/genre/<int:genre_id>/', books_by_genre, name='books_by_genre'),
     path('books/author/<int:author_id>/', books_by_author, name='books_by_author'),
     path('author/<int:author_id>/', author_detail, name='author_detail'),
@@ -107,6 +112,7 @@ urlpatterns = [
     path('cart/add/<str:product_type>/<int:pk>/', add_to_cart, name='add_to_cart'),
     path('cart/remove/<str:product_type>/<int:pk>/', remove_from_cart, name='remove_from_cart'),
     path('cart/update/<str:product_type>/<int:pk>/', update_cart_quantity, name='update_cart_quantity'),
+    path('cart/update/', update_cart_batch, name='update_cart_batch'),
     path('checkout/', checkout, name='checkout'),
     path('checkout/success/<int:order_id>/', order_success, name='order_success'),
 
@@ -176,6 +182,7 @@ urlpatterns = [
     path('manager/reports/customers/export-csv/', manager_reports_customers_export_csv, name='manager_reports_customers_export_csv'),
     path('manager/reports/customers/export-image/', manager_reports_customers_export_image, name='manager_reports_customers_export_image'),
     path('manager/audit-log/', manager_audit_log, name='manager_audit_log'),
+    path('manager/audit-log/<int:log_id>/', manager_audit_log_details, name='manager_audit_log_details'),
     path('manager/export-data/', manager_export_data, name='manager_export_data'),
     path('manager/import-data/', manager_import_data, name='manager_import_data'),
     
@@ -1,17 +1,22 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.utils import timezone
 from django.utils.html import format_html
 from .models import (
     Author,
     AuditLog,
     Book,
+    Cart,
+    CartLine,
     Category,
     DeliveryOption,
     FAQ,
     Genre,
+    Job,
     LoyaltyCard,
     Order,
     OrderItem,
+    OutboxEmail,
     PaymentCard,
     PickupPoint,
     Product,
@@ -20,23 +25,30 @@ from .models import (
     Role,
     SavedAddress,
     Stationery,
+    StockHold,
     SupportMessage,
     User,
+    ViewCounter,
     Wishlist,
 )
 from .forms import CustomUserCreationForm, CustomUserChangeForm
-from .audit import log_change
 
 
 class AuditedModelAdmin(admin.ModelAdmin):
-    """Базовый класс для админ-классов с аудитом"""
+    """
+    Базовый класс для админ-классов с аудитом.
+
+    Запись в журнал создают сигналы (core.signals); админка только передает
+    им измененные поля, пользователь и IP берутся из текущего запроса.
+    """
     def save_model(self, request, obj, form, change):
         if change:
             # Получаем старые значения
             old_instance = self.model.objects.get(pk=obj.pk)
             changes = {}
             for field in obj._meta.fields:
-                if field.name in ['id', 'created_at', 'updated_at']:
+                # reserved_quantity меняют корзины (core.reservations), а не менеджер
+                if field.name in ['id', 'created_at', 'updated_at', 'reserved_quantity']:
                     continue
                 old_value = getattr(old_instance, field.name, None)
                 new_value = getattr(obj, field.name, None)
@@ -45,27 +57,20 @@ class AuditedModelAdmin(admin.ModelAdmin):
                         'old': str(old_value) if old_value is not None else '—',
                         'new': str(new_value) if new_value is not None else '—'
                     }
-            super().save_model(request, obj, form, change)
-            if changes:
-                log_change(obj, 'update', request=request, changes=changes)
-        else:
-            super().save_model(request, obj, form, change)
-            log_change(obj, 'create', request=request)
-    
-    def delete_model(self, request, obj):
-        log_change(obj, 'delete', request=request)
-        super().delete_model(request, obj)
+            # Пустой словарь — изменений нет, сигнал ничего не запишет
+            obj._audit_changes = changes
+        super().save_model(request, obj, form, change)
 
 
 @admin.register(Publisher)
 class PublisherAdmin(AuditedModelAdmin):
-    list_display = ("id", "name")
+    list_display = ("id", "name", "books_count")
     search_fields = ("name",)
 
 
 @admin.register(Book)
 class BookAdmin(AuditedModelAdmin):
-    list_display = ("title", "isbn13", "price", "rating", "publisher", "stock_quantity")
+    list_display = ("title", "isbn13", "price", "rating", "publisher", "stock_quantity", "reserved_quantity")
     list_filter = ("publisher", "language")
     search_fields = ("title", "isbn13")
     readonly_fields = ("rating",)
@@ -73,7 +78,7 @@ class BookAdmin(AuditedModelAdmin):
 
 @admin.register(Stationery)
 class StationeryAdmin(AuditedModelAdmin):
-    list_display = ("name", "price", "stock_quantity")
+    list_display = ("name", "price", "stock_quantity", "reserved_quantity")
     search_fields = ("name",)
 
 
@@ -91,7 +96,7 @@ class ProductAdmin(admin.ModelAdmin):
 
 @admin.register(Author)
 class AuthorAdmin(AuditedModelAdmin):
-    list_display = ("last_name", "first_name", "middle_name", "birth_date", "death_date")
+    list_display = ("last_name", "first_name", "middle_name", "birth_date", "death_date", "books_count")
     search_fields = ("last_name", "first_name", "middle_name")
     list_filter = ("birth_date", "death_date")
     fieldsets = (
@@ -103,7 +108,7 @@ class AuthorAdmin(AuditedModelAdmin):
 
 @admin.register(Genre)
 class GenreAdmin(admin.ModelAdmin):
-    list_display = ("name",)
+    list_display = ("name", "books_count")
     search_fields = ("name",)
 
 
@@ -191,6 +196,30 @@ class OrderItemInline(admin.TabularInline):
     readonly_fields = ("product_type", "name", "quantity", "unit_price", "subtotal")
 
 
+class CartLineInline(admin.TabularInline):
+    model = CartLine
+    extra = 0
+    readonly_fields = ("product_type", "product_id", "quantity", "price", "added_at")
+
+
+class StockHoldInline(admin.TabularInline):
+    model = StockHold
+    extra = 0
+    can_delete = False
+    readonly_fields = ("product_type", "product_id", "quantity", "expires_at")
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Cart)
+class CartAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "created_at", "updated_at")
+    search_fields = ("user__email",)
+    inlines = (CartLineInline, StockHoldInline)
+    readonly_fields = ("created_at", "updated_at")
+
+
 @admin.register(Order)
 class OrderAdmin(AuditedModelAdmin):
     list_display = ("id", "full_name", "fulfillment_type", "total_amount", "status", "created_at")
@@ -278,7 +307,7 @@ class WishlistAdmin(admin.ModelAdmin):
 class AuditLogAdmin(admin.ModelAdmin):
     list_display = ("created_at", "action", "model_name", "object_repr", "user", "description", "ip_address")
     list_filter = ("action", "model_name", "created_at")
-    search_fields = ("object_repr", "model_name", "user__email", "user__username", "description", "url_path")
+    search_fields = ("object_repr", "model_name", "user__email", "user__username", "description", "path__value")
     readonly_fields = ("action", "model_name", "object_id", "object_repr", "description", "url_path", "get_changes_display", "user", "ip_address", "user_agent", "created_at")
     ordering = ("-created_at",)
     
@@ -317,3 +346,62 @@ class AuditLogAdmin(admin.ModelAdmin):
         return request.user.is_superuser
 
 
+
+
+@admin.register(ViewCounter)
+class ViewCounterAdmin(admin.ModelAdmin):
+    list_display = ("date", "model_name", "object_id", "views")
+    list_filter = ("model_name", "date")
+    ordering = ("-date", "-views")
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "status", "attempts", "max_attempts", "run_at", "locked_by", "finished_at")
+    list_filter = ("status", "name")
+    ordering = ("-id",)
+    readonly_fields = (
+        "name", "payload", "status", "attempts", "max_attempts", "run_at",
+        "locked_by", "locked_at", "last_error", "created_at", "finished_at",
+    )
+    actions = ("retry_jobs",)
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Повторить выбранные задачи с ошибкой")
+    def retry_jobs(self, request, queryset):
+        from .jobs import retry_failed
+        count = retry_failed(list(queryset.values_list("pk", flat=True)))
+        self.message_user(request, f"Возвращено в очередь: {count}")
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ("id", "subject", "status", "attempts", "next_attempt_at", "created_at", "sent_at")
+    list_filter = ("status",)
+    search_fields = ("subject",)
+    ordering = ("-id",)
+    readonly_fields = (
+        "subject", "from_email", "to", "status", "attempts", "next_attempt_at",
+        "last_error", "locked_at", "created_at", "sent_at",
+    )
+    # Текст письма не показываем: в нем могут быть ссылки сброса пароля
+    exclude = ("body", "html_body")
+    actions = ("retry_emails",)
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Повторить отправку выбранных писем")
+    def retry_emails(self, request, queryset):
+        count = queryset.exclude(status__in=[OutboxEmail.Status.SENT, OutboxEmail.Status.SENDING]).update(
+            status=OutboxEmail.Status.PENDING, attempts=0, next_attempt_at=timezone.now(),
+        )
+        self.message_user(request, f"Возвращено в очередь: {count}")
@@ -3,4 +3,8 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'core'
\ No newline at end of file
+    name = 'core'
+
+    def ready(self):
+        # Подключаем обработчики сигналов
+        from . import autocomplete, book_counts, caching, cart, fragment_cache, ratings, reservations, search, signals, tasks  # noqa: F401
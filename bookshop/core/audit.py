@@ -1,9 +1,58 @@
 """
 Утилиты для аудита всех действий пользователей
+
+Записи сохраняются фоновым потоком пачками (см. core.audit_writer).
+Текущий запрос хранится в contextvar (его устанавливает AuditContextMiddleware),
+поэтому пользователь и IP попадают в журнал и без передачи request.
 """
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .audit_writer import writer
 from .models import AuditLog
 
 
+# --- Контекст запроса ---
+
+_current_request = ContextVar('audit_request', default=None)
+_model_signals_muted = ContextVar('audit_model_signals_muted', default=False)
+
+
+def get_current_request():
+    """Запрос, в рамках которого выполняется код (None вне запроса)"""
+    return _current_request.get()
+
+
+def set_current_request(request):
+    """Устанавливает текущий запрос; возвращает токен для reset_current_request"""
+    return _current_request.set(request)
+
+
+def reset_current_request(token):
+    _current_request.reset(token)
+
+
+@contextmanager
+def explicit_audit():
+    """
+    Изменения моделей внутри блока не пишутся сигналами (core.signals):
+    вызывающий код сам записывает их через log_action.
+    """
+    token = _model_signals_muted.set(True)
+    try:
+        yield
+    finally:
+        _model_signals_muted.reset(token)
+
+
+def model_signals_muted():
+    return _model_signals_muted.get()
+
+
 def get_client_ip(request):
     """Получает IP адрес из запроса"""
     if not request:
@@ -29,14 +78,20 @@ def log_action(action, user=None, request=None, model_name=None, object_id=None,
     Args:
         action: Тип действия ('login', 'logout', 'view', 'create', 'update', 'delete', 'download', 'export', 'import', 'config', 'other')
         user: Пользователь (если None, берется из request)
-        request: HTTP request (для получения IP, user agent, URL)
+        request: HTTP request (для получения IP, user agent, URL); по умолчанию — текущий
         model_name: Название модели (если применимо)
         object_id: ID объекта (если применимо)
         object_repr: Строковое представление объекта
         description: Описание действия
         changes: Словарь изменений {field: {'old': value, 'new': value}} (для create/update)
         url_path: URL страницы (если не указан, берется из request)
+
+    Запись сохраняется после коммита текущей транзакции и не задерживает запрос
+    (при AUDIT_ASYNC=False — сразу).
     """
+    if request is None:
+        request = get_current_request()
+
     # Получаем пользователя из request, если не передан
     if user is None and request and hasattr(request, 'user'):
         user = request.user if request.user.is_authenticated else None
@@ -49,8 +104,8 @@ def log_action(action, user=None, request=None, model_name=None, object_id=None,
     if url_path is None and request:
         url_path = request.path[:500]  # Ограничиваем длину
     
-    AuditLog.objects.create(
-        user=user,
+    entry = AuditLog(
+        user_id=getattr(user, 'pk', None),
         action=action,
         model_name=model_name,
         object_id=object_id,
@@ -60,7 +115,14 @@ def log_action(action, user=None, request=None, model_name=None, object_id=None,
         changes=changes or {},
         ip_address=ip_address,
         user_agent=user_agent,
+        created_at=timezone.now(),
     )
+    if not settings.AUDIT_ASYNC:
+        entry.save()
+        return
+
+    # Записи отмененной транзакции в журнал не попадают
+    transaction.on_commit(lambda: writer.write(entry))
 
 
 def log_change(instance, action, user=None, request=None, changes=None):
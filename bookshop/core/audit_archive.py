@@ -0,0 +1,220 @@
+"""
+Архив журнала аудита
+
+Старые записи AuditLog переносятся из таблицы в файлы-сегменты: NDJSON
+(одна запись — одна JSON-строка), сжатый gzip. Файл index.json в каталоге
+архива хранит для каждого сегмента количество записей, диапазон id и диапазон
+дат, чтобы при поиске открывать только подходящие сегменты.
+
+Записи читаются курсором на стороне сервера (QuerySet.iterator) и пишутся в
+сегмент потоком, поэтому память не зависит от объема архива. Из таблицы записи
+удаляются пачками только после того, как сегмент записан и внесен в индекс.
+Если процесс прервался между записью сегмента и удалением, при следующем
+запуске записи попадут в архив повторно — AuditArchive отдает каждый id один раз.
+"""
+import gzip
+import json
+import os
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.utils.dateparse import parse_datetime
+
+from .models import AuditLog
+
+
+FIELDS = (
+    'id', 'created_at', 'user_id', 'action', 'model_name', 'object_id', 'object_repr',
+    'description', 'url_path', 'changes', 'ip_address', 'user_agent',
+)
+
+# Поля, которые хранятся в справочниках (core.audit_lookups): в архив пишется строка
+LOOKUP_FIELDS = {
+    'url_path': F('path__value'),
+    'user_agent': F('agent__value'),
+}
+
+INDEX_FILE = 'index.json'
+
+
+def _read_index(directory):
+    path = os.path.join(directory, INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)['segments']
+
+
+def _write_index(directory, segments):
+    # Индекс заменяется целиком: читатели видят либо старую, либо новую версию
+    path = os.path.join(directory, INDEX_FILE)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump({'segments': segments}, file, ensure_ascii=False, indent=1)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+# --- Запись ---
+
+class _Segment:
+    """Открытый на запись сегмент"""
+
+    def __init__(self, directory):
+        self.name = f'auditlog-{uuid.uuid4().hex[:12]}.ndjson.gz'
+        self.path = os.path.join(directory, self.name)
+        self._tmp_path = f'{self.path}.tmp'
+        self._file = gzip.open(self._tmp_path, 'wt', encoding='utf-8')
+        self.ids = []
+        self.date_from = self.date_to = None
+
+    def write(self, row):
+        # DjangoJSONEncoder округляет время до миллисекунд — время пишем полностью
+        data = dict(row, created_at=row['created_at'].isoformat())
+        self._file.write(json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False))
+        self._file.write('\n')
+        self.ids.append(row['id'])
+        created_at = row['created_at']
+        self.date_from = min(self.date_from or created_at, created_at)
+        self.date_to = max(self.date_to or created_at, created_at)
+
+    def close(self):
+        """Закрывает файл и возвращает запись для индекса"""
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return {
+            'file': self.name,
+            'rows': len(self.ids),
+            'min_id': min(self.ids),
+            'max_id': max(self.ids),
+            'date_from': self.date_from.isoformat(),
+            'date_to': self.date_to.isoformat(),
+        }
+
+    def discard(self):
+        self._file.close()
+        os.remove(self._tmp_path)
+
+
+def archive_before(cutoff, directory=None, segment_rows=None, delete_chunk=None, delete=True):
+    """
+    Переносит записи старше cutoff в архив.
+
+    Args:
+        cutoff: Дата/время: архивируются записи с created_at < cutoff
+        directory: Каталог архива (по умолчанию AUDIT_ARCHIVE_DIR)
+        segment_rows: Максимальное количество записей в сегменте
+        delete_chunk: Сколько записей удалять из таблицы одним запросом
+        delete: Удалять ли заархивированные записи из таблицы
+
+    Returns:
+        Список записей индекса для созданных сегментов
+    """
+    directory = directory or settings.AUDIT_ARCHIVE_DIR
+    segment_rows = segment_rows or settings.AUDIT_ARCHIVE_SEGMENT_ROWS
+    delete_chunk = delete_chunk or settings.AUDIT_ARCHIVE_DELETE_CHUNK
+    os.makedirs(directory, exist_ok=True)
+
+    rows = (
+        AuditLog.objects.filter(created_at__lt=cutoff)
+        .order_by('created_at', 'id')
+        .values(*(field for field in FIELDS if field not in LOOKUP_FIELDS), **LOOKUP_FIELDS)
+        .iterator(chunk_size=2000)
+    )
+    created = []
+    segment = None
+    try:
+        for row in rows:
+            if segment is None:
+                segment = _Segment(directory)
+            segment.write(row)
+            if len(segment.ids) >= segment_rows:
+                created.append(_finish_segment(directory, segment, delete, delete_chunk))
+                segment = None
+        if segment is not None:
+            created.append(_finish_segment(directory, segment, delete, delete_chunk))
+            segment = None
+    finally:
+        if segment is not None:
+            segment.discard()
+    return created
+
+
+def _finish_segment(directory, segment, delete, delete_chunk):
+    entry = segment.close()
+    _write_index(directory, _read_index(directory) + [entry])
+    if delete:
+        for start in range(0, len(segment.ids), delete_chunk):
+            AuditLog.objects.filter(pk__in=segment.ids[start:start + delete_chunk]).delete()
+    return entry
+
+
+# --- Чтение ---
+
+class AuditArchive:
+    """
+    Чтение архива журнала аудита.
+
+    Записи возвращаются словарями с полями FIELDS (created_at — datetime).
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or settings.AUDIT_ARCHIVE_DIR
+
+    def segments(self):
+        return _read_index(self.directory)
+
+    def summary(self):
+        """{'rows': ..., 'date_from': ..., 'date_to': ...} или None, если архив пуст"""
+        segments = self.segments()
+        if not segments:
+            return None
+        return {
+            'rows': sum(segment['rows'] for segment in segments),
+            'date_from': parse_datetime(min(segment['date_from'] for segment in segments)),
+            'date_to': parse_datetime(max(segment['date_to'] for segment in segments)),
+        }
+
+    def _read(self, segment):
+        with gzip.open(os.path.join(self.directory, segment['file']), 'rt', encoding='utf-8') as file:
+            for line in file:
+                row = json.loads(line)
+                row['created_at'] = parse_datetime(row['created_at'])
+                yield row
+
+    def get(self, entry_id):
+        """Запись по id или None"""
+        for segment in self.segments():
+            if segment['min_id'] <= entry_id <= segment['max_id']:
+                for row in self._read(segment):
+                    if row['id'] == entry_id:
+                        return row
+        return None
+
+    def between(self, date_from=None, date_to=None):
+        """Записи с date_from <= created_at < date_to (в порядке сегментов)"""
+        seen = set()
+        for segment in self.segments():
+            if date_to and parse_datetime(segment['date_from']) >= date_to:
+                continue
+            if date_from and parse_datetime(segment['date_to']) < date_from:
+                continue
+            for row in self._read(segment):
+                if date_from and row['created_at'] < date_from:
+                    continue
+                if date_to and row['created_at'] >= date_to:
+                    continue
+                if row['id'] in seen:
+                    continue
+                seen.add(row['id'])
+                yield row
+
+
+def archived_entry(row):
+    """Несохраненный AuditLog из записи архива (для шаблонов журнала)"""
+    entry = AuditLog(**row)
+    entry.archived = True
+    return entry
@@ -0,0 +1,112 @@
+"""
+Справочники User-Agent и URL журнала аудита
+
+Различных User-Agent и URL в журнале несколько тысяч, поэтому AuditLog
+хранит не строки, а ссылки на AuditUserAgent и AuditPath. Соответствие
+"строка -> id" кэшируется в процессе (LRU на AUDIT_LOOKUP_CACHE_SIZE значений):
+для уже встречавшихся строк сохранение записи не делает лишних запросов.
+Новые строки добавляются в справочник пачкой при сохранении пачки журнала.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import AuditPath, AuditUserAgent
+
+
+def digest(value):
+    return hashlib.md5(value.encode('utf-8')).hexdigest()
+
+
+class LookupCache:
+    """
+    id строк справочника model с LRU-кэшем.
+
+    Args:
+        model: Модель справочника (AuditLookup)
+        max_size: Сколько значений держать в кэше
+    """
+
+    def __init__(self, model, max_size=5000):
+        self.model = model
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_ids(self, values):
+        """{значение: id} для values; недостающие строки создаются"""
+        result = {}
+        missing = set()
+        with self._lock:
+            for value in values:
+                if value in self._ids:
+                    self._ids.move_to_end(value)
+                    result[value] = self._ids[value]
+                else:
+                    missing.add(value)
+        if not missing:
+            return result
+
+        found = self._fetch(missing)
+        new_values = missing - found.keys()
+        if new_values:
+            # Параллельный процесс мог добавить ту же строку — конфликт пропускаем
+            self.model.objects.bulk_create(
+                [self.model(value=value, digest=digest(value)) for value in new_values],
+                ignore_conflicts=True,
+            )
+            found.update(self._fetch(new_values))
+        result.update(found)
+
+        if connection.in_atomic_block:
+            # Строки из незавершенной транзакции кэшируем только после коммита
+            transaction.on_commit(lambda: self._remember(found))
+        else:
+            self._remember(found)
+        return result
+
+    def _fetch(self, values):
+        by_digest = {digest(value): value for value in values}
+        rows = self.model.objects.filter(digest__in=by_digest).values_list('digest', 'id')
+        return {by_digest[row_digest]: row_id for row_digest, row_id in rows}
+
+    def _remember(self, ids):
+        with self._lock:
+            self._ids.update(ids)
+            for value in ids:
+                self._ids.move_to_end(value)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+# --- Экземпляры процесса ---
+
+paths = LookupCache(AuditPath, settings.AUDIT_LOOKUP_CACHE_SIZE)
+user_agents = LookupCache(AuditUserAgent, settings.AUDIT_LOOKUP_CACHE_SIZE)
+
+# (справочник, поле-ссылка, атрибут со строкой)
+_LOOKUPS = (
+    (paths, 'path_id', '_url_path'),
+    (user_agents, 'agent_id', '_user_agent'),
+)
+
+
+def encode_entries(entries):
+    """Проставляет записям AuditLog ссылки на справочники по url_path и user_agent"""
+    for lookup, id_field, value_field in _LOOKUPS:
+        pending = [
+            entry for entry in entries
+            if getattr(entry, id_field) is None and entry.__dict__.get(value_field)
+        ]
+        if not pending:
+            continue
+        ids = lookup.get_ids({entry.__dict__[value_field] for entry in pending})
+        for entry in pending:
+            setattr(entry, id_field, ids[entry.__dict__[value_field]])
@@ -0,0 +1,126 @@
+"""
+Данные для фильтров журнала аудита
+
+Списки моделей и пользователей, встречающихся в журнале, хранятся в кэше
+вместе с id последней учтенной записи и временем чтения. При каждом обращении
+дочитываются только новые записи (id > last_id) и записи, созданные не раньше
+чем за RESCAN_WINDOW секунд до прошлого чтения: запись с меньшим id может быть
+закоммичена позже записи с большим (фоновая запись журнала, долгие
+транзакции). Целиком списки пересчитываются раз в
+FULL_REFRESH секунд или если новых записей слишком много. Полный пересчет на
+PostgreSQL выполняется "прыжками" по индексу (рекурсивный запрос) и читает по
+одной строке на каждое различное значение, а не всю таблицу.
+"""
+import hashlib
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .models import AuditLog
+
+
+CACHE_KEY = 'audit_filters'
+
+# Как часто пересчитывать списки целиком, секунды
+FULL_REFRESH = 24 * 60 * 60
+
+# Больше стольких новых записей — дешевле пересчитать целиком
+INCREMENTAL_LIMIT = 100000
+
+# За сколько секунд до прошлого чтения перечитывать записи (поздние коммиты)
+RESCAN_WINDOW = 60
+
+# Сколько секунд хранить статистику журнала для набора фильтров
+STATS_TIMEOUT = 5 * 60
+
+LOOSE_SCAN_SQL = """
+    WITH RECURSIVE t AS (
+        (SELECT {field} AS value FROM {table} WHERE {field} IS NOT NULL ORDER BY {field} LIMIT 1)
+        UNION ALL
+        SELECT (SELECT {field} FROM {table} WHERE {field} > t.value ORDER BY {field} LIMIT 1)
+        FROM t WHERE t.value IS NOT NULL
+    )
+    SELECT value FROM t WHERE value IS NOT NULL
+"""
+
+
+def distinct_values(field):
+    """Различные непустые значения поля AuditLog"""
+    column = AuditLog._meta.get_field(field).column
+    if connection.vendor == 'postgresql':
+        sql = LOOSE_SCAN_SQL.format(
+            field=connection.ops.quote_name(column),
+            table=connection.ops.quote_name(AuditLog._meta.db_table),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            return {row[0] for row in cursor.fetchall()}
+    return set(
+        AuditLog.objects.filter(**{f'{column}__isnull': False})
+        .order_by().values_list(column, flat=True).distinct()
+    )
+
+
+def _full_metadata(last_id, scanned_at):
+    return {
+        'model_names': distinct_values('model_name'),
+        'user_ids': distinct_values('user'),
+        'last_id': last_id,
+        'scanned_at': scanned_at,
+        'built_at': time.time(),
+    }
+
+
+def get_filter_metadata():
+    """{'model_names': set, 'user_ids': set, ...} — значения для фильтров журнала"""
+    scanned_at = timezone.now()
+    last_id = AuditLog.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    data = cache.get(CACHE_KEY)
+
+    if (
+        data is None
+        or 'scanned_at' not in data
+        or time.time() - data['built_at'] > FULL_REFRESH
+        or last_id - data['last_id'] > INCREMENTAL_LIMIT
+    ):
+        data = _full_metadata(last_id, scanned_at)
+    else:
+        new_rows = (
+            AuditLog.objects.filter(
+                Q(id__gt=data['last_id'])
+                | Q(created_at__gte=data['scanned_at'] - timedelta(seconds=RESCAN_WINDOW))
+            )
+            .order_by().values_list('model_name', 'user_id').distinct()
+        )
+        for model_name, user_id in new_rows:
+            if model_name:
+                data['model_names'].add(model_name)
+            if user_id:
+                data['user_ids'].add(user_id)
+        data['last_id'] = max(last_id, data['last_id'])
+        data['scanned_at'] = scanned_at
+
+    cache.set(CACHE_KEY, data, None)
+    return data
+
+
+def get_log_stats(audit_logs, filters):
+    """
+    Количество записей по действиям и моделям для отфильтрованного журнала.
+
+    Кэшируется на STATS_TIMEOUT по набору фильтров filters.
+    """
+    digest = hashlib.md5(repr(sorted(filters.items())).encode('utf-8')).hexdigest()
+    key = f'audit_stats:{digest}'
+    stats = cache.get(key)
+    if stats is None:
+        stats = {
+            'by_action': list(audit_logs.order_by().values('action').annotate(count=Count('id')).order_by('-count')),
+            'by_model': list(audit_logs.order_by().values('model_name').annotate(count=Count('id')).order_by('-count')),
+        }
+        cache.set(key, stats, STATS_TIMEOUT)
+    return stats
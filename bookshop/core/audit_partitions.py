@@ -0,0 +1,213 @@
+"""
+Месячные партиции журнала аудита (PostgreSQL)
+
+Таблица AuditLog секционирована по created_at (PARTITION BY RANGE): каждая
+партиция хранит один календарный месяц, записи вне созданных партиций попадают
+в партицию по умолчанию. Первичный ключ таблицы — (id, created_at), так как
+ключ секционированной таблицы должен включать ключ секционирования; id
+по-прежнему выдается последовательностью и уникален.
+
+Запросы с условием на created_at читают только партиции нужных месяцев.
+Устаревшие месяцы удаляются отключением (DETACH) или удалением (DROP) партиции,
+а не DELETE по строкам. Партиции создает и чистит команда audit_partitions.
+На других СУБД таблица остается обычной, функции модуля ничего не делают.
+"""
+import re
+from datetime import date
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+TABLE = 'core_auditlog'
+DEFAULT_PARTITION = f'{TABLE}_default'
+SEQUENCE = f'{TABLE}_id_seq'
+
+_PARTITION_RE = re.compile(rf'^{TABLE}_p(\d{{4}})_(\d{{2}})$')
+
+
+def is_supported():
+    return connection.vendor == 'postgresql'
+
+
+def month_start(day, shift=0):
+    """Первое число месяца day, сдвинутого на shift месяцев"""
+    months = day.year * 12 + day.month - 1 + shift
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month.year:04d}_{month.month:02d}'
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+# --- Список партиций ---
+
+def is_partitioned():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [TABLE])
+        return cursor.fetchone() is not None
+
+
+def list_partitions():
+    """Месячные партиции таблицы: [(month, name)] по возрастанию месяца"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT c.relname
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+        """, [TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        match = _PARTITION_RE.match(name)
+        if match:
+            partitions.append((date(int(match[1]), int(match[2]), 1), name))
+    return sorted(partitions)
+
+
+# --- Создание и удаление ---
+
+def create_partition(month):
+    """
+    Создает партицию месяца month.
+
+    Строки этого месяца, уже попавшие в партицию по умолчанию, переносятся в новую.
+
+    Returns:
+        Имя партиции или None, если она уже есть
+    """
+    month = month_start(month)
+    name = partition_name(month)
+    if name in {existing for _, existing in list_partitions()}:
+        return None
+    end = month_start(month, 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {_quote(name)} (LIKE {_quote(TABLE)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM {_quote(DEFAULT_PARTITION)}
+                WHERE created_at >= %s AND created_at < %s
+                RETURNING *
+            )
+            INSERT INTO {_quote(name)} SELECT * FROM moved
+        """, [month, end])
+        cursor.execute(
+            f'ALTER TABLE {_quote(TABLE)} ATTACH PARTITION {_quote(name)} FOR VALUES FROM (%s) TO (%s)',
+            [month, end],
+        )
+    return name
+
+
+def ensure_partitions(ahead, today=None):
+    """Создает партиции текущего месяца и ahead следующих; возвращает созданные"""
+    today = today or timezone.now().date()
+    created = []
+    for shift in range(ahead + 1):
+        name = create_partition(month_start(today, shift))
+        if name:
+            created.append(name)
+    return created
+
+
+def expired_partitions(retention_months, today=None):
+    """Партиции месяцев старше retention_months (0 — хранить все)"""
+    if not retention_months:
+        return []
+    oldest_kept = month_start(today or timezone.now().date(), -retention_months + 1)
+    return [(month, name) for month, name in list_partitions() if month < oldest_kept]
+
+
+def detach_partition(name):
+    """Отключает партицию: данные остаются в отдельной таблице с тем же именем"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {_quote(TABLE)} DETACH PARTITION {_quote(name)}')
+
+
+def drop_partition(name):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE {_quote(name)}')
+
+
+# --- Преобразование таблицы (миграция) ---
+
+def _table_definitions(cursor):
+    """SQL индексов (кроме первичного ключа) и внешних ключей таблицы"""
+    cursor.execute("""
+        SELECT pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        WHERE i.indrelid = %s::regclass AND NOT i.indisprimary
+    """, [TABLE])
+    # Индекс секционированной таблицы описывается как "ON ONLY <таблица>"
+    indexes = [row[0].replace(' ON ONLY ', ' ON ', 1) for row in cursor.fetchall()]
+    cursor.execute("""
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype = 'f'
+    """, [TABLE])
+    foreign_keys = cursor.fetchall()
+    return indexes, foreign_keys
+
+
+def _rebuild_table(cursor, partition_by, primary_key, after_create=()):
+    """Пересоздает таблицу с тем же содержимым, индексами и внешними ключами"""
+    indexes, foreign_keys = _table_definitions(cursor)
+    old = f'{TABLE}_old'
+    cursor.execute(f'ALTER TABLE {_quote(TABLE)} RENAME TO {_quote(old)}')
+    cursor.execute(f"""
+        CREATE TABLE {_quote(TABLE)} (LIKE {_quote(old)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+        {partition_by}
+    """)
+    # id получит собственную последовательность ниже
+    cursor.execute(f'ALTER TABLE {_quote(TABLE)} ALTER COLUMN id DROP DEFAULT')
+    for sql, params in after_create:
+        cursor.execute(sql, params)
+    cursor.execute(f'INSERT INTO {_quote(TABLE)} SELECT * FROM {_quote(old)}')
+    cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {_quote(old)}')
+    max_id = cursor.fetchone()[0]
+    # Вместе со старой таблицей удаляется и ее последовательность id
+    cursor.execute(f'DROP TABLE {_quote(old)}')
+
+    cursor.execute(f'CREATE SEQUENCE {_quote(SEQUENCE)} OWNED BY {_quote(TABLE)}.id')
+    cursor.execute('SELECT setval(%s, %s, %s)', [SEQUENCE, max_id or 1, bool(max_id)])
+    cursor.execute(f"ALTER TABLE {_quote(TABLE)} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')")
+    cursor.execute(f'ALTER TABLE {_quote(TABLE)} ADD CONSTRAINT {_quote(TABLE + "_pkey")} PRIMARY KEY ({primary_key})')
+    for sql in indexes:
+        cursor.execute(sql)
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {_quote(TABLE)} ADD CONSTRAINT {_quote(name)} {definition}')
+
+
+def partition_table(ahead=3):
+    """Превращает core_auditlog в секционированную по месяцам таблицу"""
+    if not is_supported() or is_partitioned():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT MIN(created_at) FROM {_quote(TABLE)}')
+        oldest = cursor.fetchone()[0]
+        first = month_start(oldest.date() if oldest else timezone.now().date())
+        last = month_start(timezone.now().date(), ahead)
+
+        partitions = [(
+            f'CREATE TABLE {_quote(DEFAULT_PARTITION)} PARTITION OF {_quote(TABLE)} DEFAULT', None,
+        )]
+        month = first
+        while month <= last:
+            partitions.append((
+                f'CREATE TABLE {_quote(partition_name(month))} PARTITION OF {_quote(TABLE)} '
+                f'FOR VALUES FROM (%s) TO (%s)',
+                [month, month_start(month, 1)],
+            ))
+            month = month_start(month, 1)
+        _rebuild_table(cursor, 'PARTITION BY RANGE (created_at)', 'id, created_at', partitions)
+
+
+def unpartition_table():
+    """Обратное преобразование: обычная таблица с первичным ключом id"""
+    if not is_supported() or not is_partitioned():
+        return
+    with connection.cursor() as cursor:
+        _rebuild_table(cursor, '', 'id')
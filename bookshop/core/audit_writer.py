@@ -0,0 +1,204 @@
+"""
+Фоновая запись журнала аудита
+
+log_action не выполняет INSERT в запросе: запись попадает в ограниченную
+очередь процесса, а фоновый поток сохраняет накопленные записи одним
+bulk_create — как только набралось AUDIT_BATCH_SIZE записей или прошло
+AUDIT_FLUSH_INTERVAL мс с первой записи пачки. При завершении процесса
+очередь дописывается (atexit).
+
+Если очередь заполнена, поведение задается AUDIT_OVERFLOW:
+    drop  — запись отбрасывается (учитывается в счетчике dropped);
+    block — ждем место в очереди до AUDIT_BLOCK_TIMEOUT мс, затем отбрасываем;
+    sync  — запись сохраняется сразу в текущем потоке.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .audit_lookups import encode_entries
+from .models import AuditLog
+
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('drop', 'block', 'sync')
+
+# Служебные элементы очереди
+_STOP = object()
+
+
+class _Flush:
+    """Маркер: поток дописывает пачку и сообщает об этом через event"""
+
+    def __init__(self):
+        self.event = threading.Event()
+
+
+class AuditWriter:
+    """
+    Буферизованная запись AuditLog.
+
+    Args:
+        batch_size: Сколько записей сохранять одним bulk_create
+        flush_interval: Максимальная задержка записи, секунды
+        max_queue: Размер очереди
+        overflow: Поведение при заполненной очереди (OVERFLOW_POLICIES)
+        block_timeout: Сколько ждать места в очереди при overflow='block', секунды
+    """
+
+    def __init__(self, batch_size=100, flush_interval=0.5, max_queue=10000,
+                 overflow='drop', block_timeout=0.05):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Неизвестная политика переполнения: {overflow}')
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._counters = dict.fromkeys(('enqueued', 'written', 'dropped', 'failed', 'batches', 'sync'), 0)
+        self._last_flush_at = None
+
+    # --- Запись ---
+
+    def write(self, entry):
+        """Ставит запись (несохраненный AuditLog) в очередь"""
+        self._ensure_started()
+        try:
+            if self.overflow == 'block':
+                self._queue.put(entry, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(entry)
+        except queue.Full:
+            if self.overflow == 'sync':
+                self._count('sync')
+                self._save([entry])
+            else:
+                self._count('dropped')
+            return
+        self._count('enqueued')
+
+    def flush(self, timeout=None):
+        """Дожидается записи всего, что уже стоит в очереди"""
+        if not self._running():
+            return True
+        marker = _Flush()
+        self._queue.put(marker)
+        return marker.event.wait(timeout)
+
+    def stop(self, timeout=5):
+        """Дописывает очередь и останавливает поток"""
+        with self._lock:
+            if not self._running():
+                return
+            thread = self._thread
+            self._queue.put(_STOP)
+        thread.join(timeout)
+
+    # --- Метрики ---
+
+    def stats(self):
+        """Глубина очереди и счетчики записей процесса"""
+        with self._lock:
+            counters = dict(self._counters)
+        counters.update(
+            queue_depth=self._queue.qsize() if self._queue is not None else 0,
+            max_queue=self.max_queue,
+            running=self._running(),
+            last_flush_at=self._last_flush_at,
+        )
+        return counters
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    # --- Фоновый поток ---
+
+    def _running(self):
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+
+    def _ensure_started(self):
+        if self._running():
+            return
+        with self._lock:
+            if self._running():
+                return
+            # После fork очередь и поток родителя в процессе недоступны
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        markers = []
+        try:
+            while True:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                stop = item is _STOP
+                if isinstance(item, _Flush):
+                    markers.append(item)
+                elif item is not None and not stop:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+
+                expired = deadline is not None and time.monotonic() >= deadline
+                if batch and (len(batch) >= self.batch_size or expired or markers or stop):
+                    self._save(batch)
+                    batch = []
+                    deadline = None
+                for marker in markers:
+                    marker.event.set()
+                markers = []
+                if stop:
+                    return
+        finally:
+            connection.close()
+
+    def _save(self, batch):
+        try:
+            encode_entries(batch)
+            AuditLog.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception:
+            logger.exception('Не удалось сохранить %d записей аудита', len(batch))
+            self._count('failed', len(batch))
+            if threading.current_thread() is self._thread:
+                # Соединение могло оборваться — следующая пачка откроет новое
+                connection.close()
+            return
+        with self._lock:
+            self._counters['written'] += len(batch)
+            self._counters['batches'] += 1
+            self._last_flush_at = time.time()
+
+
+# --- Экземпляр процесса ---
+
+writer = AuditWriter(
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL / 1000,
+    max_queue=settings.AUDIT_QUEUE_SIZE,
+    overflow=settings.AUDIT_OVERFLOW,
+    block_timeout=settings.AUDIT_BLOCK_TIMEOUT / 1000,
+)
+
+atexit.register(writer.stop)
@@ -0,0 +1,181 @@
+"""
+Автодополнение поиска по префиксу
+
+Индекс хранится в памяти процесса: отсортированный массив ключей (каждое слово
+названия и все, что идет после него) и заранее посчитанные топ-N подсказок для
+коротких префиксов, где диапазон совпадений слишком велик для перебора.
+Запрос подсказок не обращается к БД.
+
+Индекс строится при первом обращении и перестраивается в фоне: сразу после
+изменения книг/авторов/жанров/издателей в этом процессе и по истечении
+AUTOCOMPLETE_MAX_AGE в остальных.
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.urls import reverse
+
+from .models import Author, Book, Genre, Publisher
+
+
+KINDS = ('books', 'authors', 'genres', 'publishers')
+
+_NON_WORD_RE = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalize(text):
+    """Нижний регистр, ё→е, слова через один пробел"""
+    return _NON_WORD_RE.sub(' ', (text or '').lower().replace('ё', 'е')).strip()
+
+
+class PrefixIndex:
+    """
+    Индекс подсказок.
+
+    Args:
+        entries: Список (kind, id, label, url, weight)
+        limit: Максимальное количество подсказок каждого вида
+    """
+
+    SHORT_PREFIX = 3
+
+    def __init__(self, entries, limit):
+        self.limit = limit
+        self.entries = entries
+        self.built_at = time.monotonic()
+
+        keys = []
+        for position, (_, _, label, _, _) in enumerate(entries):
+            words = normalize(label).split(' ')
+            for start in range(len(words)):
+                key = ' '.join(words[start:])
+                if key:
+                    keys.append((key, position))
+        keys.sort()
+        self._keys = [key for key, _ in keys]
+        self._positions = [position for _, position in keys]
+
+        # Топ подсказок для префиксов длиной до SHORT_PREFIX символов
+        short = {}
+        for key, position in keys:
+            for length in range(1, min(len(key), self.SHORT_PREFIX) + 1):
+                short.setdefault(key[:length], set()).add(position)
+        self._short = {prefix: self._top(positions) for prefix, positions in short.items()}
+
+    def _top(self, positions):
+        grouped = {kind: [] for kind in KINDS}
+        for position in positions:
+            grouped[self.entries[position][0]].append(position)
+
+        def order(position):
+            # Сначала больший вес, затем по алфавиту
+            return -self.entries[position][4], self.entries[position][2]
+
+        return {kind: heapq.nsmallest(self.limit, items, key=order) for kind, items in grouped.items()}
+
+    def lookup(self, prefix, limit=None):
+        """Возвращает {kind: [entry, ...]} для префикса"""
+        limit = min(limit or self.limit, self.limit)
+        prefix = normalize(prefix)
+        if not prefix:
+            return {kind: [] for kind in KINDS}
+
+        if len(prefix) <= self.SHORT_PREFIX:
+            top = self._short.get(prefix, {})
+        else:
+            start = bisect.bisect_left(self._keys, prefix)
+            end = bisect.bisect_left(self._keys, prefix + '\uffff', lo=start)
+            top = self._top(set(self._positions[start:end]))
+
+        return {
+            kind: [self.entries[position] for position in top.get(kind, [])[:limit]]
+            for kind in KINDS
+        }
+
+
+def load_entries():
+    """Собирает подсказки из БД (4 запроса)"""
+    entries = []
+    books = Book.objects.values_list('pk', 'title', 'rating')
+    for pk, title, rating in books.iterator(chunk_size=5000):
+        entries.append(('books', pk, title, reverse('product_detail', args=['book', pk]), float(rating)))
+
+    for author in Author.objects.iterator(chunk_size=5000):
+        entries.append(('authors', author.pk, author.get_full_name(),
+                        reverse('author_detail', args=[author.pk]), author.books_count))
+
+    for model, kind, url_name in ((Genre, 'genres', 'books_by_genre'),
+                                  (Publisher, 'publishers', 'books_by_publisher')):
+        for pk, name, weight in model.objects.values_list('pk', 'name', 'books_count'):
+            entries.append((kind, pk, name, reverse(url_name, args=[pk]), weight))
+    return entries
+
+
+# --- Экземпляр процесса ---
+
+_index = None
+_rebuild_lock = threading.Lock()
+_rebuild_pending = threading.Event()
+
+
+def build_index():
+    global _index
+    _index = PrefixIndex(load_entries(), settings.AUTOCOMPLETE_LIMIT)
+    return _index
+
+
+def _rebuild_worker():
+    from django.db import connection
+
+    try:
+        while _rebuild_pending.is_set():
+            _rebuild_pending.clear()
+            build_index()
+    finally:
+        connection.close()
+        _rebuild_lock.release()
+    # Изменение могло прийти между последней сборкой и освобождением блокировки
+    if _rebuild_pending.is_set():
+        schedule_rebuild()
+
+
+def schedule_rebuild():
+    """Перестраивает индекс в фоновом потоке (несколько запросов сливаются в один)"""
+    _rebuild_pending.set()
+    if _rebuild_lock.acquire(blocking=False):
+        threading.Thread(target=_rebuild_worker, name='autocomplete-rebuild', daemon=True).start()
+
+
+def get_autocomplete_index():
+    """Индекс процесса: при первом обращении строится синхронно, затем обновляется в фоне"""
+    index = _index
+    if index is None:
+        with _rebuild_lock:
+            index = _index or build_index()
+    elif time.monotonic() - index.built_at > settings.AUTOCOMPLETE_MAX_AGE and not _rebuild_lock.locked():
+        schedule_rebuild()
+    return index
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Publisher)
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Publisher)
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.genres.through)
+def refresh_autocomplete_index(sender, raw=False, **kwargs):
+    # До первого обращения индекса нет — перестраивать нечего
+    if raw or _index is None:
+        return
+    transaction.on_commit(schedule_rebuild)
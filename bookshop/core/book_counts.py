@@ -0,0 +1,142 @@
+"""
+Количество книг у жанров, авторов и издателей
+
+Поле books_count хранится в строке жанра/автора/издателя и обновляется
+сигналами в той же транзакции, что и изменение связей: приращения делаются
+через F(), поэтому параллельные изменения не теряются. Меню каталога читают
+готовое значение вместо COUNT по таблицам связей.
+
+Если счетчики разошлись с данными (массовые update()/raw SQL, загрузка
+фикстур), их пересчитывает команда reconcile_books_counts.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import Author, Book, Genre, Publisher
+
+
+def change_books_count(model, pks, delta):
+    """Изменяет books_count на delta для объектов model с первичными ключами pks"""
+    pks = [pk for pk in pks if pk is not None]
+    if not pks or not delta:
+        return
+    model.objects.filter(pk__in=pks).update(books_count=F('books_count') + delta)
+
+
+# --- Пересчет ---
+
+def actual_books_count(model, book_model=Book):
+    """
+    Выражение с фактическим количеством книг для строки model.
+
+    Модель книги передается параметром, чтобы выражение работало и в миграциях.
+    """
+    name = model._meta.model_name
+    if name == 'publisher':
+        links = book_model.objects.filter(publisher=OuterRef('pk'))
+        group_by = 'publisher'
+    else:
+        through = book_model.authors.through if name == 'author' else book_model.genres.through
+        links = through.objects.filter(**{f'{name}_id': OuterRef('pk')})
+        group_by = f'{name}_id'
+    count = links.order_by().values(group_by).annotate(count=Count('*')).values('count')
+    return Coalesce(Subquery(count, output_field=IntegerField()), 0)
+
+
+def reconcile_books_counts(models=(Genre, Author, Publisher), book_model=Book):
+    """
+    Пересчитывает books_count одним UPDATE на модель.
+
+    Returns:
+        {модель: количество исправленных строк}
+    """
+    fixed = {}
+    for model in models:
+        stale = model.objects.annotate(
+            actual=actual_books_count(model, book_model),
+        ).exclude(books_count=F('actual'))
+        fixed[model] = model.objects.filter(pk__in=stale.values('pk')).update(
+            books_count=actual_books_count(model, book_model),
+        )
+    return fixed
+
+
+# --- Издатель книги ---
+
+@receiver(pre_save, sender=Book)
+def remember_book_publisher(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        instance._counted_publisher_id = None
+        return
+    instance._counted_publisher_id = (
+        Book.objects.filter(pk=instance.pk).values_list('publisher_id', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Book)
+def update_publisher_books_count(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else getattr(instance, '_counted_publisher_id', None)
+    if previous != instance.publisher_id:
+        change_books_count(Publisher, [previous], -1)
+        change_books_count(Publisher, [instance.publisher_id], 1)
+
+
+# --- Удаление книги ---
+
+@receiver(pre_delete, sender=Book)
+def remember_book_relations(sender, instance, **kwargs):
+    # Связи с авторами и жанрами удаляются каскадно без m2m_changed
+    instance._counted_author_ids = list(
+        Book.authors.through.objects.filter(book_id=instance.pk).values_list('author_id', flat=True)
+    )
+    instance._counted_genre_ids = list(
+        Book.genres.through.objects.filter(book_id=instance.pk).values_list('genre_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Book)
+def update_books_count_after_delete(sender, instance, **kwargs):
+    change_books_count(Publisher, [instance.publisher_id], -1)
+    change_books_count(Author, getattr(instance, '_counted_author_ids', []), -1)
+    change_books_count(Genre, getattr(instance, '_counted_genre_ids', []), -1)
+
+
+# --- Авторы и жанры книги ---
+
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.genres.through)
+def update_books_count_on_m2m(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+    Прямая сторона (book.genres.add(...)): меняются счетчики жанров из pk_set.
+    Обратная (genre.books.add(...)): меняется счетчик самого жанра на len(pk_set).
+    """
+    target = type(instance) if reverse else model
+    target_field = f'{target._meta.model_name}_id'
+    # owner — сторона, у которой вызван менеджер; member — значения из pk_set
+    owner_field, member_field = (target_field, 'book_id') if reverse else ('book_id', target_field)
+
+    if action in ('pre_remove', 'pre_clear'):
+        # Удаляются только существующие связи: запоминаем их до удаления
+        links = sender.objects.filter(**{owner_field: instance.pk})
+        if action == 'pre_remove':
+            links = links.filter(**{f'{member_field}__in': pk_set})
+        instance._counted_removed = list(links.values_list(member_field, flat=True))
+        return
+
+    if action == 'post_add':
+        changed = list(pk_set)
+        delta = 1
+    elif action in ('post_remove', 'post_clear'):
+        changed = getattr(instance, '_counted_removed', [])
+        delta = -1
+    else:
+        return
+
+    if reverse:
+        change_books_count(target, [instance.pk], delta * len(changed))
+    else:
+        change_books_count(target, changed, delta)
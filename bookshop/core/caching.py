@@ -0,0 +1,102 @@
+"""
+Версионированный кэш
+
+Ключи кэша строятся из пространства имен и его текущей версии. Чтобы
+сбросить все значения пространства (например, всё, что зависит от каталога),
+достаточно увеличить версию: старые ключи перестают читаться и со временем
+вытесняются из кэша сами. Версии увеличиваются обработчиками сигналов моделей
+после коммита транзакции.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Author, Book, Category, Genre, Publisher, Review, Stationery, Wishlist
+
+
+# Пространство имен для данных, зависящих от каталога (книги, канцтовары, отзывы)
+CATALOG = 'catalog'
+
+# Сколько секунд хранить значения (страховка на случай пропущенного сигнала)
+DEFAULT_TIMEOUT = 60 * 60
+
+
+def cache_version(namespace):
+    """Текущая версия пространства имен"""
+    return cache.get_or_set(f'version:{namespace}', 1, timeout=None)
+
+
+def bump_cache_version(namespace):
+    """Увеличивает версию: все ключи пространства имен становятся неактуальными"""
+    key = f'version:{namespace}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Версия вытеснена из кэша или еще не создавалась
+        cache.add(key, 1, timeout=None)
+        cache.incr(key)
+
+
+def bump_catalog_on_commit():
+    """
+    Сбрасывает кэш каталога после коммита.
+
+    Для изменений остатков и резервов через update(): post_save они не вызывают,
+    а доступное количество выводится на закэшированных страницах каталога.
+    """
+    transaction.on_commit(lambda: bump_cache_version(CATALOG))
+
+
+def versioned_key(namespace, *parts):
+    """Ключ кэша с учетом текущей версии пространства имен"""
+    return ':'.join([namespace, str(cache_version(namespace)), *map(str, parts)])
+
+
+# --- Количество товаров в избранном ---
+
+def wishlist_count_key(user_id):
+    return f'wishlist_count:{user_id}'
+
+
+def get_wishlist_count(user):
+    """Количество товаров в избранном пользователя (кэшируется на пользователя)"""
+    key = wishlist_count_key(user.pk)
+    count = cache.get(key)
+    if count is None:
+        count = Wishlist.objects.filter(user=user).count()
+        cache.set(key, count, DEFAULT_TIMEOUT)
+    return count
+
+
+# --- Сброс кэша ---
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Publisher)
+@receiver(post_save, sender=Stationery)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Publisher)
+@receiver(post_delete, sender=Stationery)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Review)
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.genres.through)
+def invalidate_catalog_cache(sender, raw=False, action='post', **kwargs):
+    if raw or action.startswith('pre_'):
+        return
+    bump_catalog_on_commit()
+
+
+@receiver(post_save, sender=Wishlist)
+@receiver(post_delete, sender=Wishlist)
+def invalidate_wishlist_count(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    key = wishlist_count_key(instance.user_id)
+    transaction.on_commit(lambda: cache.delete(key))
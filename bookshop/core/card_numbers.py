@@ -0,0 +1,141 @@
+"""
+Номера карт лояльности
+
+Номер — 16 цифр: префикс LOYALTY_CARD_PREFIX, 14 цифр порядкового номера
+карты, пропущенного через перестановку, и контрольная цифра Луна.
+
+Перестановка — сеть Фейстеля на половинах по 7 цифр с раундовой функцией
+HMAC-SHA256 (ключ LOYALTY_CARD_KEY). Она взаимно однозначна, поэтому разные
+порядковые номера дают разные номера карт и проверять занятость номера в базе
+не нужно; без ключа по одному номеру не угадать соседние.
+
+Порядковые номера выдает последовательность PostgreSQL (SEQUENCE) блоками по
+LOYALTY_CARD_BLOCK_SIZE, так что большинство карт получает номер без запросов.
+nextval() не откатывается вместе с транзакцией, и параллельные покупки не ждут
+друг друга. На других СУБД (разработка) порядковый номер берется случайным,
+а совпадения отсекает уникальный индекс.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import connection
+
+
+SEQUENCE = 'core_loyalty_card_number_seq'
+
+_HALF = 10 ** 7
+_SPACE = _HALF * _HALF
+_ROUNDS = 8
+
+
+def _key():
+    return (settings.LOYALTY_CARD_KEY or settings.SECRET_KEY).encode()
+
+
+def _round_value(key, round_index, value):
+    digest = hmac.new(key, f'{round_index}:{value}'.encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:8], 'big') % _HALF
+
+
+def permute(number):
+    """Взаимно однозначная перестановка [0, 10^14)"""
+    key = _key()
+    left, right = divmod(number % _SPACE, _HALF)
+    for round_index in range(_ROUNDS):
+        left, right = right, (left + _round_value(key, round_index, right)) % _HALF
+    return left * _HALF + right
+
+
+def luhn_check_digit(digits):
+    """Контрольная цифра Луна для строки цифр"""
+    total = 0
+    for index, digit in enumerate(reversed(digits)):
+        value = int(digit)
+        if index % 2 == 0:
+            value *= 2
+            if value > 9:
+                value -= 9
+        total += value
+    return str((10 - total % 10) % 10)
+
+
+def is_valid(card_number):
+    """Номер из 16 цифр с верной контрольной цифрой"""
+    return (
+        len(card_number) == 16 and card_number.isdigit()
+        and luhn_check_digit(card_number[:-1]) == card_number[-1]
+    )
+
+
+def format_card_number(sequence_value):
+    """Номер карты для порядкового номера sequence_value"""
+    body = f'{settings.LOYALTY_CARD_PREFIX}{permute(sequence_value):014d}'
+    return body + luhn_check_digit(body)
+
+
+# --- Выдача порядковых номеров ---
+
+def _fetch(count):
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(%s) FROM generate_series(1, %s)', [SEQUENCE, count])
+            return [row[0] for row in cursor.fetchall()]
+    return [secrets.randbelow(_SPACE) for _ in range(count)]
+
+
+class _Allocator:
+    """Запас порядковых номеров процесса (пополняется блоками)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = deque()
+        self._pid = None
+
+    def take(self, count):
+        with self._lock:
+            if self._pid != os.getpid():
+                # После fork запас родителя достался бы обоим процессам
+                self._values.clear()
+                self._pid = os.getpid()
+            if len(self._values) < count:
+                self._values.extend(_fetch(max(count - len(self._values), settings.LOYALTY_CARD_BLOCK_SIZE)))
+            return [self._values.popleft() for _ in range(count)]
+
+
+_allocator = _Allocator()
+
+
+def card_numbers(count):
+    """count новых номеров карт (не больше одного запроса)"""
+    return [format_card_number(value) for value in _allocator.take(count)]
+
+
+def next_card_number():
+    return card_numbers(1)[0]
+
+
+def issue_cards(users, batch_size=1000):
+    """
+    Выпускает карты лояльности пользователям (bulk_create).
+
+    Пользователи, которые уже получили карту (в том числе параллельно,
+    при первой покупке), пропускаются.
+
+    Returns:
+        Количество выпущенных карт
+    """
+    from .models import LoyaltyCard
+
+    users = list(users)
+    numbers = card_numbers(len(users))
+    LoyaltyCard.objects.bulk_create(
+        [LoyaltyCard(user=user, card_number=number) for user, number in zip(users, numbers)],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+    return LoyaltyCard.objects.filter(card_number__in=numbers).count()
@@ -0,0 +1,356 @@
+"""
+Корзина в базе данных
+
+Строки корзины хранятся в CartLine, в сессии — только id корзины гостя
+(SESSION_KEY), поэтому изменение корзины обновляет одну строку таблицы, а не
+всю сессию. При входе корзина гостя объединяется с корзиной пользователя
+(обработчик user_logged_in).
+
+revalidate() сверяет строки с текущими товарами — по одному запросу на тип
+товара: удаляет исчезнувшие товары, обновляет цены и проверяет остатки.
+
+Количество в строке всегда зарезервировано (core.reservations): добавление и
+увеличение количества не проходят, если свободного товара не хватает.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.contrib.auth.signals import user_logged_in
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, F, Q, Sum
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Cart, CartLine
+from .reservations import PRODUCT_MODELS, extend_holds, move_holds, release_holds, set_hold
+
+
+SESSION_KEY = 'cart_id'
+
+# Корзина в сессии (JSON) до перехода на таблицы — переносится при обращении
+LEGACY_SESSION_KEY = 'cart'
+
+# Поля товара, нужные корзине: (название, изображение)
+_PRODUCT_FIELDS = {
+    'book': ('title', 'cover'),
+    'stationery': ('name', 'image'),
+}
+
+
+def get_product(product_type, pk):
+    """Товар с полями, нужными корзине, или None"""
+    model = PRODUCT_MODELS.get(product_type)
+    if model is None:
+        return None
+    fields = ('id', 'price', 'stock_quantity', 'reserved_quantity') + _PRODUCT_FIELDS[product_type]
+    return model.objects.filter(pk=pk).only(*fields).first()
+
+
+def product_name(product_type, product):
+    return getattr(product, _PRODUCT_FIELDS[product_type][0])
+
+
+# --- Корзина запроса ---
+
+def get_cart(request, create=False):
+    """
+    Корзина текущего посетителя.
+
+    Args:
+        request: HTTP request
+        create: Создать корзину, если ее еще нет
+
+    Returns:
+        Cart или None
+    """
+    user = request.user if request.user.is_authenticated else None
+    cart = None
+
+    cart_id = request.session.get(SESSION_KEY)
+    if cart_id:
+        cart = Cart.objects.filter(pk=cart_id, user=user).first()
+    if cart is None and user is not None:
+        cart = Cart.objects.filter(user=user).first()
+
+    legacy = request.session.pop(LEGACY_SESSION_KEY, None)
+    if cart is None and (create or legacy):
+        cart = Cart.objects.create(user=user)
+    if cart is not None and legacy:
+        for item in legacy.values():
+            add_line(cart, item['product_type'], item['product_id'], item['quantity'], Decimal(item['price']))
+
+    if cart is None:
+        request.session.pop(SESSION_KEY, None)
+    elif cart_id != cart.pk:
+        request.session[SESSION_KEY] = cart.pk
+    return cart
+
+
+def cart_totals(cart):
+    """(количество, сумма) корзины по сохраненным ценам строк — один запрос"""
+    if cart is None:
+        return 0, Decimal('0.00')
+    totals = CartLine.objects.filter(cart=cart).aggregate(
+        total_quantity=Sum('quantity'),
+        total=Sum(F('price') * F('quantity'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+    )
+    return totals['total_quantity'] or 0, totals['total'] or Decimal('0.00')
+
+
+def cart_quantity(request):
+    """Количество товаров в корзине посетителя (для шапки сайта)"""
+    cart_id = request.session.get(SESSION_KEY)
+    if not cart_id:
+        legacy = request.session.get(LEGACY_SESSION_KEY) or {}
+        return sum(item.get('quantity', 0) for item in legacy.values())
+    return CartLine.objects.filter(cart_id=cart_id).aggregate(total=Sum('quantity'))['total'] or 0
+
+
+@receiver(user_logged_in, dispatch_uid='merge_session_cart')
+def merge_session_cart(sender, request, user, **kwargs):
+    """Переносит корзину гостя в корзину пользователя при входе"""
+    if request is None or not hasattr(request, 'session'):
+        return
+    cart_id = request.session.get(SESSION_KEY)
+    guest_cart = Cart.objects.filter(pk=cart_id, user__isnull=True).first() if cart_id else None
+    user_cart = Cart.objects.filter(user=user).first()
+
+    if guest_cart is None:
+        if user_cart is None:
+            request.session.pop(SESSION_KEY, None)
+        else:
+            request.session[SESSION_KEY] = user_cart.pk
+        return
+
+    if user_cart is None:
+        guest_cart.user = user
+        guest_cart.save(update_fields=['user', 'updated_at'])
+        request.session[SESSION_KEY] = guest_cart.pk
+        return
+
+    merge_carts(guest_cart, user_cart)
+    request.session[SESSION_KEY] = user_cart.pk
+
+
+# --- Изменение строк ---
+
+def _line_filter(cart, product_type, product_id):
+    return CartLine.objects.filter(cart=cart, product_type=product_type, product_id=product_id)
+
+
+def _touch(cart):
+    # Время изменения нужно, чтобы удалять заброшенные корзины гостей (clear_carts)
+    Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now())
+
+
+def _add_line(cart, product_type, product_id, quantity, price):
+    line = _line_filter(cart, product_type, product_id).select_for_update().first()
+    total = quantity + (line.quantity if line else 0)
+    if not set_hold(cart, product_type, product_id, total):
+        return False
+    if line is None:
+        CartLine.objects.create(
+            cart=cart, product_type=product_type, product_id=product_id,
+            quantity=quantity, price=price,
+        )
+    else:
+        _line_filter(cart, product_type, product_id).update(quantity=total, price=price)
+    return True
+
+
+def add_line(cart, product_type, product_id, quantity, price):
+    """
+    Добавляет quantity единиц товара (или создает строку) и резервирует их.
+
+    Returns:
+        False, если свободного товара не хватает (корзина не изменилась)
+    """
+    try:
+        with transaction.atomic():
+            added = _add_line(cart, product_type, product_id, quantity, price)
+    except IntegrityError:
+        # Строку одновременно создал параллельный запрос — теперь она есть и блокируется
+        with transaction.atomic():
+            added = _add_line(cart, product_type, product_id, quantity, price)
+    if added:
+        _touch(cart)
+    return added
+
+
+@transaction.atomic
+def set_quantities(cart, quantities):
+    """
+    Меняет количество нескольких товаров сразу.
+
+    Args:
+        cart: Корзина
+        quantities: {(тип товара, id): количество}; 0 и меньше — удалить строку
+
+    Returns:
+        {(тип товара, id): CartLine или None для удаленных} — только товары,
+        которые были в корзине. Если свободного товара на увеличение не
+        хватило, строка возвращается с прежним количеством.
+    """
+    if not quantities:
+        return {}
+    query = Q()
+    for product_type, product_id in quantities:
+        query |= Q(product_type=product_type, product_id=product_id)
+    lines = {
+        (line.product_type, line.product_id): line
+        for line in cart.lines.filter(query).select_for_update()
+    }
+
+    # Резервы меняются в порядке (тип, id) — как и при оформлении заказа
+    result, to_update, to_delete = {}, [], []
+    for key, quantity in sorted(quantities.items()):
+        line = lines.get(key)
+        if line is None:
+            continue
+        if quantity <= 0:
+            set_hold(cart, *key, 0)
+            to_delete.append(line.pk)
+            result[key] = None
+        elif quantity == line.quantity or not set_hold(cart, *key, quantity):
+            result[key] = line
+        else:
+            line.quantity = quantity
+            to_update.append(line)
+            result[key] = line
+    if to_delete:
+        CartLine.objects.filter(pk__in=to_delete).delete()
+    if to_update:
+        CartLine.objects.bulk_update(to_update, ['quantity'])
+    _touch(cart)
+    return result
+
+
+@transaction.atomic
+def remove_line(cart, product_type, product_id):
+    _line_filter(cart, product_type, product_id).delete()
+    release_holds(cart, [(product_type, product_id)])
+    _touch(cart)
+
+
+@transaction.atomic
+def clear_cart(cart):
+    cart.lines.all().delete()
+    release_holds(cart)
+    _touch(cart)
+
+
+@transaction.atomic
+def merge_carts(source, target):
+    """Переносит строки source в target (количества складываются) и удаляет source"""
+    existing = {(line.product_type, line.product_id): line for line in target.lines.all()}
+    to_update, to_create = [], []
+    for line in source.lines.all():
+        current = existing.get((line.product_type, line.product_id))
+        if current is None:
+            to_create.append(CartLine(
+                cart=target, product_type=line.product_type, product_id=line.product_id,
+                quantity=line.quantity, price=line.price,
+            ))
+        else:
+            current.quantity += line.quantity
+            current.price = line.price
+            to_update.append(current)
+    CartLine.objects.bulk_update(to_update, ['quantity', 'price'])
+    CartLine.objects.bulk_create(to_create)
+    move_holds(source, target)
+    source.delete()
+    _touch(target)
+
+
+# --- Проверка ---
+
+def _load_products(lines):
+    """{(тип, id): товар} — один запрос на тип товара"""
+    ids = defaultdict(list)
+    for line in lines:
+        ids[line.product_type].append(line.product_id)
+    products = {}
+    for product_type, product_ids in ids.items():
+        model = PRODUCT_MODELS.get(product_type)
+        if model is None:
+            continue
+        fields = ('id', 'price', 'stock_quantity', 'reserved_quantity') + _PRODUCT_FIELDS[product_type]
+        for product in model.objects.filter(pk__in=product_ids).only(*fields):
+            products[(product_type, product.pk)] = product
+    return products
+
+
+def revalidate(cart):
+    """
+    Сверяет корзину с текущими товарами.
+
+    Строки исчезнувших товаров удаляются, цены строк обновляются до текущих.
+    Истекшие или неполные резервы возобновляются, остальные продлеваются;
+    у строк, которые не удалось зарезервировать целиком, in_stock=False.
+
+    Returns:
+        (items, total, total_quantity, changes): строки для шаблона, сумма,
+        количество и сообщения об удаленных строках и изменившихся ценах
+    """
+    items = []
+    changes = []
+    total = Decimal('0.00')
+    total_quantity = 0
+    if cart is None:
+        return items, total, total_quantity, changes
+
+    lines = list(cart.lines.all())
+    products = _load_products(lines)
+    holds = {
+        (product_type, product_id): quantity
+        for product_type, product_id, quantity in cart.holds.values_list('product_type', 'product_id', 'quantity')
+    }
+    removed, removed_keys, repriced = [], [], []
+
+    for line in lines:
+        product = products.get((line.product_type, line.product_id))
+        if product is None:
+            removed.append(line.pk)
+            removed_keys.append((line.product_type, line.product_id))
+            changes.append('Один из товаров больше не продается и удален из корзины')
+            continue
+
+        name_field, image_field = _PRODUCT_FIELDS[line.product_type]
+        name = getattr(product, name_field)
+        image = getattr(product, image_field)
+
+        if product.price != line.price:
+            changes.append(f'Цена товара "{name}" изменилась: {line.price} → {product.price} ₽')
+            line.price = product.price
+            repriced.append(line)
+
+        # Свободно для этой корзины: остаток минус чужие резервы
+        held = holds.get((line.product_type, line.product_id), 0)
+        available = product.stock_quantity - product.reserved_quantity + held
+        if held != line.quantity and set_hold(cart, line.product_type, line.product_id, line.quantity):
+            held = line.quantity
+
+        subtotal = line.price * line.quantity
+        total += subtotal
+        total_quantity += line.quantity
+        items.append({
+            'key': f'{line.product_type}:{line.product_id}',
+            'product_type': line.product_type,
+            'product_id': line.product_id,
+            'name': name,
+            'price': line.price,
+            'quantity': line.quantity,
+            'subtotal': subtotal,
+            'image': image.url if image else None,
+            'stock': max(available, 0),
+            'in_stock': held >= line.quantity,
+        })
+
+    if removed:
+        CartLine.objects.filter(pk__in=removed).delete()
+        release_holds(cart, removed_keys)
+    if repriced:
+        CartLine.objects.bulk_update(repriced, ['price'])
+    if items:
+        extend_holds(cart)
+    return items, total, total_quantity, changes
@@ -0,0 +1,177 @@
+"""
+Оформление заказа
+
+place_order() выполняет заказ в одной транзакции:
+    1. блокирует строки и резервы корзины и списывает остатки товаров условным
+       UPDATE (свободный остаток с учетом своего резерва >= количество), переводя
+       резерв корзины в продажу; если какого-то товара не хватило, транзакция
+       откатывается целиком;
+    2. списывает бонусы с карты лояльности покупателя (условным UPDATE);
+    3. создает заказ и его строки (bulk_create);
+    4. записывает письмо с подтверждением в очередь писем (core.outbox) и
+       ставит начисление бонусов в очередь задач (core.tasks) — они выполнятся
+       только после коммита заказа.
+
+Остатки списываются в порядке (тип товара, id), поэтому параллельные заказы
+блокируют строки товаров в одном порядке и не ждут друг друга по кругу.
+
+Ключ идемпотентности (CheckoutKey) вставляется первым в транзакции: повторная
+отправка формы ждет на уникальном индексе, пока первая не завершится, и
+получает DuplicateCheckout с уже созданным заказом, ничего не изменив.
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.template.loader import render_to_string
+
+from .audit import explicit_audit
+from .caching import bump_catalog_on_commit
+from .jobs import enqueue
+from .models import CheckoutKey, LoyaltyCard, Order, OrderItem, StockHold
+from .outbox import queue_email
+from .reservations import PRODUCT_MODELS
+
+
+class OutOfStock(Exception):
+    """Товара не хватило на складе в момент оформления"""
+
+    def __init__(self, name):
+        self.name = name
+        super().__init__(f'Товара "{name}" недостаточно на складе. Измените количество в корзине.')
+
+
+class DuplicateCheckout(Exception):
+    """Заказ с этим ключом идемпотентности уже создан"""
+
+    def __init__(self, order_id):
+        self.order_id = order_id
+        super().__init__(f'Заказ #{order_id} уже оформлен')
+
+
+def existing_order_id(key):
+    """id заказа, созданного с ключом идемпотентности key, или None"""
+    if not key:
+        return None
+    return CheckoutKey.objects.filter(key=key, order__isnull=False).values_list('order_id', flat=True).first()
+
+
+def _claim_key(key):
+    """Занимает ключ идемпотентности или выбрасывает DuplicateCheckout"""
+    try:
+        with transaction.atomic():
+            return CheckoutKey.objects.create(key=key)
+    except IntegrityError:
+        # Ключ занят транзакцией, которая уже завершилась, — заказ создан ею
+        raise DuplicateCheckout(existing_order_id(key))
+
+
+def queue_order_confirmation(order):
+    """Письмо покупателю с составом заказа — в очередь писем"""
+    queue_email(
+        subject=f'Заказ #{order.pk} оформлен — Lexicon',
+        body=render_to_string('emails/order_confirmation.txt', {'order': order}),
+        to=[order.email],
+    )
+
+
+def decrement_stock(items, held=None):
+    """
+    Списывает остатки по строкам корзины или выбрасывает OutOfStock.
+
+    Args:
+        items: Строки корзины
+        held: {(тип товара, id): количество} — резервы корзины, которые
+            переходят в продажу и снимаются с reserved_quantity
+    """
+    held = held or {}
+    for item in sorted(items, key=lambda item: (item['product_type'], item['product_id'])):
+        model = PRODUCT_MODELS[item['product_type']]
+        reserved = held.get((item['product_type'], item['product_id']), 0)
+        updated = model.objects.filter(
+            pk=item['product_id'],
+            stock_quantity__gte=F('reserved_quantity') - reserved + item['quantity'],
+        ).update(
+            stock_quantity=F('stock_quantity') - item['quantity'],
+            reserved_quantity=Greatest(F('reserved_quantity') - reserved, Value(0)),
+        )
+        if not updated:
+            raise OutOfStock(item['name'])
+    # Доступное количество выводится на закэшированных страницах каталога
+    bump_catalog_on_commit()
+
+
+@transaction.atomic
+def place_order(items, amount, order_fields, user=None, use_bonuses=Decimal('0'), cart=None, key=None):
+    """
+    Создает заказ.
+
+    Args:
+        items: Строки корзины (core.cart.revalidate)
+        amount: Сумма заказа с доставкой, до списания бонусов
+        order_fields: Поля Order, кроме user и total_amount
+        user: Покупатель (None — гость; бонусы не списываются и не начисляются)
+        use_bonuses: Сколько бонусов покупатель хочет списать
+        cart: Корзина, резервы которой переходят в заказ
+        key: Ключ идемпотентности из формы оформления
+
+    Returns:
+        (order, списано бонусов, будет начислено бонусов, создана ли карта лояльности)
+
+    Raises:
+        OutOfStock: товара не хватило
+        DuplicateCheckout: заказ с ключом key уже создан
+    """
+    claim = _claim_key(key) if key else None
+
+    holds = []
+    if cart is not None:
+        # Строки и резервы блокируются раньше товаров — порядок core.reservations
+        list(cart.lines.select_for_update().order_by('pk').values_list('pk', flat=True))
+        keys = {(item['product_type'], item['product_id']) for item in items}
+        holds = [
+            hold for hold in StockHold.objects.select_for_update().filter(cart=cart).order_by('pk')
+            if (hold.product_type, hold.product_id) in keys
+        ]
+    decrement_stock(items, {(hold.product_type, hold.product_id): hold.quantity for hold in holds})
+    StockHold.objects.filter(pk__in=[hold.pk for hold in holds]).delete()
+
+    used_bonuses = bonus = Decimal('0')
+    card, card_created = None, False
+    if user is not None:
+        # Карта создается при первой покупке
+        card, card_created = LoyaltyCard.objects.get_or_create(user=user)
+        spend = min(Decimal(str(use_bonuses)), amount)
+        if spend > 0 and card.spend_bonus(spend):
+            used_bonuses = spend
+        # Начисляет задача accrue_loyalty ровно эту сумму (процент — по сумме покупок на момент заказа)
+        bonus = card.calculate_bonus(amount)
+
+    # Создание заказа записывается в журнал вызывающим кодом (с суммой и способом получения)
+    with explicit_audit():
+        order = Order.objects.create(
+            user=user,
+            total_amount=max(Decimal('0'), amount - used_bonuses),
+            **order_fields,
+        )
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            product_type=item['product_type'],
+            product_id=item['product_id'],
+            name=item['name'],
+            unit_price=item['price'],
+            quantity=item['quantity'],
+            subtotal=item['subtotal'],
+        )
+        for item in items
+    ])
+    if claim is not None:
+        claim.order = order
+        claim.save(update_fields=['order'])
+
+    queue_order_confirmation(order)
+    if card is not None:
+        enqueue('accrue_loyalty', card_id=card.pk, amount=str(amount), bonus=str(bonus), order_id=order.pk)
+    return order, used_bonuses, bonus, card_created
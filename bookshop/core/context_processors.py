@@ -1,68 +1,108 @@
 from decimal import Decimal
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.db import connection, OperationalError, ProgrammingError
 
+from .caching import CATALOG, DEFAULT_TIMEOUT, get_wishlist_count, versioned_key
+from .page_cache import SKELETON_CSRF_TOKEN, is_skeleton_request
+
+
+def _lazy(func):
+    """
+    Значение, которое вычисляется только при обращении из шаблона.
+
+    Шаблоны Django вызывают callable-переменные сами; результат запоминается,
+    чтобы повторные обращения на странице не выполняли запрос снова.
+    """
+    result = []
+
+    def value():
+        if not result:
+            result.append(func())
+        return result[0]
+
+    return value
+
 
 def cart_context(request):
     """Context processor для корзины - доступен во всех шаблонах"""
-    cart = request.session.get("cart", {})
-    total_quantity = 0
-    
-    for item in cart.values():
-        total_quantity += item.get("quantity", 0)
-    
+    if is_skeleton_request(request):
+        # Общая для всех страница: количество подставит скрипт (personalization)
+        return {'cart_total_quantity': 0}
+
+    from .cart import cart_quantity
+
+    # Один запрос к строкам корзины и только если шаблон выводит количество
     return {
-        'cart_total_quantity': total_quantity,
+        'cart_total_quantity': _lazy(lambda: cart_quantity(request)),
     }
 
 
 def wishlist_context(request):
     """Context processor для избранного - доступен во всех шаблонах"""
-    wishlist_count = 0
-    
-    # Проверяем, существует ли таблица wishlist и пользователь авторизован
-    if request.user.is_authenticated:
+
+    def wishlist_count():
+        # Проверяем, существует ли таблица wishlist и пользователь авторизован
+        if not request.user.is_authenticated:
+            return 0
         try:
-            # Пытаемся получить количество элементов избранного
-            # Если таблица не существует, это вызовет ProgrammingError
-            wishlist_count = request.user.wishlist_items.count()
+            # Количество кэшируется на пользователя и сбрасывается сигналами Wishlist
+            return get_wishlist_count(request.user)
         except (ProgrammingError, OperationalError):
             # Таблица еще не создана (миграции не применены)
             # Просто возвращаем 0, чтобы не ломать сайт
-            wishlist_count = 0
+            return 0
         except Exception:
             # Любая другая ошибка - тоже возвращаем 0
-            wishlist_count = 0
-    
+            return 0
+
     return {
-        'wishlist_count': wishlist_count,
+        'wishlist_count': _lazy(wishlist_count),
     }
 
 
-def categories_context(request):
-    """Context processor для категорий - доступен во всех шаблонах"""
+def _catalog_counts():
     from .models import Book, Genre, Author, Publisher
-    
+
+    key = versioned_key(CATALOG, 'counts')
+    counts = cache.get(key)
+    if counts is not None:
+        return counts
     try:
-        books_count = Book.objects.count()
-        genres_count = Genre.objects.count()
-        authors_count = Author.objects.count()
-        publishers_count = Publisher.objects.count()
+        counts = {
+            'books_count': Book.objects.count(),
+            'genres_count': Genre.objects.count(),
+            'authors_count': Author.objects.count(),
+            'publishers_count': Publisher.objects.count(),
+        }
     except (ProgrammingError, OperationalError):
-        books_count = 0
-        genres_count = 0
-        authors_count = 0
-        publishers_count = 0
+        return dict.fromkeys(('books_count', 'genres_count', 'authors_count', 'publishers_count'), 0)
     except Exception:
-        books_count = 0
-        genres_count = 0
-        authors_count = 0
-        publishers_count = 0
-    
+        return dict.fromkeys(('books_count', 'genres_count', 'authors_count', 'publishers_count'), 0)
+    cache.set(key, counts, DEFAULT_TIMEOUT)
+    return counts
+
+
+def categories_context(request):
+    """Context processor для категорий - доступен во всех шаблонах"""
+    # Счетчики берутся из кэша каталога (версия сбрасывается сигналами моделей)
+    # и только если шаблон к ним обращается
+    counts = _lazy(_catalog_counts)
+
     return {
-        'books_count': books_count,
-        'genres_count': genres_count,
-        'authors_count': authors_count,
-        'publishers_count': publishers_count,
+        'books_count': _lazy(lambda: counts()['books_count']),
+        'genres_count': _lazy(lambda: counts()['genres_count']),
+        'authors_count': _lazy(lambda: counts()['authors_count']),
+        'publishers_count': _lazy(lambda: counts()['publishers_count']),
     }
 
+
+def page_skeleton_context(request):
+    """Context processor для страниц, кэшируемых целиком (см. core.page_cache)"""
+    if not is_skeleton_request(request):
+        return {'page_skeleton': False}
+    # Токен конкретного посетителя в общий HTML не попадает
+    return {
+        'page_skeleton': True,
+        'csrf_token': SKELETON_CSRF_TOKEN,
+    }
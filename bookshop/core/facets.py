@@ -0,0 +1,236 @@
+"""
+Фасеты каталога книг
+
+Для произвольного набора книг (жанр, автор, поиск, ...) считает, сколько книг
+приходится на каждый жанр, автора, издателя, год и ценовой диапазон.
+Все группировки объединяются через UNION ALL и выполняются одним запросом;
+в тот же запрос входит общее количество книг набора.
+
+Выбранные значения фасетов передаются GET-параметрами (?genre=1&year=2001)
+и применяются к набору через apply_facet_filters.
+"""
+from django.conf import settings
+from django.db.models import Case, CharField, Count, F, IntegerField, Q, Value, When
+from django.db.models.functions import Coalesce, Concat
+
+from .models import Book
+
+
+FACET_PARAMS = ('genre', 'author', 'publisher', 'year', 'price')
+
+
+class FacetValue:
+    """Значение фасета с количеством книг"""
+
+    def __init__(self, key, label, count, selected=False):
+        self.key = key
+        self.label = label
+        self.count = count
+        self.selected = selected
+        self.url = ''
+
+
+class Facets:
+    """Результат подсчета фасетов для набора книг"""
+
+    def __init__(self, total=0, selected=None):
+        self.total = total
+        self.selected = selected or {}
+        self.genres = []
+        self.authors = []
+        self.publishers = []
+        self.years = []
+        self.prices = []
+
+    @property
+    def has_selected(self):
+        return bool(self.selected)
+
+    @property
+    def groups(self):
+        """Группы для шаблона: (заголовок, параметр, значения)"""
+        return [
+            ('Жанры', 'genre', self.genres),
+            ('Авторы', 'author', self.authors),
+            ('Издатели', 'publisher', self.publishers),
+            ('Год издания', 'year', self.years),
+            ('Цена', 'price', self.prices),
+        ]
+
+    def build_urls(self, params):
+        """
+        Проставляет значениям ссылки для уточнения выборки.
+
+        Ссылка выбирает значение или снимает его, если оно уже выбрано;
+        остальные параметры запроса сохраняются, курсор страницы сбрасывается.
+        """
+        base = params.copy()
+        base.pop('cursor', None)
+        # Некорректные значения фасетов в ссылки не переносим
+        for param in FACET_PARAMS:
+            if param not in self.selected:
+                base.pop(param, None)
+
+        for _, param, values in self.groups:
+            for value in values:
+                query = base.copy()
+                if value.selected:
+                    query.pop(param, None)
+                else:
+                    query[param] = str(value.key)
+                value.url = '?' + query.urlencode()
+        return self
+
+
+# --- Ценовые диапазоны ---
+
+def price_bounds():
+    """Границы ценовых диапазонов (settings.FACET_PRICE_BOUNDS)"""
+    return sorted(settings.FACET_PRICE_BOUNDS)
+
+
+def price_bucket_label(bucket, bounds):
+    if not bounds:
+        return 'Любая цена'
+    if bucket == 0:
+        return f'до {bounds[0]} ₽'
+    if bucket >= len(bounds):
+        return f'от {bounds[-1]} ₽'
+    return f'{bounds[bucket - 1]}–{bounds[bucket]} ₽'
+
+
+def price_bucket_condition(bucket, bounds):
+    """Условие фильтра для ценового диапазона с номером bucket"""
+    condition = Q()
+    if bucket > 0:
+        condition &= Q(price__gte=bounds[bucket - 1])
+    if bucket < len(bounds):
+        condition &= Q(price__lt=bounds[bucket])
+    return condition
+
+
+def price_bucket_expression(bounds):
+    """Номер ценового диапазона книги: 0 — дешевле первой границы"""
+    if not bounds:
+        return Value(0, output_field=IntegerField())
+    return Case(
+        *[When(price__lt=bound, then=Value(bucket)) for bucket, bound in enumerate(bounds)],
+        default=Value(len(bounds)),
+        output_field=IntegerField(),
+    )
+
+
+# --- Фильтрация ---
+
+def apply_facet_filters(books, params):
+    """
+    Применяет выбранные значения фасетов из GET-параметров.
+
+    Returns:
+        (queryset, selected) — selected: {параметр: значение} для корректных значений
+    """
+    selected = {}
+    for param in FACET_PARAMS:
+        try:
+            value = int(params.get(param, ''))
+        except (TypeError, ValueError):
+            continue
+        selected[param] = value
+
+    if 'genre' in selected:
+        books = books.filter(genres=selected['genre'])
+    if 'author' in selected:
+        books = books.filter(authors=selected['author'])
+    if 'publisher' in selected:
+        books = books.filter(publisher_id=selected['publisher'])
+    if 'year' in selected:
+        books = books.filter(publication_year=selected['year'])
+    if 'price' in selected:
+        bounds = price_bounds()
+        if 0 <= selected['price'] <= len(bounds):
+            books = books.filter(price_bucket_condition(selected['price'], bounds))
+        else:
+            del selected['price']
+    return books, selected
+
+
+# --- Подсчет ---
+
+def _facet_rows(queryset, kind, key, label):
+    """Группировка queryset по key в формате строк (kind, key, label, count)"""
+    return queryset.values_list(
+        Value(kind, output_field=CharField()),
+        key,
+        label,
+    ).annotate(count=Count('*')).order_by()
+
+
+def facet_counts_queryset(books):
+    """Один запрос (UNION ALL) с количеством книг по каждому значению фасетов"""
+    book_ids = books.order_by().values('pk')
+    in_books = Book.objects.filter(pk__in=book_ids)
+    empty_label = Value('', output_field=CharField())
+
+    total = _facet_rows(in_books, 'total', Value(0, output_field=IntegerField()), empty_label)
+    genres = _facet_rows(
+        Book.genres.through.objects.filter(book_id__in=book_ids),
+        'genre', F('genre_id'), F('genre__name'),
+    )
+    authors = _facet_rows(
+        Book.authors.through.objects.filter(book_id__in=book_ids),
+        'author', F('author_id'),
+        Concat(
+            'author__last_name', Value(' '), 'author__first_name', Value(' '),
+            Coalesce('author__middle_name', Value('')),
+            output_field=CharField(),
+        ),
+    )
+    publishers = _facet_rows(
+        in_books.filter(publisher__isnull=False), 'publisher', F('publisher_id'), F('publisher__name'),
+    )
+    years = _facet_rows(
+        in_books.filter(publication_year__isnull=False), 'year', F('publication_year'), empty_label,
+    )
+    prices = _facet_rows(in_books, 'price', price_bucket_expression(price_bounds()), empty_label)
+    return total.union(genres, authors, publishers, years, prices, all=True)
+
+
+def compute_facets(books, selected=None, params=None):
+    """
+    Считает фасеты для набора книг.
+
+    Args:
+        books: Набор книг (QuerySet)
+        selected: Выбранные значения (см. apply_facet_filters)
+        params: GET-параметры запроса для построения ссылок (FacetValue.url)
+    """
+    selected = selected or {}
+    facets = Facets(selected=selected)
+    bounds = price_bounds()
+    groups = {
+        'genre': facets.genres,
+        'author': facets.authors,
+        'publisher': facets.publishers,
+        'year': facets.years,
+        'price': facets.prices,
+    }
+
+    for kind, key, label, count in facet_counts_queryset(books):
+        if kind == 'total':
+            facets.total = count
+            continue
+        if kind == 'year':
+            label = str(key)
+        elif kind == 'price':
+            label = price_bucket_label(key, bounds)
+        else:
+            label = ' '.join(label.split())
+        groups[kind].append(FacetValue(key, label, count, selected=selected.get(kind) == key))
+
+    for kind in ('genre', 'author', 'publisher'):
+        groups[kind].sort(key=lambda value: (-value.count, value.label))
+    facets.years.sort(key=lambda value: value.key, reverse=True)
+    facets.prices.sort(key=lambda value: value.key)
+    if params is not None:
+        facets.build_urls(params)
+    return facets
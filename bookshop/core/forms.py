@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm, PasswordResetForm
 from django.contrib.auth import get_user_model
+from django.template import loader
 
 from .models import DeliveryOption, Order, PickupPoint, Review, SavedAddress, PaymentCard, Role
 
@@ -57,6 +58,8 @@ class CheckoutForm(forms.Form):
     new_card_expiry_year = forms.IntegerField(min_value=2024, max_value=2100, required=False, label="Год", widget=forms.NumberInput(attrs={"class": "form-control"}))
     new_card_cvv = forms.CharField(max_length=4, required=False, label="CVV", widget=forms.TextInput(attrs={"class": "form-control", "type": "password"}))
     comment = forms.CharField(required=False, label="Комментарий к заказу", widget=forms.Textarea(attrs={"class": "form-control", "rows": 3}))
+    # Ключ идемпотентности: повторная отправка формы не создает второй заказ
+    idempotency_key = forms.CharField(max_length=64, required=False, widget=forms.HiddenInput())
 
     def __init__(self, *args, **kwargs):
         user = kwargs.pop("user", None)
@@ -260,6 +263,18 @@ class CustomPasswordResetForm(PasswordResetForm):
         active_users = User.objects.filter(email__iexact=email, is_active=True)
         return (u for u in active_users if u.has_usable_password())
 
+    def send_mail(self, subject_template_name, email_template_name, context, from_email, to_email,
+                  html_email_template_name=None):
+        """Письмо со ссылкой сброса ставится в очередь (core.outbox), а не отправляется в запросе"""
+        from .outbox import queue_email
+        queue_email(
+            subject=loader.render_to_string(subject_template_name, context),
+            body=loader.render_to_string(email_template_name, context),
+            to=[to_email],
+            from_email=from_email,
+            html_body=loader.render_to_string(html_email_template_name, context) if html_email_template_name else '',
+        )
+
 
 # Формы для админки
 class CustomUserCreationForm(UserCreationForm):
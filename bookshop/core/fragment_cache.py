@@ -0,0 +1,118 @@
+"""
+Кэш HTML-фрагментов карточек книг
+
+Ключ фрагмента содержит Book.version, поэтому устаревшие фрагменты не
+нужно удалять: после изменения книги ее версия увеличивается и старый ключ
+больше не читается. Версия увеличивается при сохранении книги, изменении ее
+авторов/жанров, а также вместе с рейтингом при изменении отзывов (core.ratings).
+
+Фрагменты страницы загружаются из кэша одним get_many (prefetch_book_cards),
+шаблонный тег {% bookcard %} рендерит только недостающие. Попадания и промахи
+считаются в кэше (одно обращение на страницу); посмотреть их можно командой
+fragment_cache_stats.
+"""
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+
+from .models import Book
+
+
+# Сколько секунд хранить фрагмент (старые версии вытесняются сами)
+FRAGMENT_TIMEOUT = 24 * 60 * 60
+
+STATS_KEYS = {
+    'hits': 'fragment_stats:book_card:hits',
+    'misses': 'fragment_stats:book_card:misses',
+}
+
+
+def card_key(book, variant):
+    return f'book_card:{variant}:{book.pk}:{book.version}'
+
+
+def prefetch_book_cards(books, variant):
+    """Загружает фрагменты карточек для списка книг одним запросом к кэшу"""
+    books = list(books)
+    if not books:
+        return books
+    fragments = cache.get_many([card_key(book, variant) for book in books])
+    for book in books:
+        book._card_fragments = {variant: fragments.get(card_key(book, variant))}
+    record_card_stats(hits=len(fragments), misses=len(books) - len(fragments))
+    return books
+
+
+def get_card_fragment(book, variant):
+    """Фрагмент из prefetch_book_cards или из кэша (None — нужно отрендерить)"""
+    prefetched = getattr(book, '_card_fragments', None)
+    if prefetched is not None and variant in prefetched:
+        return prefetched[variant]
+    html = cache.get(card_key(book, variant))
+    record_card_stats(hits=int(html is not None), misses=int(html is None))
+    return html
+
+
+def set_card_fragment(book, variant, html):
+    cache.set(card_key(book, variant), html, FRAGMENT_TIMEOUT)
+
+
+# --- Статистика ---
+
+def record_card_stats(hits=0, misses=0):
+    for name, count in (('hits', hits), ('misses', misses)):
+        if not count:
+            continue
+        key = STATS_KEYS[name]
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            if not cache.add(key, count, timeout=None):
+                cache.incr(key, count)
+
+
+def card_stats():
+    """{'hits': ..., 'misses': ..., 'hit_rate': доля попаданий 0..1}"""
+    values = cache.get_many(STATS_KEYS.values())
+    hits = values.get(STATS_KEYS['hits'], 0)
+    misses = values.get(STATS_KEYS['misses'], 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0}
+
+
+def reset_card_stats():
+    cache.delete_many(STATS_KEYS.values())
+
+
+# --- Версии карточек ---
+
+def bump_book_versions(book_ids):
+    """Увеличивает версию карточек книг (старые фрагменты перестают читаться)"""
+    book_ids = [pk for pk in book_ids if pk is not None]
+    if book_ids:
+        Book.objects.filter(pk__in=book_ids).update(version=F('version') + 1)
+
+
+@receiver(post_save, sender=Book)
+def bump_saved_book_version(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # update() не вызывает сигналы, поэтому рекурсии нет
+    bump_book_versions([instance.pk])
+    instance.refresh_from_db(fields=['version'])
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.genres.through)
+def bump_book_version_on_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            bump_book_versions([instance.pk])
+        return
+    if action == 'pre_clear':
+        instance._card_affected_books = list(instance.books.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        bump_book_versions(getattr(instance, '_card_affected_books', []))
+    elif action in ('post_add', 'post_remove'):
+        bump_book_versions(pk_set)
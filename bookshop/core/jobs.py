@@ -0,0 +1,272 @@
+"""
+Очередь фоновых задач в базе данных
+
+enqueue() добавляет строку Job в текущей транзакции: задача выполнится,
+только если транзакция запроса закоммичена, и не потеряется при перезапуске
+процесса. Обработчики (команда run_workers) забирают задачи пачками через
+SELECT ... FOR UPDATE SKIP LOCKED, поэтому несколько потоков и процессов не
+получают одну задачу и не ждут друг друга.
+
+Обработчик задачи и отметка о ее выполнении — одна транзакция: изменения
+в базе, сделанные задачей, применяются ровно один раз. Внешние действия
+(отправка письма) при сбое между ними могут повториться.
+
+Неудачная попытка откладывается на JOB_RETRY_DELAY * 2^(попытка-1) секунд
+(не больше JOB_RETRY_MAX_DELAY); после max_attempts попыток задача получает
+статус failed и остается в таблице для разбора (dead letter). Задачи,
+обработчик которых пропал дольше JOB_LOCK_TIMEOUT секунд, возвращаются
+в очередь или, если попытки исчерпаны, получают статус failed (requeue_stale).
+
+Задачи регистрируются декоратором:
+
+    @register('log_order_created')
+    def log_order_created(order_id): ...
+
+    enqueue('log_order_created', order_id=order.pk)
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+class LostJobLock(Exception):
+    """Задачу, пока она выполнялась, забрал другой обработчик"""
+
+
+def register(name):
+    """Декоратор: регистрирует функцию как обработчик задачи name"""
+    def decorator(func):
+        _handlers[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, delay=None, max_attempts=None, **payload):
+    """
+    Ставит задачу в очередь (в текущей транзакции).
+
+    Args:
+        name: Имя зарегистрированной задачи
+        delay: Отложить выполнение (timedelta)
+        max_attempts: Сколько попыток (по умолчанию JOB_MAX_ATTEMPTS)
+        **payload: Аргументы обработчика (JSON-совместимые)
+    """
+    if name not in _handlers:
+        raise ValueError(f'Неизвестная задача: {name}')
+    return Job.objects.create(
+        name=name,
+        payload=payload,
+        run_at=timezone.now() + (delay or timedelta()),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+    )
+
+
+def retry_delay(attempts):
+    """Пауза перед следующей попыткой: экспонента с разбросом ±20%"""
+    delay = min(settings.JOB_RETRY_DELAY * 2 ** (attempts - 1), settings.JOB_RETRY_MAX_DELAY)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+# --- Выполнение ---
+
+def claim(worker_id, batch_size=10):
+    """Забирает до batch_size готовых задач и помечает их выполняемыми"""
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.Status.PENDING, run_at__lte=now)
+            .order_by('run_at', 'pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        Job.objects.filter(pk__in=ids).update(
+            status=Job.Status.RUNNING, locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1,
+        )
+    return list(Job.objects.filter(pk__in=ids, locked_by=worker_id, locked_at=now).order_by('run_at', 'pk'))
+
+
+def execute(job):
+    """
+    Выполняет захваченную задачу.
+
+    Returns:
+        Итоговый статус задачи (Job.Status)
+    """
+    mine = Job.objects.filter(pk=job.pk, status=Job.Status.RUNNING, locked_by=job.locked_by, locked_at=job.locked_at)
+    try:
+        handler = _handlers.get(job.name)
+        if handler is None:
+            raise LookupError(f'Неизвестная задача: {job.name}')
+        with transaction.atomic():
+            handler(**job.payload)
+            finished = mine.update(status=Job.Status.DONE, finished_at=timezone.now(), last_error='')
+            if not finished:
+                # Задача вернулась в очередь (requeue_stale) — ее изменения откатываются
+                raise LostJobLock(job.pk)
+        return Job.Status.DONE
+    except LostJobLock:
+        logger.warning('Задача %s #%s выполнялась дольше JOB_LOCK_TIMEOUT и отменена', job.name, job.pk)
+        return Job.Status.PENDING
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error('Задача %s #%s не выполнена за %d попыток', job.name, job.pk, job.attempts)
+            mine.update(status=Job.Status.FAILED, finished_at=timezone.now(), last_error=error)
+            return Job.Status.FAILED
+        logger.warning('Задача %s #%s: ошибка, попытка %d из %d', job.name, job.pk, job.attempts, job.max_attempts)
+        mine.update(status=Job.Status.PENDING, run_at=timezone.now() + retry_delay(job.attempts), last_error=error)
+        return Job.Status.PENDING
+
+
+def release(jobs):
+    """Возвращает захваченные, но не начатые задачи в очередь (при остановке)"""
+    Job.objects.filter(pk__in=[job.pk for job in jobs], status=Job.Status.RUNNING).update(
+        status=Job.Status.PENDING, attempts=F('attempts') - 1, locked_by='', locked_at=None,
+    )
+
+
+def requeue_stale():
+    """
+    Возвращает в очередь задачи, обработчик которых не завершился за JOB_LOCK_TIMEOUT.
+
+    Задача, исчерпавшая попытки (например, каждый раз роняющая обработчик),
+    получает статус failed.
+
+    Returns:
+        Количество задач, возвращенных в очередь
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.Status.RUNNING, locked_at__lt=now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.Status.FAILED, finished_at=now, locked_by='',
+        last_error=f'Обработчик не завершил задачу за {settings.JOB_LOCK_TIMEOUT} с',
+    )
+    if failed:
+        logger.error('Зависшие задачи исчерпали попытки и получили статус failed: %d', failed)
+    return stale.update(status=Job.Status.PENDING, run_at=now, locked_by='')
+
+
+def retry_failed(ids=None):
+    """Возвращает задачи из failed в очередь с новым набором попыток"""
+    jobs = Job.objects.filter(status=Job.Status.FAILED)
+    if ids:
+        jobs = jobs.filter(pk__in=ids)
+    return jobs.update(status=Job.Status.PENDING, attempts=0, run_at=timezone.now(), finished_at=None)
+
+
+def purge_finished(days):
+    """Удаляет выполненные задачи старше days дней"""
+    deleted, _ = Job.objects.filter(
+        status=Job.Status.DONE, finished_at__lt=timezone.now() - timedelta(days=days),
+    ).delete()
+    return deleted
+
+
+# --- Обработчик ---
+
+class Worker:
+    """
+    Цикл обработки задач в одном потоке.
+
+    Args:
+        name: Имя обработчика (для locked_by)
+        stop_event: threading.Event, по которому цикл завершается
+        batch_size: Сколько задач забирать за раз
+        poll_interval: Пауза, когда очередь пуста, секунды
+        once: Выйти, когда очередь опустела
+    """
+
+    def __init__(self, name, stop_event, batch_size=10, poll_interval=1.0, once=False):
+        self.name = name
+        self.stop_event = stop_event
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.once = once
+        self.counters = {Job.Status.DONE: 0, Job.Status.PENDING: 0, Job.Status.FAILED: 0}
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                close_old_connections()
+                try:
+                    jobs = claim(self.name, self.batch_size)
+                except Exception:
+                    logger.exception('Обработчик %s: не удалось получить задачи', self.name)
+                    connection.close()
+                    jobs = []
+                for index, job in enumerate(jobs):
+                    if self.stop_event.is_set():
+                        release(jobs[index:])
+                        return
+                    try:
+                        self.counters[execute(job)] += 1
+                    except Exception:
+                        # Не удалось записать результат — задачу вернет requeue_stale
+                        logger.exception('Обработчик %s: сбой задачи #%s', self.name, job.pk)
+                        connection.close()
+                if not jobs:
+                    if self.once:
+                        return
+                    self.stop_event.wait(self.poll_interval)
+        finally:
+            connection.close()
+
+
+def worker_name(index):
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+def run_workers(threads=1, batch_size=10, poll_interval=1.0, once=False, stop_event=None):
+    """
+    Запускает threads обработчиков в потоках текущего процесса и ждет их.
+
+    Returns:
+        {статус: количество} по всем потокам
+    """
+    stop_event = stop_event or threading.Event()
+    requeue_stale()
+    workers = [
+        Worker(worker_name(index), stop_event, batch_size=batch_size, poll_interval=poll_interval, once=once)
+        for index in range(threads)
+    ]
+    pool = [threading.Thread(target=worker.run, name=worker.name) for worker in workers]
+    for thread in pool:
+        thread.start()
+    # Зависшие задачи проверяются, пока потоки работают
+    checked_at = time.monotonic()
+    while any(thread.is_alive() for thread in pool):
+        for thread in pool:
+            thread.join(timeout=0.5)
+        if time.monotonic() - checked_at >= settings.JOB_LOCK_TIMEOUT / 2:
+            checked_at = time.monotonic()
+            try:
+                requeue_stale()
+            except Exception:
+                logger.exception('Не удалось вернуть зависшие задачи в очередь')
+            finally:
+                connection.close()
+
+    totals = {}
+    for worker in workers:
+        for status, count in worker.counters.items():
+            totals[status] = totals.get(status, 0) + count
+    return totals
@@ -0,0 +1,49 @@
+"""
+Команда для переноса старых записей журнала аудита в архив
+Записи старше AUDIT_ARCHIVE_AFTER_DAYS дней (или --before) сохраняются в
+сжатые сегменты в AUDIT_ARCHIVE_DIR и удаляются из таблицы.
+Использование: python manage.py archive_audit_log [--days N | --before YYYY-MM-DD] [--keep] [--dry-run]
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.audit_archive import AuditArchive, archive_before
+from core.models import AuditLog
+
+
+class Command(BaseCommand):
+    help = 'Переносит старые записи журнала аудита в сжатый архив'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.AUDIT_ARCHIVE_AFTER_DAYS,
+                            help='Архивировать записи старше N дней')
+        parser.add_argument('--before', help='Архивировать записи до даты (YYYY-MM-DD)')
+        parser.add_argument('--keep', action='store_true', help='Не удалять записи из таблицы')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать количество записей')
+
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                day = datetime.strptime(options['before'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Дата должна быть в формате YYYY-MM-DD')
+            cutoff = timezone.make_aware(datetime.combine(day, time.min))
+        else:
+            cutoff = timezone.now() - timedelta(days=options['days'])
+
+        if options['dry_run']:
+            count = AuditLog.objects.filter(created_at__lt=cutoff).count()
+            self.stdout.write(f'Будет перенесено записей: {count} (до {cutoff:%d.%m.%Y %H:%M})')
+            return
+
+        segments = archive_before(cutoff, delete=not options['keep'])
+        for segment in segments:
+            self.stdout.write(f'{segment["file"]}: {segment["rows"]} записей')
+        summary = AuditArchive().summary()
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено записей: {sum(segment["rows"] for segment in segments)}; '
+            f'всего в архиве: {summary["rows"] if summary else 0}'
+        ))
@@ -0,0 +1,61 @@
+"""
+Команда для обслуживания месячных партиций журнала аудита (PostgreSQL)
+Создает партиции на AUDIT_PARTITIONS_AHEAD месяцев вперед и отключает или
+удаляет партиции старше AUDIT_RETENTION_MONTHS месяцев.
+Запускать регулярно (например, раз в сутки из cron).
+Использование: python manage.py audit_partitions [--ahead N] [--retention N] [--drop] [--dry-run] [--list]
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import audit_partitions
+
+
+class Command(BaseCommand):
+    help = 'Создает будущие партиции журнала аудита и отключает/удаляет устаревшие'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=settings.AUDIT_PARTITIONS_AHEAD,
+                            help='На сколько месяцев вперед создать партиции')
+        parser.add_argument('--retention', type=int, default=settings.AUDIT_RETENTION_MONTHS,
+                            help='Сколько месяцев хранить (0 — хранить все)')
+        parser.add_argument('--drop', action='store_true',
+                            default=settings.AUDIT_EXPIRED_PARTITIONS == 'drop',
+                            help='Удалять устаревшие партиции вместо отключения')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет сделано')
+        parser.add_argument('--list', action='store_true', help='Показать партиции и выйти')
+
+    def handle(self, *args, **options):
+        if not audit_partitions.is_supported():
+            raise CommandError('Партиции журнала аудита поддерживаются только на PostgreSQL')
+        if not audit_partitions.is_partitioned():
+            raise CommandError('Таблица журнала аудита не секционирована (примените миграции)')
+
+        if options['list']:
+            for month, name in audit_partitions.list_partitions():
+                self.stdout.write(f'{month:%Y-%m}  {name}')
+            return
+
+        expired = audit_partitions.expired_partitions(options['retention'])
+        if options['dry_run']:
+            existing = {month for month, _ in audit_partitions.list_partitions()}
+            today = timezone.now().date()
+            for shift in range(options['ahead'] + 1):
+                month = audit_partitions.month_start(today, shift)
+                if month not in existing:
+                    self.stdout.write(f'Будет создана: {audit_partitions.partition_name(month)}')
+            for _, name in expired:
+                self.stdout.write(f'Будет {"удалена" if options["drop"] else "отключена"}: {name}')
+            return
+
+        for name in audit_partitions.ensure_partitions(options['ahead']):
+            self.stdout.write(f'Создана партиция {name}')
+        for _, name in expired:
+            if options['drop']:
+                audit_partitions.drop_partition(name)
+                self.stdout.write(f'Удалена партиция {name}')
+            else:
+                audit_partitions.detach_partition(name)
+                self.stdout.write(f'Отключена партиция {name} (данные остались в таблице {name})')
+        self.stdout.write(self.style.SUCCESS('Партиции журнала аудита обновлены'))
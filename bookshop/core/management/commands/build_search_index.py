@@ -0,0 +1,32 @@
+"""
+Команда для построения встроенного поискового индекса книг
+Использование: python manage.py build_search_index [--output путь]
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.search_index import iter_book_documents, write_index_file
+
+
+class Command(BaseCommand):
+    help = 'Строит файл встроенного поискового индекса (BM25) для книг'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=settings.SEARCH_INDEX_PATH,
+            help='Путь к файлу индекса (по умолчанию SEARCH_INDEX_PATH)',
+        )
+
+    def handle(self, *args, **options):
+        path = options['output']
+        started = time.monotonic()
+        count = write_index_file(path, iter_book_documents())
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано книг: {count} за {elapsed:.1f} с. Файл: {path}'
+        ))
+        # Запущенные процессы перечитают файл при следующем запросе
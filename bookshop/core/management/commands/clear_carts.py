@@ -0,0 +1,29 @@
+"""
+Команда для удаления заброшенных корзин гостей
+Корзина гостя недоступна после истечения его сессии, поэтому удаляются корзины
+без пользователя, которые не менялись дольше SESSION_COOKIE_AGE.
+Использование: python manage.py clear_carts [--days N]
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Удаляет корзины гостей, которые не менялись дольше срока жизни сессии'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Удалять корзины старше N дней (по умолчанию — SESSION_COOKIE_AGE)')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None:
+            age = timedelta(days=options['days'])
+        else:
+            age = timedelta(seconds=settings.SESSION_COOKIE_AGE)
+        deleted, _ = Cart.objects.filter(user__isnull=True, updated_at__lt=timezone.now() - age).delete()
+        self.stdout.write(self.style.SUCCESS(f'Удалено записей корзин: {deleted}'))
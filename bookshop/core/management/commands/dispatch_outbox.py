@@ -0,0 +1,57 @@
+"""
+Команда для отправки писем из очереди (core.outbox)
+Отправляет готовые письма пачками через одно соединение с почтовым сервером
+и ждет новые; --once отправляет накопившиеся письма и выходит (для cron).
+Использование: python manage.py dispatch_outbox [--once] [--batch N] [--rate N] [--poll S]
+               python manage.py dispatch_outbox --retry-failed | --purge DAYS
+"""
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.outbox import drain, purge_sent, retry_failed
+
+
+class Command(BaseCommand):
+    help = 'Отправляет письма из очереди исходящих писем'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Отправить накопившиеся письма и выйти')
+        parser.add_argument('--batch', type=int, default=None,
+                            help='Писем на одно соединение (по умолчанию EMAIL_OUTBOX_BATCH_SIZE)')
+        parser.add_argument('--rate', type=float, default=None,
+                            help='Не больше N писем в секунду (по умолчанию EMAIL_OUTBOX_RATE)')
+        parser.add_argument('--poll', type=float, default=2.0, help='Пауза при пустой очереди, секунды')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Вернуть письма со статусом failed в очередь и выйти')
+        parser.add_argument('--purge', type=int, metavar='DAYS',
+                            help='Удалить отправленные письма старше DAYS дней и выйти')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            self.stdout.write(self.style.SUCCESS(f'Возвращено в очередь: {retry_failed()}'))
+            return
+        if options['purge'] is not None:
+            self.stdout.write(self.style.SUCCESS(f'Удалено писем: {purge_sent(options["purge"])}'))
+            return
+
+        stop_event = threading.Event()
+
+        def stop(signum, frame):
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        total_sent = total_failed = 0
+        while not stop_event.is_set():
+            close_old_connections()
+            sent, failed = drain(options['batch'], options['rate'], stop_event)
+            total_sent += sent
+            total_failed += failed
+            if options['once']:
+                break
+            stop_event.wait(options['poll'])
+        self.stdout.write(self.style.SUCCESS(f'Отправлено: {total_sent}, отложено: {total_failed}'))
@@ -0,0 +1,24 @@
+"""
+Команда для просмотра статистики кэша карточек книг
+Использование: python manage.py fragment_cache_stats [--reset]
+"""
+from django.core.management.base import BaseCommand
+
+from core.fragment_cache import card_stats, reset_card_stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кэша фрагментов карточек книг'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Обнулить счетчики после вывода')
+
+    def handle(self, *args, **options):
+        stats = card_stats()
+        self.stdout.write(f'Попаданий: {stats["hits"]}')
+        self.stdout.write(f'Промахов: {stats["misses"]}')
+        self.stdout.write(self.style.SUCCESS(f'Доля попаданий: {stats["hit_rate"]:.1%}'))
+
+        if options['reset']:
+            reset_card_stats()
+            self.stdout.write('Счетчики обнулены')
@@ -0,0 +1,41 @@
+"""
+Команда для массового выпуска карт лояльности
+Выпускает карты активным пользователям без карты — всем или по списку email
+из файла (по одному в строке). Номера выдаются без проверки занятости
+(core.card_numbers), карты создаются пачками через bulk_create.
+Использование: python manage.py issue_loyalty_cards [--emails FILE] [--batch N] [--dry-run]
+"""
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Lower
+
+from core.card_numbers import issue_cards
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = 'Выпускает карты лояльности пользователям без карты'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emails', type=str, default=None,
+                            help='Файл со списком email (по умолчанию — все пользователи)')
+        parser.add_argument('--batch', type=int, default=1000, help='Карт в одной транзакции')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать пользователей')
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(is_active=True, loyalty_card__isnull=True)
+        if options['emails']:
+            with open(options['emails'], encoding='utf-8') as file:
+                emails = {line.strip().lower() for line in file if line.strip()}
+            users = users.annotate(email_lower=Lower('email')).filter(email_lower__in=emails)
+
+        ids = list(users.order_by('pk').values_list('pk', flat=True))
+        if options['dry_run']:
+            self.stdout.write(f'Будет выпущено карт: {len(ids)}')
+            return
+
+        issued = 0
+        batch = options['batch']
+        for start in range(0, len(ids), batch):
+            chunk = User.objects.filter(pk__in=ids[start:start + batch], loyalty_card__isnull=True)
+            issued += issue_cards(chunk, batch_size=batch)
+        self.stdout.write(self.style.SUCCESS(f'Выпущено карт: {issued}'))
@@ -0,0 +1,17 @@
+"""
+Команда для пересчета рейтинга книг по отзывам
+Использование: python manage.py recompute_ratings
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.ratings import recompute_ratings
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает rating_sum, rating_count и rating всех книг одним UPDATE'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = recompute_ratings()
+        self.stdout.write(self.style.SUCCESS(f'Рейтинг обновлен у книг: {updated}'))
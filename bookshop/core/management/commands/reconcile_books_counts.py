@@ -0,0 +1,34 @@
+"""
+Команда для пересчета количества книг у жанров, авторов и издателей
+Использование: python manage.py reconcile_books_counts [--dry-run]
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from core.book_counts import actual_books_count, reconcile_books_counts
+from core.models import Author, Genre, Publisher
+
+
+class Command(BaseCommand):
+    help = 'Сверяет и исправляет books_count у жанров, авторов и издателей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        models = (Genre, Author, Publisher)
+
+        if options['dry_run']:
+            for model in models:
+                stale = model.objects.annotate(actual=actual_books_count(model)).exclude(
+                    books_count=F('actual'),
+                ).count()
+                self.stdout.write(f'{model._meta.verbose_name_plural}: расхождений {stale}')
+            return
+
+        with transaction.atomic():
+            fixed = reconcile_books_counts(models)
+        for model, count in fixed.items():
+            self.stdout.write(f'{model._meta.verbose_name_plural}: исправлено {count}')
+        self.stdout.write(self.style.SUCCESS('Количество книг пересчитано'))
@@ -0,0 +1,28 @@
+"""
+Команда для снятия истекших резервов товаров в корзинах
+Резерв, к которому корзина не обращалась STOCK_HOLD_TTL минут, снимается, и
+товар снова становится доступен другим покупателям. Запускается по расписанию
+(например, cron раз в минуту); --reconcile дополнительно пересчитывает
+reserved_quantity товаров по таблице резервов.
+Использование: python manage.py release_stock_holds [--batch N] [--reconcile]
+"""
+from django.core.management.base import BaseCommand
+
+from core.reservations import reconcile_reserved, release_expired
+
+
+class Command(BaseCommand):
+    help = 'Снимает истекшие резервы товаров в корзинах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=500,
+                            help='Сколько резервов снимать за одну транзакцию')
+        parser.add_argument('--reconcile', action='store_true',
+                            help='Пересчитать резерв товаров по таблице резервов')
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options['batch'])
+        self.stdout.write(self.style.SUCCESS(f'Снято резервов: {released}'))
+        if options['reconcile']:
+            fixed = reconcile_reserved()
+            self.stdout.write(self.style.SUCCESS(f'Исправлен резерв товаров: {fixed}'))
@@ -0,0 +1,85 @@
+"""
+Команда для запуска обработчиков фоновых задач (core.jobs)
+Запускает --threads потоков в каждом из --processes процессов; SIGTERM/SIGINT
+завершают обработчики после текущей задачи. --once обрабатывает готовые задачи
+и выходит (для cron и отладки).
+Использование: python manage.py run_workers [--threads N] [--processes N] [--once]
+               python manage.py run_workers --retry-failed | --purge DAYS
+"""
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.jobs import purge_finished, retry_failed, run_workers
+
+
+def _serve(options, stop_event):
+    def stop(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    return run_workers(
+        threads=options['threads'],
+        batch_size=options['batch'],
+        poll_interval=options['poll'],
+        once=options['once'],
+        stop_event=stop_event,
+    )
+
+
+def _child(options):
+    _serve(options, threading.Event())
+
+
+class Command(BaseCommand):
+    help = 'Запускает обработчики фоновых задач'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2, help='Потоков в процессе')
+        parser.add_argument('--processes', type=int, default=1, help='Количество процессов')
+        parser.add_argument('--batch', type=int, default=10, help='Сколько задач забирать за раз')
+        parser.add_argument('--poll', type=float, default=1.0, help='Пауза при пустой очереди, секунды')
+        parser.add_argument('--once', action='store_true', help='Выйти, когда очередь опустеет')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Вернуть задачи со статусом failed в очередь и выйти')
+        parser.add_argument('--purge', type=int, metavar='DAYS',
+                            help='Удалить выполненные задачи старше DAYS дней и выйти')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            self.stdout.write(self.style.SUCCESS(f'Возвращено в очередь: {retry_failed()}'))
+            return
+        if options['purge'] is not None:
+            self.stdout.write(self.style.SUCCESS(f'Удалено задач: {purge_finished(options["purge"])}'))
+            return
+
+        if options['processes'] <= 1:
+            totals = _serve(options, threading.Event())
+            self.stdout.write(self.style.SUCCESS(
+                'Выполнено: {done}, отложено: {pending}, ошибок: {failed}'.format(
+                    done=totals.get('done', 0), pending=totals.get('pending', 0), failed=totals.get('failed', 0),
+                )
+            ))
+            return
+
+        # Дочерние процессы открывают свои соединения с базой
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        children = [context.Process(target=_child, args=(options,)) for _ in range(options['processes'])]
+        for child in children:
+            child.start()
+        self.stdout.write(f'Запущено процессов: {len(children)}, потоков в каждом: {options["threads"]}')
+
+        def stop(signum, frame):
+            for child in children:
+                if child.is_alive():
+                    child.terminate()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for child in children:
+            child.join()
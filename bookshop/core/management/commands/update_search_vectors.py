@@ -0,0 +1,38 @@
+"""
+Команда для пересчета документов полнотекстового поиска книг
+Использование: python manage.py update_search_vectors [--batch-size 5000]
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Book
+from core.search import is_fulltext_available, update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает search_vector для всех книг (PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Количество книг в одном UPDATE')
+
+    def handle(self, *args, **options):
+        if not is_fulltext_available():
+            self.stdout.write(self.style.WARNING('Полнотекстовый поиск доступен только на PostgreSQL'))
+            return
+
+        batch_size = options['batch_size']
+        updated = 0
+        last_id = 0
+        # Идем по id пачками, чтобы не держать длинную транзакцию на весь каталог
+        while True:
+            ids = list(
+                Book.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                updated += update_search_vectors(ids)
+            last_id = ids[-1]
+            self.stdout.write(f'Обработано книг: {updated}')
+
+        self.stdout.write(self.style.SUCCESS(f'Поисковые документы обновлены для {updated} книг'))
@@ -2,7 +2,25 @@
 Middleware для отслеживания важных действий пользователей
 """
 from django.utils.deprecation import MiddlewareMixin
-from .audit import log_action
+from .audit import log_action, reset_current_request, set_current_request
+
+
+class AuditContextMiddleware:
+    """
+    Делает текущий запрос доступным коду аудита (core.audit.get_current_request),
+    в том числе обработчикам сигналов моделей
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = set_current_request(request)
+        try:
+            return self.get_response(request)
+        finally:
+            reset_current_request(token)
+
 
 
 class AuditMiddleware(MiddlewareMixin):
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:51
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def populate_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from core.search import search_vector_expression
+
+    Book = apps.get_model('core', 'Book')
+    Book.objects.update(search_vector=search_vector_expression(
+        apps.get_model('core', 'Author'),
+        apps.get_model('core', 'Genre'),
+        apps.get_model('core', 'Publisher'),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_book_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='core_book_search_vector_gin'),
+        ),
+        migrations.RunPython(populate_search_vectors, migrations.RunPython.noop),
+    ]
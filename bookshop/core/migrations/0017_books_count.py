@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:05
+
+from django.db import migrations, models
+
+
+def populate_books_counts(apps, schema_editor):
+    from core.book_counts import reconcile_books_counts
+
+    reconcile_books_counts(
+        [apps.get_model('core', name) for name in ('Genre', 'Author', 'Publisher')],
+        book_model=apps.get_model('core', 'Book'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_book_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='books_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Количество книг'),
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='books_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Количество книг'),
+        ),
+        migrations.AddField(
+            model_name='publisher',
+            name='books_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Количество книг'),
+        ),
+        migrations.RunPython(populate_books_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:11
+
+from django.db import migrations, models
+
+
+def populate_ratings(apps, schema_editor):
+    from core.ratings import recompute_ratings
+
+    recompute_ratings(book_model=apps.get_model('core', 'Book'), review_model=apps.get_model('core', 'Review'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_book_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_ratings, migrations.RunPython.noop),
+    ]
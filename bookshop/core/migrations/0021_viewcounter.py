@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_auditlog_created_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=50)),
+                ('object_id', models.PositiveIntegerField()),
+                ('date', models.DateField()),
+                ('views', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Счетчик просмотров',
+                'verbose_name_plural': 'Счетчики просмотров',
+                'indexes': [models.Index(fields=['model_name', 'date'], name='core_viewco_model_n_8bb606_idx')],
+                'unique_together': {('model_name', 'object_id', 'date')},
+            },
+        ),
+    ]
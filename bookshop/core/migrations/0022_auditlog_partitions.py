@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:19
+
+from django.conf import settings
+from django.db import migrations
+
+
+def partition_auditlog(apps, schema_editor):
+    from core.audit_partitions import partition_table
+
+    partition_table(ahead=settings.AUDIT_PARTITIONS_AHEAD)
+
+
+def unpartition_auditlog(apps, schema_editor):
+    from core.audit_partitions import unpartition_table
+
+    unpartition_table()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_viewcounter'),
+    ]
+
+    operations = [
+        # Только PostgreSQL: на других СУБД таблица остается обычной
+        migrations.RunPython(partition_auditlog, unpartition_auditlog),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:24
+
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# (старое поле AuditLog, новая ссылка, справочник)
+LOOKUPS = (
+    ('url_path', 'path', 'AuditPath'),
+    ('user_agent', 'agent', 'AuditUserAgent'),
+)
+
+
+def encode_values(apps, schema_editor):
+    AuditLog = apps.get_model('core', 'AuditLog')
+    quote = schema_editor.quote_name
+    for column, field, model_name in LOOKUPS:
+        Lookup = apps.get_model('core', model_name)
+        values = list(
+            AuditLog.objects.exclude(**{f'{column}__isnull': True}).exclude(**{column: ''})
+            .order_by().values_list(column, flat=True).distinct()
+        )
+        Lookup.objects.bulk_create(
+            [Lookup(value=value, digest=hashlib.md5(value.encode('utf-8')).hexdigest()) for value in values],
+            batch_size=1000,
+        )
+        # Одним UPDATE ... FROM (PostgreSQL, SQLite 3.33+) вместо запроса на каждое значение
+        schema_editor.execute(
+            f'UPDATE {quote(AuditLog._meta.db_table)} SET {quote(field + "_id")} = l.id '
+            f'FROM {quote(Lookup._meta.db_table)} l WHERE {quote(AuditLog._meta.db_table)}.{quote(column)} = l.value'
+        )
+    if schema_editor.connection.vendor == 'postgresql':
+        # Новые внешние ключи DEFERRABLE INITIALLY DEFERRED: без проверки сейчас
+        # отложенные события UPDATE не дадут выполнить ALTER TABLE в RemoveField
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+def decode_values(apps, schema_editor):
+    AuditLog = apps.get_model('core', 'AuditLog')
+    quote = schema_editor.quote_name
+    for column, field, model_name in LOOKUPS:
+        Lookup = apps.get_model('core', model_name)
+        schema_editor.execute(
+            f'UPDATE {quote(AuditLog._meta.db_table)} SET {quote(column)} = l.value '
+            f'FROM {quote(Lookup._meta.db_table)} l WHERE {quote(AuditLog._meta.db_table)}.{quote(field + "_id")} = l.id'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_auditlog_created_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditPath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.TextField()),
+                ('digest', models.CharField(editable=False, max_length=32, unique=True)),
+            ],
+            options={
+                'verbose_name': 'URL журнала',
+                'verbose_name_plural': 'URL журнала',
+            },
+        ),
+        migrations.CreateModel(
+            name='AuditUserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.TextField()),
+                ('digest', models.CharField(editable=False, max_length=32, unique=True)),
+            ],
+            options={
+                'verbose_name': 'User-Agent журнала',
+                'verbose_name_plural': 'User-Agent журнала',
+            },
+        ),
+        migrations.AddField(
+            model_name='auditlog',
+            name='path',
+            field=models.ForeignKey(blank=True, db_index=False, help_text='URL страницы', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.auditpath'),
+        ),
+        migrations.AddField(
+            model_name='auditlog',
+            name='agent',
+            field=models.ForeignKey(blank=True, db_index=False, help_text='User Agent', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.audituseragent'),
+        ),
+        migrations.RunPython(encode_values, decode_values),
+        migrations.RemoveField(
+            model_name='auditlog',
+            name='url_path',
+        ),
+        migrations.RemoveField(
+            model_name='auditlog',
+            name='user_agent',
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_cart'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='reserved_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='В резерве корзин'),
+        ),
+        migrations.AddField(
+            model_name='stationery',
+            name='reserved_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='В резерве корзин'),
+        ),
+        migrations.CreateModel(
+            name='StockHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_type', models.CharField(choices=[('book', 'Book'), ('stationery', 'Stationery')], max_length=50)),
+                ('product_id', models.PositiveIntegerField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('cart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='core.cart')),
+            ],
+            options={
+                'verbose_name': 'Резерв товара',
+                'verbose_name_plural': 'Резервы товаров',
+                'indexes': [models.Index(fields=['expires_at'], name='core_stockh_expires_c8137d_idx'), models.Index(fields=['product_type', 'product_id'], name='core_stockh_product_d3e5a3_idx')],
+                'unique_together': {('cart', 'product_type', 'product_id')},
+            },
+        ),
+    ]
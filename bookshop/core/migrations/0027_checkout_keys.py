@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_stock_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckoutKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.OneToOneField(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='checkout_key', to='core.order')),
+            ],
+            options={
+                'verbose_name': 'Ключ оформления заказа',
+                'verbose_name_plural': 'Ключи оформления заказов',
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:50
+
+from django.db import migrations
+
+
+SEQUENCE = 'core_loyalty_card_number_seq'
+
+
+def create_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'CREATE SEQUENCE IF NOT EXISTS {SEQUENCE}')
+
+
+def drop_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP SEQUENCE IF EXISTS {SEQUENCE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_email_outbox'),
+    ]
+
+    operations = [
+        # Только PostgreSQL: порядковые номера карт лояльности (core.card_numbers)
+        migrations.RunPython(create_sequence, drop_sequence),
+    ]
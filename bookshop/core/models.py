@@ -1,7 +1,11 @@
 from decimal import Decimal
 
 from django.conf import settings
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager, Group, Permission
 
 
@@ -102,6 +106,8 @@ class Category(models.Model):
 class Publisher(models.Model):
     name = models.CharField(max_length=150, unique=True)
     description = models.TextField(blank=True, null=True)
+    # Количество книг (поддерживается core.book_counts)
+    books_count = models.PositiveIntegerField(default=0, editable=False, help_text="Количество книг")
 
     def __str__(self):
         return self.name
@@ -119,6 +125,8 @@ class Author(models.Model):
     death_place = models.CharField(max_length=255, blank=True, null=True, help_text="Место смерти")
     biography = models.TextField(blank=True, null=True, help_text="Биография автора")
     short_bio = models.TextField(blank=True, null=True, help_text="Краткая биография (для карточек)")
+    # Количество книг (поддерживается core.book_counts)
+    books_count = models.PositiveIntegerField(default=0, editable=False, help_text="Количество книг")
 
     class Meta:
         ordering = ('last_name', 'first_name')
@@ -144,13 +152,50 @@ class Author(models.Model):
 # --- Жанры ---
 class Genre(models.Model):
     name = models.CharField(max_length=100, unique=True)
+    # Количество книг (поддерживается core.book_counts)
+    books_count = models.PositiveIntegerField(default=0, editable=False, help_text="Количество книг")
 
     def __str__(self):
         return self.name
 
 
+# --- Остатки товаров ---
+class StockedProduct(models.Model):
+    """
+    Товар со складским остатком и резервом корзин.
+
+    reserved_quantity — сколько единиц удерживают корзины (core.reservations);
+    меняется только атомарными UPDATE, поэтому обычный save() его не записывает.
+    Наследники добавляют такие поля в counter_fields.
+    """
+    # Поля, которые меняются только UPDATE с F(); save() без update_fields их не записывает
+    counter_fields = ('reserved_quantity',)
+
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False, help_text="В резерве корзин")
+
+    class Meta:
+        abstract = True
+
+    @property
+    def available_quantity(self):
+        """Сколько можно положить в корзину: остаток за вычетом резервов"""
+        return max(self.stock_quantity - self.reserved_quantity, 0)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
 # --- Книги ---
-class Book(models.Model):
+class Book(StockedProduct):
+    # Рейтинг меняет только core.ratings, версию — core.fragment_cache:
+    # устаревший экземпляр не затирает новые оценки и не возвращает старую версию
+    counter_fields = StockedProduct.counter_fields + ('rating', 'rating_sum', 'rating_count', 'version')
+
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
     isbn13 = models.CharField(max_length=20, unique=True)
@@ -161,27 +206,39 @@ class Book(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock_quantity = models.IntegerField(default=0)
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.00, help_text="Рейтинг от 0.00 до 5.00")
+    # Сумма и количество оценок из отзывов; rating = rating_sum / rating_count (см. core.ratings)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
 
     publisher = models.ForeignKey(Publisher, on_delete=models.SET_NULL, null=True, related_name='books')
     authors = models.ManyToManyField(Author, related_name='books')
     genres = models.ManyToManyField(Genre, related_name='books')
 
+    # Документ для полнотекстового поиска (поддерживается core.search)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+    # Версия карточки книги для кэша фрагментов (увеличивается core.fragment_cache)
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Курсорная пагинация каталога: сортировка по рейтингу и по году
+            models.Index(fields=['-rating', 'title', 'id']),
+            models.Index(fields=['publication_year', 'title', 'id']),
+            GinIndex(fields=['search_vector'], name='core_book_search_vector_gin'),
+        ]
+
     def __str__(self):
         return self.title
 
     def update_rating(self):
-        """Пересчитывает средний рейтинг книги на основе отзывов"""
-        from django.db.models import Avg
-        avg_rating = self.reviews.aggregate(Avg('rating'))['rating__avg']
-        if avg_rating is not None:
-            self.rating = round(Decimal(str(avg_rating)), 2)
-        else:
-            self.rating = Decimal('0.00')
-        self.save(update_fields=['rating'])
+        """Пересчитывает рейтинг книги по всем отзывам (см. core.ratings.recompute_ratings)"""
+        from .ratings import recompute_ratings
+        recompute_ratings(Book.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=['rating', 'rating_sum', 'rating_count', 'version'])
 
 
 # --- Канцтовары ---
-class Stationery(models.Model):
+class Stationery(StockedProduct):
     name = models.CharField(max_length=150)
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -296,6 +353,96 @@ class OrderItem(models.Model):
         return f"{self.name} x{self.quantity}"
 
 
+class CheckoutKey(models.Model):
+    """
+    Ключ идемпотентности оформления заказа.
+
+    Форма оформления содержит случайный ключ; повторная отправка той же формы
+    (двойной клик, повтор после таймаута) находит уже созданный заказ по ключу
+    вместо создания нового (core.checkout).
+    """
+    key = models.CharField(max_length=64, unique=True)
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, null=True, related_name="checkout_key")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Ключ оформления заказа'
+        verbose_name_plural = 'Ключи оформления заказов'
+
+    def __str__(self):
+        return self.key
+
+
+# --- Корзина ---
+class Cart(models.Model):
+    """
+    Корзина покупателя.
+
+    Корзина пользователя привязана к user; корзина гостя — без пользователя,
+    ее id хранится в сессии (core.cart). При входе корзина гостя объединяется
+    с корзиной пользователя.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="cart",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Корзина'
+        verbose_name_plural = 'Корзины'
+
+    def __str__(self):
+        return f"Корзина #{self.pk} ({self.user or 'гость'})"
+
+
+class CartLine(models.Model):
+    """Строка корзины: товар, количество и цена на момент последней проверки"""
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="lines")
+    product_type = models.CharField(max_length=50, choices=Product.PRODUCT_TYPES)
+    product_id = models.PositiveIntegerField()
+    quantity = models.PositiveIntegerField(default=1)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('cart', 'product_type', 'product_id')
+        ordering = ('added_at', 'id')
+
+    def __str__(self):
+        return f"{self.product_type}:{self.product_id} x{self.quantity}"
+
+
+class StockHold(models.Model):
+    """
+    Резерв товара корзиной до expires_at.
+
+    Сумма активных резервов товара хранится в reserved_quantity товара;
+    истекшие резервы снимает команда release_stock_holds.
+    """
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="holds")
+    product_type = models.CharField(max_length=50, choices=Product.PRODUCT_TYPES)
+    product_id = models.PositiveIntegerField()
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('cart', 'product_type', 'product_id')
+        indexes = [
+            models.Index(fields=['expires_at']),
+            models.Index(fields=['product_type', 'product_id']),
+        ]
+        verbose_name = 'Резерв товара'
+        verbose_name_plural = 'Резервы товаров'
+
+    def __str__(self):
+        return f"{self.product_type}:{self.product_id} x{self.quantity} до {self.expires_at:%H:%M}"
+
+
 # --- Отзывы ---
 class Review(models.Model):
     user = models.ForeignKey(
@@ -331,11 +478,6 @@ class Review(models.Model):
     def __str__(self):
         return f"Отзыв от {self.user} на {self.book or 'заказ'}"
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        if self.book:
-            self.book.update_rating()
-
 
 # --- Сохраненные адреса ---
 class SavedAddress(models.Model):
@@ -432,40 +574,61 @@ class LoyaltyCard(models.Model):
         percentage = self.get_bonus_percentage()
         return Decimal(str(amount)) * Decimal(str(percentage)) / Decimal('100')
 
+    # Баланс меняется UPDATE ... SET balance = balance ± x: параллельные
+    # списания и начисления не затирают друг друга
+
     def add_bonus(self, amount):
         """Добавляет бонусы на карту"""
-        self.balance += Decimal(str(amount))
-        self.save(update_fields=['balance', 'updated_at'])
+        LoyaltyCard.objects.filter(pk=self.pk).update(
+            balance=F('balance') + Decimal(str(amount)), updated_at=timezone.now(),
+        )
+        self.refresh_from_db(fields=['balance', 'updated_at'])
 
     def spend_bonus(self, amount):
-        """Списывает бонусы с карты"""
+        """Списывает бонусы с карты, если их достаточно"""
         amount_decimal = Decimal(str(amount))
-        if self.balance >= amount_decimal:
-            self.balance -= amount_decimal
-            self.save(update_fields=['balance', 'updated_at'])
-            return True
-        return False
-
-    def add_purchase(self, amount):
+        spent = LoyaltyCard.objects.filter(pk=self.pk, balance__gte=amount_decimal).update(
+            balance=F('balance') - amount_decimal, updated_at=timezone.now(),
+        )
+        self.refresh_from_db(fields=['balance', 'updated_at'])
+        return bool(spent)
+
+    def apply_purchase(self, amount, spend=0, bonus=None):
+        """
+        Списывает бонусы в оплату покупки и начисляет бонусы за нее.
+
+        Строка карты блокируется до конца транзакции: процент начисления зависит
+        от суммы прошлых покупок. Бонусы списываются, только если их хватает,
+        и не больше суммы покупки. bonus — начисление, рассчитанное заранее
+        (при оформлении заказа); по умолчанию считается по текущему проценту.
+
+        Returns:
+            (списано, начислено)
+        """
+        amount = Decimal(str(amount))
+        spend = min(Decimal(str(spend)), amount)
+        with transaction.atomic():
+            card = LoyaltyCard.objects.select_for_update().get(pk=self.pk)
+            if spend <= 0 or card.balance < spend:
+                spend = Decimal('0')
+            bonus = card.calculate_bonus(amount) if bonus is None else Decimal(str(bonus))
+            LoyaltyCard.objects.filter(pk=self.pk).update(
+                balance=F('balance') - spend + bonus,
+                total_spent=F('total_spent') + amount,
+                updated_at=timezone.now(),
+            )
+        self.refresh_from_db(fields=['balance', 'total_spent', 'updated_at'])
+        return spend, bonus
+
+    def add_purchase(self, amount, bonus=None):
         """Добавляет покупку и начисляет бонусы"""
-        bonus = self.calculate_bonus(amount)
-        amount_decimal = Decimal(str(amount))
-        self.total_spent += amount_decimal
-        # Обновляем баланс и total_spent в одной транзакции
-        self.balance += bonus
-        self.save(update_fields=['balance', 'total_spent', 'updated_at'])
-        return bonus
+        return self.apply_purchase(amount, bonus=bonus)[1]
 
     @staticmethod
     def generate_card_number():
-        """Генерирует уникальный номер карты лояльности"""
-        import random
-        import string
-        while True:
-            # Генерируем 16-значный номер карты
-            card_number = ''.join(random.choices(string.digits, k=16))
-            if not LoyaltyCard.objects.filter(card_number=card_number).exists():
-                return card_number
+        """Генерирует уникальный номер карты лояльности (core.card_numbers, без запросов к картам)"""
+        from .card_numbers import next_card_number
+        return next_card_number()
 
     def save(self, *args, **kwargs):
         if not self.card_number:
@@ -581,6 +744,35 @@ class SupportMessage(models.Model):
 
 
 # --- Журнал аудита ---
+class AuditLookup(models.Model):
+    """
+    Справочник повторяющихся строк журнала аудита.
+
+    AuditLog хранит ссылку на строку справочника вместо самой строки;
+    уникальность проверяется по md5 значения (значения бывают длинными).
+    """
+    value = models.TextField()
+    digest = models.CharField(max_length=32, unique=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return self.value
+
+
+class AuditUserAgent(AuditLookup):
+    class Meta:
+        verbose_name = 'User-Agent журнала'
+        verbose_name_plural = 'User-Agent журнала'
+
+
+class AuditPath(AuditLookup):
+    class Meta:
+        verbose_name = 'URL журнала'
+        verbose_name_plural = 'URL журнала'
+
+
 class AuditLog(models.Model):
     """Журнал аудита для отслеживания всех действий пользователей"""
     ACTION_TYPES = (
@@ -618,16 +810,24 @@ class AuditLog(models.Model):
     
     # Дополнительная информация о действии
     description = models.TextField(blank=True, null=True, help_text="Описание действия")
-    url_path = models.CharField(max_length=500, blank=True, null=True, help_text="URL страницы")
+    # URL и User-Agent хранятся в справочниках (свойства url_path и user_agent)
+    path = models.ForeignKey(
+        AuditPath, on_delete=models.PROTECT, null=True, blank=True, related_name='+',
+        db_index=False, help_text="URL страницы",
+    )
     
     # Изменения в формате JSON (для create/update/delete)
     changes = models.JSONField(default=dict, blank=True, help_text="Изменения (поле: {old: значение, new: значение})")
     
     # Дополнительная информация
     ip_address = models.GenericIPAddressField(null=True, blank=True, help_text="IP адрес")
-    user_agent = models.TextField(blank=True, null=True, help_text="User Agent")
+    agent = models.ForeignKey(
+        AuditUserAgent, on_delete=models.PROTECT, null=True, blank=True, related_name='+',
+        db_index=False, help_text="User Agent",
+    )
     
-    created_at = models.DateTimeField(auto_now_add=True, help_text="Время действия")
+    # Время задается при вызове log_action: запись сохраняется позже, фоновым потоком
+    created_at = models.DateTimeField(default=timezone.now, editable=False, help_text="Время действия")
     
     class Meta:
         ordering = ('-created_at',)
@@ -636,11 +836,43 @@ class AuditLog(models.Model):
         indexes = [
             models.Index(fields=['model_name', 'object_id']),
             models.Index(fields=['user', 'created_at']),
+            # Курсорная пагинация журнала (order by created_at, id)
+            models.Index(fields=['created_at', 'id']),
         ]
     
     def __str__(self):
         return f"{self.get_action_display()} {self.model_name} #{self.object_id} by {self.user or 'System'}"
-    
+
+    # Строки, присвоенные url_path/user_agent, переводятся в ссылки на справочники
+    # при сохранении (core.audit_lookups.encode_entries)
+
+    @property
+    def url_path(self):
+        if '_url_path' not in self.__dict__:
+            self._url_path = self.path.value if self.path_id else None
+        return self._url_path
+
+    @url_path.setter
+    def url_path(self, value):
+        self._url_path = value
+        self.path_id = None
+
+    @property
+    def user_agent(self):
+        if '_user_agent' not in self.__dict__:
+            self._user_agent = self.agent.value if self.agent_id else None
+        return self._user_agent
+
+    @user_agent.setter
+    def user_agent(self, value):
+        self._user_agent = value
+        self.agent_id = None
+
+    def save(self, *args, **kwargs):
+        from .audit_lookups import encode_entries
+        encode_entries([self])
+        super().save(*args, **kwargs)
+
     def get_changes_display(self):
         """Возвращает форматированное отображение изменений"""
         if not self.changes:
@@ -653,3 +885,104 @@ class AuditLog(models.Model):
             result.append(f"{field}: {old_val} → {new_val}")
         
         return "; ".join(result)
+
+
+# --- Счетчики просмотров ---
+class ViewCounter(models.Model):
+    """Количество просмотров страницы объекта за день (см. core.view_counters)"""
+    model_name = models.CharField(max_length=50)
+    object_id = models.PositiveIntegerField()
+    date = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('model_name', 'object_id', 'date')]
+        indexes = [
+            models.Index(fields=['model_name', 'date']),
+        ]
+        verbose_name = 'Счетчик просмотров'
+        verbose_name_plural = 'Счетчики просмотров'
+
+    def __str__(self):
+        return f"{self.model_name} #{self.object_id} {self.date}: {self.views}"
+
+
+# --- Очередь задач ---
+class Job(models.Model):
+    """
+    Фоновая задача (core.jobs, команда run_workers).
+
+    Задача создается в транзакции запроса и становится видна обработчикам
+    только после ее коммита; обработчики забирают задачи через
+    SELECT ... FOR UPDATE SKIP LOCKED. Задача, исчерпавшая попытки,
+    остается в таблице со статусом failed.
+    """
+    class Status(models.TextChoices):
+        PENDING = "pending", "Ожидает"
+        RUNNING = "running", "Выполняется"
+        DONE = "done", "Выполнена"
+        FAILED = "failed", "Ошибка"
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now, help_text="Время следующей попытки")
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_at'], name='core_job_pending_idx', condition=models.Q(status='pending')),
+            models.Index(fields=['status', 'finished_at']),
+        ]
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.get_status_display()})"
+
+
+# --- Исходящие письма ---
+class OutboxEmail(models.Model):
+    """
+    Письмо в очереди отправки (core.outbox, команда dispatch_outbox).
+
+    Письмо записывается в той же транзакции, что и изменение, которое его
+    вызвало, и отправляется диспетчером после коммита; запрос не ждет
+    почтовый сервер.
+    """
+    class Status(models.TextChoices):
+        PENDING = "pending", "Ожидает"
+        SENDING = "sending", "Отправляется"
+        SENT = "sent", "Отправлено"
+        FAILED = "failed", "Ошибка"
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.JSONField(default=list, help_text="Список получателей")
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    # Когда диспетчер забрал письмо на отправку
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at'], name='core_outbox_pending_idx', condition=models.Q(status='pending')),
+            models.Index(fields=['status', 'created_at']),
+        ]
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = 'Исходящие письма'
+
+    def __str__(self):
+        return f"{self.subject} → {', '.join(self.to)}"
@@ -0,0 +1,231 @@
+"""
+Исходящие письма через таблицу (transactional outbox)
+
+queue_email() не соединяется с почтовым сервером: письмо записывается в
+OutboxEmail в текущей транзакции и уходит, только если она закоммичена.
+Диспетчер (команда dispatch_outbox) забирает письма пачками через
+SELECT ... FOR UPDATE SKIP LOCKED, помечает их отправляемыми и после коммита
+отправляет пачку через одно соединение get_connection(), не быстрее
+EMAIL_OUTBOX_RATE писем в секунду.
+
+Неудачная отправка повторяется через EMAIL_OUTBOX_RETRY_DELAY * 2^(попытка-1)
+секунд; после EMAIL_OUTBOX_MAX_ATTEMPTS попыток письмо получает статус failed.
+Если диспетчер прервется посреди пачки, ее письма через
+EMAIL_OUTBOX_LOCK_TIMEOUT секунд вернутся в очередь и будут отправлены
+повторно (доставка «хотя бы один раз»).
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+
+logger = logging.getLogger(__name__)
+
+
+def queue_email(subject, body, to, from_email=None, html_body=''):
+    """
+    Ставит письмо в очередь отправки (в текущей транзакции).
+
+    Args:
+        subject: Тема (переводы строк удаляются)
+        body: Текст письма
+        to: Список адресов получателей
+        from_email: Отправитель (по умолчанию DEFAULT_FROM_EMAIL)
+        html_body: HTML-версия письма
+    """
+    return OutboxEmail.objects.create(
+        subject=''.join(subject.splitlines())[:255],
+        body=body,
+        html_body=html_body or '',
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(to),
+    )
+
+
+def _message(email, connection):
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email or settings.DEFAULT_FROM_EMAIL,
+        to=email.to,
+        connection=connection,
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def _defer(email, error, now):
+    email.attempts += 1
+    email.last_error = error
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.Status.FAILED
+        logger.error('Письмо #%s не отправлено за %d попыток: %s', email.pk, email.attempts, error)
+    else:
+        email.status = OutboxEmail.Status.PENDING
+        delay = settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+        email.next_attempt_at = now + timedelta(seconds=delay)
+
+
+class Throttle:
+    """Ограничение скорости: не больше rate отправок в секунду (0 — без ограничения)"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if now < self._next:
+            time.sleep(self._next - now)
+            now = self._next
+        self._next = now + self.interval
+
+
+def _claim(batch_size):
+    """Забирает готовые письма и помечает их отправляемыми (короткая транзакция)"""
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxEmail.Status.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        OutboxEmail.objects.filter(pk__in=ids).update(status=OutboxEmail.Status.SENDING, locked_at=now)
+    return list(OutboxEmail.objects.filter(pk__in=ids, locked_at=now).order_by('next_attempt_at', 'pk'))
+
+
+def _save_results(emails, sent_ids):
+    """Записывает итог отправки пачки (письма, возвращенные requeue_stale, не трогает)"""
+    if not emails:
+        return
+    mine = OutboxEmail.objects.filter(status=OutboxEmail.Status.SENDING, locked_at=emails[0].locked_at)
+    if sent_ids:
+        mine.filter(pk__in=sent_ids).update(
+            status=OutboxEmail.Status.SENT, sent_at=timezone.now(), attempts=F('attempts') + 1,
+            locked_at=None,
+        )
+    for email in emails:
+        if email.pk not in sent_ids:
+            # Ошибки редки — по запросу на письмо
+            mine.filter(pk=email.pk).update(
+                status=email.status, attempts=email.attempts, last_error=email.last_error,
+                next_attempt_at=email.next_attempt_at, locked_at=None,
+            )
+
+
+def dispatch(batch_size=None, throttle=None):
+    """
+    Отправляет одну пачку готовых писем.
+
+    Письма помечаются отправляемыми в короткой транзакции, а соединение с
+    почтовым сервером открывается уже после ее коммита: медленный сервер и
+    ограничение скорости не держат транзакцию и блокировки строк.
+
+    Args:
+        batch_size: Размер пачки (по умолчанию EMAIL_OUTBOX_BATCH_SIZE)
+        throttle: Throttle, общий для нескольких пачек
+
+    Returns:
+        (отправлено, отложено или с ошибкой)
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    throttle = throttle or Throttle(settings.EMAIL_OUTBOX_RATE)
+    emails = _claim(batch_size)
+    if not emails:
+        return 0, 0
+
+    sent_ids = set()
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as error:
+        # Почтовый сервер недоступен — откладываем всю пачку
+        logger.warning('Не удалось подключиться к почтовому серверу: %s', error)
+        now = timezone.now()
+        for email in emails:
+            _defer(email, str(error), now)
+        _save_results(emails, sent_ids)
+        return 0, len(emails)
+
+    try:
+        for index, email in enumerate(emails):
+            throttle.wait()
+            try:
+                connection.send_messages([_message(email, connection)])
+            except Exception as error:
+                _defer(email, str(error), timezone.now())
+                # После ошибки соединение может быть разорвано — открываем заново
+                connection.close()
+                try:
+                    connection.open()
+                except Exception as reconnect_error:
+                    # Переподключиться не удалось — остаток пачки ждет следующей попытки
+                    now = timezone.now()
+                    for pending in emails[index + 1:]:
+                        _defer(pending, str(reconnect_error), now)
+                    break
+            else:
+                sent_ids.add(email.pk)
+    finally:
+        connection.close()
+        _save_results(emails, sent_ids)
+    return len(sent_ids), len(emails) - len(sent_ids)
+
+
+def requeue_stale():
+    """
+    Возвращает в очередь письма, диспетчер которых пропал дольше EMAIL_OUTBOX_LOCK_TIMEOUT
+    (они могут быть отправлены повторно).
+    """
+    deadline = timezone.now() - timedelta(seconds=settings.EMAIL_OUTBOX_LOCK_TIMEOUT)
+    return OutboxEmail.objects.filter(status=OutboxEmail.Status.SENDING, locked_at__lt=deadline).update(
+        status=OutboxEmail.Status.PENDING, locked_at=None, next_attempt_at=timezone.now(),
+    )
+
+
+def drain(batch_size=None, rate=None, stop_event=None):
+    """
+    Отправляет готовые письма, пока они есть.
+
+    Returns:
+        (отправлено, отложено или с ошибкой)
+    """
+    throttle = Throttle(settings.EMAIL_OUTBOX_RATE if rate is None else rate)
+    requeue_stale()
+    total_sent = total_failed = 0
+    while stop_event is None or not stop_event.is_set():
+        sent, failed = dispatch(batch_size, throttle)
+        total_sent += sent
+        total_failed += failed
+        if not sent and not failed:
+            break
+    return total_sent, total_failed
+
+
+def retry_failed():
+    """Возвращает письма со статусом failed в очередь"""
+    return OutboxEmail.objects.filter(status=OutboxEmail.Status.FAILED).update(
+        status=OutboxEmail.Status.PENDING, attempts=0, next_attempt_at=timezone.now(),
+    )
+
+
+def purge_sent(days):
+    """Удаляет отправленные письма старше days дней (в них ссылки сброса пароля)"""
+    deleted, _ = OutboxEmail.objects.filter(
+        status=OutboxEmail.Status.SENT, sent_at__lt=timezone.now() - timedelta(days=days),
+    ).delete()
+    return deleted
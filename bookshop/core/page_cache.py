@@ -0,0 +1,81 @@
+"""
+Кэширование страниц каталога для анонимных посетителей
+
+Страница рендерится как общий для всех "скелет": вместо CSRF-токена
+в формы подставляется заглушка, а счетчики корзины и избранного не
+выводятся. Всё, что зависит от посетителя (CSRF-токен, корзина, избранное),
+страница получает отдельным запросом к JSON-эндпоинту personalization.
+
+Готовый HTML хранится в кэше под ключом, зависящим от версии каталога
+(см. core.caching), и отдается с заголовками Cache-Control, поэтому его
+может кэшировать и прокси/CDN перед приложением.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+from .caching import CATALOG, versioned_key
+
+
+# Значение csrf_token в скелете; настоящий токен подставляет скрипт страницы
+SKELETON_CSRF_TOKEN = 'skeleton'
+
+
+def is_skeleton_request(request):
+    """Страница рендерится как общий скелет"""
+    return getattr(request, 'page_skeleton', False)
+
+
+def _is_cacheable(request):
+    if request.method not in ('GET', 'HEAD') or not settings.PAGE_CACHE_TIMEOUT:
+        return False
+    if request.user.is_authenticated:
+        return False
+    # Страница с одноразовыми сообщениями не должна попасть в кэш
+    return not len(get_messages(request))
+
+
+def _page_key(request):
+    path = hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()
+    return versioned_key(CATALOG, 'page', path)
+
+
+def _add_cache_headers(response, state):
+    patch_cache_control(response, public=True, max_age=settings.PAGE_CACHE_MAX_AGE)
+    patch_vary_headers(response, ('Cookie',))
+    response['X-Page-Cache'] = state
+    return response
+
+
+def cache_anonymous_page(view):
+    """
+    Декоратор: для анонимных посетителей отдает страницу из кэша.
+
+    Авторизованные пользователи и страницы с сообщениями рендерятся как обычно.
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not _is_cacheable(request):
+            return view(request, *args, **kwargs)
+
+        key = _page_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return _add_cache_headers(HttpResponse(content, content_type=content_type), 'hit')
+
+        request.page_skeleton = True
+        response = view(request, *args, **kwargs)
+        # Кэшируем только обычный HTML без установки cookie
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return response
+        cache.set(key, (response.content, response['Content-Type']), settings.PAGE_CACHE_TIMEOUT)
+        return _add_cache_headers(response, 'miss')
+
+    return wrapper
@@ -0,0 +1,188 @@
+"""
+Курсорная (keyset) пагинация.
+
+Вместо OFFSET страница выбирается условием "строго после/до граничной строки"
+по тем же полям, по которым отсортирован queryset. При наличии составного
+индекса с тем же порядком полей каждая страница читается как диапазон индекса,
+а стоимость запроса не зависит от номера страницы.
+"""
+import base64
+import binascii
+import json
+from decimal import Decimal
+
+from django.db import connections
+from django.db.models import F, Q
+
+
+class KeysetPage:
+    """Страница результатов с токенами для перехода вперед и назад"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Пагинатор по ключу сортировки.
+
+    Args:
+        ordering: Поля сортировки в формате order_by ('-rating', 'title', 'id').
+            Последнее поле должно быть уникальным, чтобы порядок был строгим.
+        per_page: Размер страницы
+        nullable: Поля, которые могут быть NULL. NULL считается наибольшим
+            значением (как в индексе PostgreSQL по умолчанию): в конце при
+            сортировке по возрастанию и в начале при сортировке по убыванию.
+    """
+
+    def __init__(self, ordering, per_page, nullable=()):
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.nullable = set(nullable)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        # Подпись сортировки, чтобы токен от одной сортировки не применялся к другой
+        self.signature = ','.join(self.ordering)
+
+    # --- Токены ---
+
+    def encode_cursor(self, obj, direction):
+        values = [self._dump_value(getattr(obj, field)) for field in self.fields]
+        payload = json.dumps({'o': self.signature, 'd': direction, 'v': values}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Возвращает (direction, values) или None, если токен некорректен"""
+        if not cursor:
+            return None
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+            if payload.get('o') != self.signature or payload.get('d') not in ('next', 'prev'):
+                return None
+            values = payload['v']
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                return None
+        except (ValueError, TypeError, KeyError, binascii.Error, UnicodeError):
+            return None
+        return payload['d'], values
+
+    @staticmethod
+    def _dump_value(value):
+        if isinstance(value, Decimal):
+            return str(value)
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+
+    # --- Построение запроса ---
+
+    def _order_expressions(self, reverse=False):
+        expressions = []
+        for name in self.ordering:
+            field = name.lstrip('-')
+            descending = name.startswith('-') != reverse
+            if field in self.nullable:
+                if descending:
+                    expressions.append(F(field).desc(nulls_first=True))
+                else:
+                    expressions.append(F(field).asc(nulls_last=True))
+            else:
+                expressions.append(F(field).desc() if descending else F(field).asc())
+        return expressions
+
+    def _after_condition(self, values, reverse=False):
+        """Условие "строка идет строго после values" для прямого или обратного порядка"""
+        condition = Q(pk__in=[])
+        equal_prefix = Q()
+        for name, value in zip(self.ordering, values):
+            field = name.lstrip('-')
+            descending = name.startswith('-') != reverse
+            nullable = field in self.nullable
+
+            if value is None:
+                # NULL — наибольшее значение: после него идут только не-NULL при убывании
+                after = Q(**{f'{field}__isnull': False}) if descending else None
+                equal = Q(**{f'{field}__isnull': True})
+            else:
+                lookup = 'lt' if descending else 'gt'
+                after = Q(**{f'{field}__{lookup}': value})
+                if nullable and not descending:
+                    after |= Q(**{f'{field}__isnull': True})
+                equal = Q(**{field: value})
+
+            if after is not None:
+                condition |= equal_prefix & after
+            equal_prefix &= equal
+        return condition
+
+    def paginate(self, queryset, cursor=None):
+        """Возвращает KeysetPage для queryset начиная с позиции cursor"""
+        decoded = self.decode_cursor(cursor)
+        direction, values = decoded if decoded else ('next', None)
+        backwards = direction == 'prev'
+
+        queryset = queryset.order_by(*self._order_expressions(reverse=backwards))
+        if values is not None:
+            queryset = queryset.filter(self._after_condition(values, reverse=backwards))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = self.encode_cursor(rows[-1], 'next') if rows and has_next else None
+        previous_cursor = self.encode_cursor(rows[0], 'prev') if rows and has_previous else None
+        return KeysetPage(rows, next_cursor=next_cursor, previous_cursor=previous_cursor)
+
+
+def estimate_count(queryset, exact_below=10000):
+    """
+    Количество строк queryset по оценке планировщика PostgreSQL.
+
+    COUNT(*) читает все подходящие строки; оценка из EXPLAIN берется из
+    статистики таблицы и не зависит от ее размера. Если оценка меньше
+    exact_below, считается точное значение (это дешево). На других СУБД
+    всегда выполняется COUNT(*).
+
+    Returns:
+        (count, exact) — количество и признак точного значения
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count(), True
+
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    estimate = int(plan[0]['Plan']['Plan Rows'])
+    if estimate < exact_below:
+        return queryset.count(), True
+    return estimate, False
@@ -0,0 +1,141 @@
+"""
+Рейтинг книг
+
+У книги хранятся сумма и количество оценок (rating_sum, rating_count), а
+rating вычисляется из них. Создание, изменение и удаление отзыва меняет эти
+поля одним UPDATE с F()-выражениями: запись отзыва не зависит от количества
+отзывов у книги, а параллельные отзывы не затирают изменения друг друга.
+
+recompute_ratings пересчитывает рейтинг по таблице отзывов (команда
+recompute_ratings, миграция и Book.update_rating).
+"""
+from django.db import connection
+from django.db.models import (
+    Case, Count, DecimalField, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Cast, Coalesce, Round
+from django.db.models.lookups import GreaterThan
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Book, Review
+
+
+def rating_expression(rating_sum, rating_count):
+    """rating = round(rating_sum / rating_count, 2); 0, если оценок нет"""
+    return Case(
+        When(GreaterThan(rating_count, 0), then=Round(Cast(rating_sum, FloatField()) / rating_count, 2)),
+        default=Value(0),
+        output_field=DecimalField(max_digits=3, decimal_places=2),
+    )
+
+
+def change_book_rating(book_id, rating_delta, count_delta):
+    """Атомарно меняет сумму и количество оценок книги и пересчитывает rating"""
+    if book_id is None or not (rating_delta or count_delta):
+        return
+    rating_sum = F('rating_sum') + rating_delta
+    rating_count = F('rating_count') + count_delta
+    Book.objects.filter(pk=book_id).update(
+        rating_sum=rating_sum,
+        rating_count=rating_count,
+        rating=rating_expression(rating_sum, rating_count),
+        # Карточка книги в кэше фрагментов (core.fragment_cache) устарела
+        version=F('version') + 1,
+    )
+
+
+# --- Пересчет по таблице отзывов ---
+
+RECOMPUTE_SQL = """
+    UPDATE {book} AS b
+    SET rating_sum = s.total,
+        rating_count = s.cnt,
+        rating = s.rating,
+        version = b.version + 1
+    FROM (
+        SELECT bk.id,
+               COALESCE(SUM(r.rating), 0) AS total,
+               COUNT(r.id) AS cnt,
+               CASE WHEN COUNT(r.id) > 0
+                    THEN ROUND(SUM(r.rating)::numeric / COUNT(r.id), 2)
+                    ELSE 0 END AS rating
+        FROM {book} AS bk
+        LEFT JOIN {review} AS r ON r.book_id = bk.id
+        GROUP BY bk.id
+    ) AS s
+    WHERE s.id = b.id
+      AND (b.rating_sum <> s.total OR b.rating_count <> s.cnt OR b.rating <> s.rating)
+"""
+
+
+def recompute_ratings(books=None, book_model=Book, review_model=Review):
+    """
+    Пересчитывает rating_sum, rating_count и rating по отзывам.
+
+    Для всего каталога на PostgreSQL выполняется один UPDATE ... FROM
+    с агрегатом по отзывам, обновляющий только разошедшиеся книги; для
+    части книг и других СУБД — UPDATE с подзапросами. Модели передаются
+    параметрами, чтобы функция работала и в миграциях.
+
+    Returns:
+        Количество обновленных книг
+    """
+    if books is None and connection.vendor == 'postgresql':
+        sql = RECOMPUTE_SQL.format(
+            book=connection.ops.quote_name(book_model._meta.db_table),
+            review=connection.ops.quote_name(review_model._meta.db_table),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.rowcount
+
+    if books is None:
+        books = book_model.objects.all()
+    reviews = review_model.objects.filter(book=OuterRef('pk')).order_by().values('book')
+    rating_sum = Coalesce(
+        Subquery(reviews.annotate(total=Sum('rating')).values('total'), output_field=IntegerField()), 0,
+    )
+    rating_count = Coalesce(
+        Subquery(reviews.annotate(cnt=Count('*')).values('cnt'), output_field=IntegerField()), 0,
+    )
+    return books.update(
+        rating_sum=rating_sum,
+        rating_count=rating_count,
+        rating=rating_expression(rating_sum, rating_count),
+        version=F('version') + 1,
+    )
+
+
+# --- Отзывы ---
+
+@receiver(pre_save, sender=Review)
+def remember_previous_review_rating(sender, instance, raw=False, **kwargs):
+    instance._previous_rating = None
+    if raw or instance._state.adding:
+        return
+    instance._previous_rating = (
+        Review.objects.filter(pk=instance.pk).values_list('book_id', 'rating').first()
+    )
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_review_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else getattr(instance, '_previous_rating', None)
+    if previous is None:
+        change_book_rating(instance.book_id, instance.rating, 1)
+        return
+
+    previous_book_id, previous_rating = previous
+    if previous_book_id == instance.book_id:
+        change_book_rating(instance.book_id, instance.rating - previous_rating, 0)
+    else:
+        change_book_rating(previous_book_id, -previous_rating, -1)
+        change_book_rating(instance.book_id, instance.rating, 1)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_review_delete(sender, instance, **kwargs):
+    change_book_rating(instance.book_id, -instance.rating, -1)
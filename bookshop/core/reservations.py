@@ -0,0 +1,195 @@
+"""
+Резерв товаров корзинами
+
+Товар в корзине удерживается (StockHold) на STOCK_HOLD_TTL минут, и пока
+резерв действует, другие покупатели не могут его забрать. Сумма резервов
+товара хранится в reserved_quantity товара и меняется только условным UPDATE:
+резерв увеличивается, только если stock_quantity >= reserved_quantity + delta,
+поэтому параллельные корзины не могут зарезервировать больше, чем есть на складе.
+
+Блокировки берутся в одном порядке: строки корзины → резервы → товары
+(по типу и id), поэтому корзины, оформление заказа и release_expired() не
+ждут друг друга по кругу. Истекшие резервы снимает команда release_stock_holds.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .caching import bump_catalog_on_commit
+from .models import Book, Cart, Stationery, StockHold
+
+
+PRODUCT_MODELS = {
+    'book': Book,
+    'stationery': Stationery,
+}
+
+
+def hold_expires_at():
+    return timezone.now() + timedelta(minutes=settings.STOCK_HOLD_TTL)
+
+
+def _change_reserved(product_type, product_id, delta):
+    """Меняет резерв товара на delta; увеличение — только в пределах остатка"""
+    model = PRODUCT_MODELS.get(product_type)
+    if model is None or not delta:
+        return False
+    products = model.objects.filter(pk=product_id)
+    if delta > 0:
+        products = products.filter(stock_quantity__gte=F('reserved_quantity') + delta)
+    if not products.update(reserved_quantity=Greatest(F('reserved_quantity') + delta, Value(0))):
+        return False
+    bump_catalog_on_commit()
+    return True
+
+
+def _unreserve(holds):
+    """Удаляет резервы и уменьшает reserved_quantity товаров (по товару за запрос)"""
+    if not holds:
+        return
+    StockHold.objects.filter(pk__in=[hold.pk for hold in holds]).delete()
+    totals = defaultdict(int)
+    for hold in holds:
+        totals[(hold.product_type, hold.product_id)] += hold.quantity
+    for (product_type, product_id), quantity in sorted(totals.items()):
+        _change_reserved(product_type, product_id, -quantity)
+
+
+@transaction.atomic
+def set_hold(cart, product_type, product_id, quantity):
+    """
+    Резервирует для корзины ровно quantity единиц товара и продлевает резерв.
+
+    Returns:
+        False, если свободного товара не хватило (резерв не изменился)
+    """
+    hold = StockHold.objects.select_for_update().filter(
+        cart=cart, product_type=product_type, product_id=product_id,
+    ).first()
+    held = hold.quantity if hold else 0
+    delta = quantity - held
+    if delta > 0 and not _change_reserved(product_type, product_id, delta):
+        return False
+    if delta < 0:
+        _change_reserved(product_type, product_id, delta)
+
+    if quantity <= 0:
+        if hold:
+            hold.delete()
+    elif hold:
+        hold.quantity = quantity
+        hold.expires_at = hold_expires_at()
+        hold.save(update_fields=['quantity', 'expires_at'])
+    else:
+        StockHold.objects.create(
+            cart=cart, product_type=product_type, product_id=product_id,
+            quantity=quantity, expires_at=hold_expires_at(),
+        )
+    return True
+
+
+def extend_holds(cart):
+    """Продлевает все резервы корзины — один запрос"""
+    StockHold.objects.filter(cart=cart).update(expires_at=hold_expires_at())
+
+
+@transaction.atomic
+def release_holds(cart, keys=None):
+    """Снимает резервы корзины (все или только товары keys: [(тип, id), ...])"""
+    holds = list(StockHold.objects.select_for_update().filter(cart=cart))
+    if keys is not None:
+        keys = set(keys)
+        holds = [hold for hold in holds if (hold.product_type, hold.product_id) in keys]
+    _unreserve(holds)
+
+
+@transaction.atomic
+def move_holds(source, target):
+    """Переносит резервы source в target (при объединении корзин); reserved_quantity не меняется"""
+    existing = {
+        (hold.product_type, hold.product_id): hold
+        for hold in StockHold.objects.select_for_update().filter(cart=target)
+    }
+    to_update, to_delete = [], []
+    for hold in StockHold.objects.select_for_update().filter(cart=source):
+        current = existing.get((hold.product_type, hold.product_id))
+        if current is None:
+            hold.cart = target
+            to_update.append(hold)
+        else:
+            current.quantity += hold.quantity
+            current.expires_at = max(current.expires_at, hold.expires_at)
+            to_update.append(current)
+            to_delete.append(hold.pk)
+    StockHold.objects.filter(pk__in=to_delete).delete()
+    StockHold.objects.bulk_update(to_update, ['cart', 'quantity', 'expires_at'])
+
+
+@receiver(pre_delete, sender=Cart, dispatch_uid='release_cart_holds')
+def release_cart_holds(sender, instance, **kwargs):
+    """Удаляемая корзина (clear_carts, объединение, админка) освобождает свои резервы"""
+    release_holds(instance)
+
+
+# --- Обслуживание ---
+
+def release_expired(batch_size=500):
+    """
+    Снимает истекшие резервы пачками по batch_size.
+
+    Резервы, заблокированные оформляемыми сейчас заказами, пропускаются
+    (SKIP LOCKED) и будут сняты при следующем запуске.
+
+    Returns:
+        Количество снятых резервов
+    """
+    released = 0
+    while True:
+        with transaction.atomic():
+            holds = list(
+                StockHold.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=timezone.now())
+                .order_by('pk')[:batch_size]
+            )
+            _unreserve(holds)
+        released += len(holds)
+        if len(holds) < batch_size:
+            return released
+
+
+def _held_total(product_type):
+    """Сумма резервов товара (для annotate/update)"""
+    return Coalesce(
+        Subquery(
+            StockHold.objects.filter(product_type=product_type, product_id=OuterRef('pk'))
+            .values('product_id').annotate(total=Sum('quantity')).values('total'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def reconcile_reserved():
+    """
+    Пересчитывает reserved_quantity товаров по таблице резервов.
+
+    Returns:
+        Количество исправленных товаров
+    """
+    fixed = 0
+    for product_type, model in PRODUCT_MODELS.items():
+        fixed += (
+            model.objects.annotate(held=_held_total(product_type))
+            .exclude(reserved_quantity=F('held'))
+            .update(reserved_quantity=_held_total(product_type))
+        )
+    if fixed:
+        bump_catalog_on_commit()
+    return fixed
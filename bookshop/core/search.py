@@ -0,0 +1,242 @@
+"""
+Полнотекстовый поиск книг
+
+Два движка (settings.SEARCH_BACKEND):
+- 'postgres': для каждой книги хранится документ tsvector (Book.search_vector),
+  собранный из названия, имен авторов, жанров и издателя; поиск идет по
+  GIN-индексу вместо цепочки icontains по JOIN-ам;
+- 'index': встроенный инвертированный индекс с BM25 (core.search_index),
+  используется также на СУБД, отличных от PostgreSQL.
+
+Документы обновляются сигналами при изменении книги и связанных с ней авторов,
+жанров и издателей.
+"""
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce, Concat
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .jobs import enqueue
+from .models import Author, Book, Genre, Job, Publisher
+from .search_index import get_search_index, iter_book_documents
+
+
+def get_search_backend():
+    """Активный движок поиска: 'postgres' или 'index'"""
+    if settings.SEARCH_BACKEND == 'postgres' and connection.vendor == 'postgresql':
+        return 'postgres'
+    return 'index'
+
+
+def is_fulltext_available():
+    """Полнотекстовый поиск PostgreSQL доступен и включен"""
+    return get_search_backend() == 'postgres'
+
+
+def search_vector_expression(author_model=Author, genre_model=Genre, publisher_model=Publisher):
+    """
+    Выражение для UPDATE, собирающее документ книги одним запросом.
+
+    Имена авторов и жанры агрегируются подзапросами, поэтому выражение
+    можно применять к произвольному набору книг без выборки их в Python.
+    Модели передаются параметрами, чтобы выражение работало и в миграциях.
+    """
+    config = settings.SEARCH_CONFIG
+    authors = Subquery(
+        author_model.objects.filter(books=OuterRef('pk'))
+        .values('books')
+        .annotate(names=StringAgg(
+            Concat(
+                'last_name', Value(' '), 'first_name', Value(' '), Coalesce('middle_name', Value('')),
+            ),
+            delimiter=' ',
+        ))
+        .values('names')[:1]
+    )
+    genres = Subquery(
+        genre_model.objects.filter(books=OuterRef('pk'))
+        .values('books')
+        .annotate(names=StringAgg('name', delimiter=' '))
+        .values('names')[:1]
+    )
+    publisher = Subquery(
+        publisher_model.objects.filter(pk=OuterRef('publisher_id')).values('name')[:1]
+    )
+    return (
+        SearchVector('title', weight='A', config=config)
+        + SearchVector(authors, weight='B', config=config)
+        + SearchVector(genres, weight='C', config=config)
+        + SearchVector(publisher, weight='C', config=config)
+    )
+
+
+def update_search_vectors(books=None):
+    """Пересчитывает search_vector для набора книг (queryset или список id, по умолчанию — все)"""
+    if not is_fulltext_available():
+        return 0
+    if books is None:
+        books = Book.objects.all()
+    if isinstance(books, (list, tuple, set)):
+        books = Book.objects.filter(pk__in=books)
+    return Book.objects.filter(pk__in=books.values('pk')).update(
+        search_vector=search_vector_expression()
+    )
+
+
+def build_search_query(text):
+    """
+    Превращает строку пользователя в tsquery с поиском по префиксу.
+
+    Каждое слово ищется как префикс ("толст" найдет "Толстой"), слова
+    объединяются через AND. Возвращает None, если в строке нет слов.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    raw = ' & '.join(f'{word}:*' for word in words)
+    return SearchQuery(raw, search_type='raw', config=settings.SEARCH_CONFIG)
+
+
+def search_books_queryset(text, queryset=None):
+    """
+    Возвращает книги, подходящие под запрос, с аннотацией rank.
+
+    rank — ts_rank для PostgreSQL или оценка BM25 встроенного индекса.
+    """
+    if queryset is None:
+        queryset = Book.objects.all()
+    nothing_found = queryset.annotate(rank=Value(0.0, output_field=FloatField())).none()
+
+    if not is_fulltext_available():
+        results = get_search_index().search(text, limit=settings.SEARCH_INDEX_MAX_RESULTS)
+        if not results:
+            return nothing_found
+        # БД нужна только для выборки найденных книг по id
+        return queryset.filter(pk__in=[book_id for book_id, _ in results]).annotate(
+            rank=Case(
+                *[When(pk=book_id, then=Value(score)) for book_id, score in results],
+                default=Value(0.0),
+                output_field=FloatField(),
+            )
+        )
+
+    search_query = build_search_query(text)
+    if search_query is None:
+        return nothing_found
+    # ts_rank возвращает real; приводим к double precision, чтобы значение
+    # без потерь проходило через курсор пагинации и сравнивалось точно
+    return queryset.filter(search_vector=search_query).annotate(
+        rank=Cast(SearchRank(F('search_vector'), search_query), FloatField())
+    )
+
+
+def update_index_documents(book_ids):
+    """Обновляет документы книг во встроенном индексе процесса"""
+    book_ids = set(book_ids)
+    if not book_ids:
+        return
+    index = get_search_index()
+    found = set()
+    for book_id, terms in iter_book_documents(Book.objects.filter(pk__in=book_ids)):
+        index.update(book_id, terms)
+        found.add(book_id)
+    for book_id in book_ids - found:
+        index.remove(book_id)
+
+
+def schedule_index_rebuild():
+    """Ставит в очередь перестройку файла индекса, если она еще не запланирована"""
+    if not Job.objects.filter(name='rebuild_search_index', status=Job.Status.PENDING).exists():
+        enqueue('rebuild_search_index', delay=timedelta(seconds=settings.SEARCH_INDEX_REBUILD_DELAY))
+
+
+def reindex_books(books):
+    """Обновляет поисковые документы книг в активном движке"""
+    if is_fulltext_available():
+        update_search_vectors(books)
+        return
+    if not isinstance(books, (list, tuple, set)):
+        books = list(books.values_list('pk', flat=True))
+    if not books:
+        return
+    # Индекс процесса не транзакционный: применяем изменения после коммита
+    transaction.on_commit(lambda: update_index_documents(books))
+    # Дельта есть только в этом процессе — остальные увидят изменения после перестройки
+    schedule_index_rebuild()
+
+
+# --- Поддержка поисковых документов в актуальном состоянии ---
+
+@receiver(post_save, sender=Book)
+def update_book_search_document(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    reindex_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def remove_deleted_book_from_index(sender, instance, **kwargs):
+    if not is_fulltext_available():
+        reindex_books([instance.pk])
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.genres.through)
+def update_search_document_on_m2m(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if not reverse:
+        # Изменены авторы/жанры книги
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            reindex_books([instance.pk])
+        return
+
+    # Изменены книги автора/жанра (author.books.add(...))
+    if action == 'pre_clear':
+        # После clear() список затронутых книг уже не получить
+        instance._search_affected_books = list(instance.books.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        reindex_books(getattr(instance, '_search_affected_books', []))
+    elif action in ('post_add', 'post_remove'):
+        reindex_books(list(pk_set))
+
+
+@receiver(post_save, sender=Author)
+def update_author_books_search_document(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    reindex_books(Book.objects.filter(authors=instance))
+
+
+@receiver(post_save, sender=Genre)
+def update_genre_books_search_document(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    reindex_books(Book.objects.filter(genres=instance))
+
+
+@receiver(post_save, sender=Publisher)
+def update_publisher_books_search_document(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    reindex_books(Book.objects.filter(publisher=instance))
+
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Genre)
+@receiver(pre_delete, sender=Publisher)
+def remember_books_before_delete(sender, instance, **kwargs):
+    # Связи удаляются каскадно без m2m_changed, поэтому запоминаем книги заранее
+    instance._search_affected_books = list(instance.books.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Publisher)
+def update_books_search_document_after_delete(sender, instance, **kwargs):
+    reindex_books(getattr(instance, '_search_affected_books', []))
@@ -0,0 +1,537 @@
+"""
+Встроенный поисковый индекс книг (инвертированный индекс + BM25)
+
+Используется там, где нет полнотекстового поиска PostgreSQL (SQLite в
+разработке и тестах) или когда SEARCH_BACKEND = 'index'. Индекс строится
+командой build_search_index и сохраняется в файл, который открывается через
+mmap: словарь термов лежит в заголовке, а списки вхождений — в плоских
+массивах uint32/uint16, поэтому загрузка не требует разбора всех данных.
+
+Изменения книг после построения накапливаются в памяти процесса (дельта):
+обновленная книга помечается удаленной в основном индексе и добавляется в
+дельту. Дельта есть только у процесса, сохранившего книгу, поэтому изменение
+заодно ставит в очередь перестройку файла (задача rebuild_search_index,
+не раньше чем через SEARCH_INDEX_REBUILD_DELAY секунд); остальные процессы
+видят изменения, когда перечитывают перестроенный файл. Запрос индекс не
+строит: пока файла нет, поиск ничего не находит.
+"""
+import bisect
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import logging
+import threading
+from array import array
+from collections import Counter
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# --- Токенизация ---
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_CYRILLIC_RE = re.compile(r'[а-я]')
+
+STOP_WORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по
+только ее мне было вот от меня еще нет о из ему теперь когда даже ну ли если уже
+или ни быть был него до вас нибудь опять уж вам ведь там потом себя ничего ей
+может они тут где есть надо ней для мы тебя их чем была сам чтоб без будто чего
+раз тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь
+этом один почти мой тем чтобы нее были куда зачем всех никогда можно при наконец
+два об другой хоть после над больше тот через эти нас про всего них какая много
+разве три эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя
+такой им более всегда конечно всю между
+a an and are as at be by for from in is it of on or the to with
+""".split())
+
+
+class RussianStemmer:
+    """Облегченная реализация стеммера Snowball для русского языка"""
+
+    VOWELS = 'аеиоуыэюя'
+
+    PERFECTIVE_GERUND = (('в', 'вши', 'вшись'), ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+    ADJECTIVE = (
+        'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+        'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+    )
+    PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+    REFLEXIVE = ('ся', 'сь')
+    VERB = (
+        ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+        ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым',
+         'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'),
+    )
+    NOUN = (
+        'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий',
+        'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю',
+        'ия', 'ья', 'я',
+    )
+    DERIVATIONAL = ('ост', 'ость')
+    SUPERLATIVE = ('ейш', 'ейше')
+
+    def _regions(self, word):
+        """Возвращает начала областей RV и R2"""
+        rv = len(word)
+        for i, char in enumerate(word):
+            if char in self.VOWELS:
+                rv = i + 1
+                break
+        r1 = self._next_region(word, 0)
+        r2 = self._next_region(word, r1)
+        return rv, r2
+
+    def _next_region(self, word, start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in self.VOWELS and word[i - 1] in self.VOWELS:
+                return i + 1
+        return len(word)
+
+    @staticmethod
+    def _strip(rv, endings):
+        """Отрезает самое длинное окончание из endings"""
+        for ending in sorted(endings, key=len, reverse=True):
+            if rv.endswith(ending):
+                return rv[:-len(ending)], True
+        return rv, False
+
+    def _strip_grouped(self, rv, groups):
+        """Как _strip, но окончания первой группы должны идти после 'а' или 'я'"""
+        first, second = groups
+        candidates = [(ending, True) for ending in first] + [(ending, False) for ending in second]
+        for ending, needs_a in sorted(candidates, key=lambda item: len(item[0]), reverse=True):
+            if not rv.endswith(ending):
+                continue
+            stem = rv[:-len(ending)]
+            if needs_a and not stem.endswith(('а', 'я')):
+                continue
+            return stem, True
+        return rv, False
+
+    def _strip_adjectival(self, rv):
+        stem, found = self._strip(rv, self.ADJECTIVE)
+        if found:
+            stem, _ = self._strip_grouped(stem, self.PARTICIPLE)
+        return stem, found
+
+    def stem(self, word):
+        word = word.replace('ё', 'е')
+        rv_start, r2_start = self._regions(word)
+        prefix, rv = word[:rv_start], word[rv_start:]
+
+        # Шаг 1
+        rv, found = self._strip_grouped(rv, self.PERFECTIVE_GERUND)
+        if not found:
+            rv, _ = self._strip(rv, self.REFLEXIVE)
+            for step in (self._strip_adjectival,
+                         lambda value: self._strip_grouped(value, self.VERB),
+                         lambda value: self._strip(value, self.NOUN)):
+                rv, found = step(rv)
+                if found:
+                    break
+
+        # Шаг 2
+        if rv.endswith('и'):
+            rv = rv[:-1]
+
+        # Шаг 3: словообразовательные суффиксы только в R2
+        r2 = (prefix + rv)[r2_start:] if r2_start < len(prefix + rv) else ''
+        for ending in self.DERIVATIONAL:
+            if r2.endswith(ending):
+                rv = rv[:-len(ending)]
+                break
+
+        # Шаг 4
+        if rv.endswith('нн'):
+            rv = rv[:-1]
+        else:
+            stripped, found = self._strip(rv, self.SUPERLATIVE)
+            if found:
+                rv = stripped[:-1] if stripped.endswith('нн') else stripped
+            elif rv.endswith('ь'):
+                rv = rv[:-1]
+
+        return prefix + rv
+
+
+_stemmer = RussianStemmer()
+
+
+def normalize_word(word):
+    """Приводит слово к поисковому терму: нижний регистр, ё→е, основа слова"""
+    word = word.lower().replace('ё', 'е')
+    if _CYRILLIC_RE.search(word) and len(word) > 2:
+        return _stemmer.stem(word)
+    return word
+
+
+def tokenize(text):
+    """Разбивает текст на термы (без стоп-слов)"""
+    if not text:
+        return []
+    return [
+        normalize_word(word)
+        for word in _WORD_RE.findall(text.lower())
+        if word not in STOP_WORDS
+    ]
+
+
+def book_terms(book):
+    """
+    Термы документа книги с частотами.
+
+    Название учитывается с двойным весом, затем авторы, жанры и издатель.
+    Ожидает книгу с подгруженными authors, genres и publisher.
+    """
+    terms = Counter()
+    for term in tokenize(book.title):
+        terms[term] += 2
+    for author in book.authors.all():
+        terms.update(tokenize(author.get_full_name()))
+    for genre in book.genres.all():
+        terms.update(tokenize(genre.name))
+    if book.publisher_id and book.publisher:
+        terms.update(tokenize(book.publisher.name))
+    return terms
+
+
+# --- Файл индекса ---
+
+MAGIC = b'BSIDX01\n'
+_HEADER_LENGTH = struct.Struct('<I')
+
+
+def build_index_data(documents):
+    """
+    Строит массивы индекса.
+
+    Args:
+        documents: Итерируемое (book_id, Counter термов) в порядке возрастания book_id
+    """
+    book_ids = array('I')
+    doc_lengths = array('I')
+    postings = {}
+    total_length = 0
+
+    for doc_number, (book_id, terms) in enumerate(documents):
+        book_ids.append(book_id)
+        length = sum(terms.values())
+        doc_lengths.append(length)
+        total_length += length
+        for term, frequency in terms.items():
+            postings.setdefault(term, []).append((doc_number, min(frequency, 0xFFFF)))
+
+    posting_docs = array('I')
+    posting_freqs = array('H')
+    vocabulary = []
+    for term in sorted(postings):
+        entries = postings[term]
+        vocabulary.append([term, len(posting_docs), len(entries)])
+        for doc_number, frequency in entries:
+            posting_docs.append(doc_number)
+            posting_freqs.append(frequency)
+
+    return {
+        'doc_count': len(book_ids),
+        'total_length': total_length,
+        'terms': vocabulary,
+        'book_ids': book_ids,
+        'doc_lengths': doc_lengths,
+        'posting_docs': posting_docs,
+        'posting_freqs': posting_freqs,
+    }
+
+
+SECTIONS = ('book_ids', 'doc_lengths', 'posting_docs', 'posting_freqs')
+
+
+def write_index_file(path, documents):
+    """
+    Сохраняет индекс в файл (атомарно: временный файл + rename).
+
+    Возвращает количество проиндексированных книг.
+    """
+    data = build_index_data(documents)
+    layout = {}
+    offset = 0
+    for name in SECTIONS:
+        section = data[name]
+        layout[name] = [offset, len(section), section.typecode]
+        offset += len(section) * section.itemsize
+        offset += -offset % 4  # выравнивание
+    header = json.dumps({
+        'doc_count': data['doc_count'],
+        'total_length': data['total_length'],
+        'terms': data['terms'],
+        'sections': layout,
+    }, ensure_ascii=False).encode('utf-8')
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.search_index_')
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(MAGIC)
+            handle.write(_HEADER_LENGTH.pack(len(header)))
+            handle.write(header)
+            handle.write(b'\0' * (-handle.tell() % 4))
+            for name in SECTIONS:
+                section = data[name]
+                handle.write(section.tobytes())
+                handle.write(b'\0' * (-(len(section) * section.itemsize) % 4))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return data['doc_count']
+
+
+class SearchIndex:
+    """Инвертированный индекс с ранжированием BM25"""
+
+    K1 = 1.2
+    B = 0.75
+    MAX_PREFIX_EXPANSIONS = 64
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._mmap = None
+        self._reset_base()
+        self._reset_delta()
+        if path:
+            self._load()
+
+    # --- Загрузка ---
+
+    def _reset_base(self):
+        self._set_base(build_index_data([]))
+        self._mtime = None
+
+    def _set_base(self, data):
+        with self._lock:
+            self._swap_base(data)
+
+    def _swap_base(self, data):
+        self._terms = [term for term, _, _ in data['terms']]
+        self._term_postings = {term: (start, count) for term, start, count in data['terms']}
+        self._book_ids = data['book_ids']
+        self._doc_lengths = data['doc_lengths']
+        self._posting_docs = data['posting_docs']
+        self._posting_freqs = data['posting_freqs']
+        self._doc_count = data['doc_count']
+        self._total_length = data['total_length']
+
+    def _reset_delta(self):
+        self._delta = {}      # book_id -> (Counter термов, длина)
+        self._masked = set()  # book_id из основного индекса, которые устарели
+
+    def _load(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        with open(self.path, 'rb') as handle:
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(MAGIC)] != MAGIC:
+            mapped.close()
+            raise ValueError(f'{self.path} не является файлом поискового индекса')
+
+        (header_length,) = _HEADER_LENGTH.unpack_from(mapped, len(MAGIC))
+        header_start = len(MAGIC) + _HEADER_LENGTH.size
+        header = json.loads(bytes(mapped[header_start:header_start + header_length]).decode('utf-8'))
+        data_start = header_start + header_length
+        data_start += -data_start % 4
+
+        view = memoryview(mapped)
+        for name, (offset, length, typecode) in header['sections'].items():
+            start = data_start + offset
+            itemsize = array(typecode).itemsize
+            header[name] = view[start:start + length * itemsize].cast(typecode)
+
+        self._set_base(header)
+        self._mmap = mapped
+        self._mtime = stat.st_mtime
+
+    @classmethod
+    def from_documents(cls, documents):
+        """Индекс в памяти без файла"""
+        index = cls()
+        index._set_base(build_index_data(documents))
+        return index
+
+    def reload_if_changed(self):
+        """Перечитывает файл, если он был перестроен (дельта при этом сбрасывается)"""
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._load()
+                    self._reset_delta()
+
+    # --- Инкрементальные изменения ---
+
+    def _in_base(self, book_id):
+        position = bisect.bisect_left(self._book_ids, book_id)
+        return position < len(self._book_ids) and self._book_ids[position] == book_id
+
+    def update(self, book_id, terms):
+        """Добавляет или заменяет документ книги"""
+        with self._lock:
+            if self._in_base(book_id):
+                self._masked.add(book_id)
+            self._delta[book_id] = (Counter(terms), sum(terms.values()))
+
+    def remove(self, book_id):
+        """Удаляет книгу из индекса"""
+        with self._lock:
+            if self._in_base(book_id):
+                self._masked.add(book_id)
+            self._delta.pop(book_id, None)
+
+    # --- Поиск ---
+
+    @classmethod
+    def _expand(cls, terms, word):
+        """Термы словаря terms, начинающиеся с word (точное совпадение — первым)"""
+        position = bisect.bisect_left(terms, word)
+        expansions = []
+        while (position < len(terms) and terms[position].startswith(word)
+               and len(expansions) < cls.MAX_PREFIX_EXPANSIONS):
+            expansions.append(terms[position])
+            position += 1
+        return expansions
+
+    def _idf(self, document_frequency, doc_count):
+        return math.log(1 + (doc_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def _term_weight(self, frequency, length, average_length):
+        norm = self.K1 * (1 - self.B + self.B * length / average_length)
+        return frequency * (self.K1 + 1) / (frequency + norm)
+
+    def search(self, text, limit=None):
+        """
+        Ищет книги по тексту запроса.
+
+        Каждое слово запроса ищется как префикс основы; в результат попадают
+        книги, содержащие все слова. Возвращает список (book_id, score),
+        отсортированный по убыванию score.
+        """
+        words = tokenize(text)
+        if not words:
+            return []
+
+        # Снимок основного индекса и дельты: файл может быть перечитан параллельно
+        with self._lock:
+            delta = dict(self._delta)
+            masked = set(self._masked)
+            terms_list, term_postings = self._terms, self._term_postings
+            book_ids, doc_lengths = self._book_ids, self._doc_lengths
+            posting_docs, posting_freqs = self._posting_docs, self._posting_freqs
+            doc_count, total_length = self._doc_count, self._total_length
+
+        doc_count = doc_count - len(masked) + len(delta)
+        if doc_count <= 0:
+            return []
+        total_length += sum(length for _, length in delta.values())
+        average_length = total_length / doc_count if total_length else 1.0
+
+        scores = None
+        for word in words:
+            word_scores = {}
+            for term in self._expand(terms_list, word):
+                start, count = term_postings[term]
+                idf = self._idf(count, doc_count)
+                for index in range(start, start + count):
+                    doc_number = posting_docs[index]
+                    book_id = book_ids[doc_number]
+                    if book_id in masked:
+                        continue
+                    weight = self._term_weight(posting_freqs[index], doc_lengths[doc_number], average_length)
+                    word_scores[book_id] = word_scores.get(book_id, 0.0) + idf * weight
+
+            for book_id, (terms, length) in delta.items():
+                for term, frequency in terms.items():
+                    if term.startswith(word):
+                        # df берем из основного индекса (для новых термов — 1)
+                        document_frequency = term_postings.get(term, (0, 1))[1]
+                        idf = self._idf(document_frequency, doc_count)
+                        weight = self._term_weight(frequency, length, average_length)
+                        word_scores[book_id] = word_scores.get(book_id, 0.0) + idf * weight
+
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {book_id: score + word_scores[book_id]
+                          for book_id, score in scores.items() if book_id in word_scores}
+            if not scores:
+                return []
+
+        results = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return results[:limit] if limit else results
+
+    def __len__(self):
+        with self._lock:
+            return self._doc_count - len(self._masked) + len(self._delta)
+
+
+# --- Экземпляр процесса ---
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def iter_book_documents(queryset=None, chunk_size=2000):
+    """Документы книг из БД в порядке возрастания id"""
+    from .models import Book
+
+    if queryset is None:
+        queryset = Book.objects.all()
+    books = (
+        queryset.select_related('publisher')
+        .prefetch_related('authors', 'genres')
+        .order_by('pk')
+    )
+    for book in books.iterator(chunk_size=chunk_size):
+        yield book.pk, book_terms(book)
+
+
+def get_search_index():
+    """
+    Возвращает индекс текущего процесса.
+
+    Если файл индекса еще не построен, индекс пуст и загрузится, когда файл
+    появится (build_search_index или задача rebuild_search_index).
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                if not os.path.exists(settings.SEARCH_INDEX_PATH):
+                    logger.warning(
+                        'Файл поискового индекса %s не найден: выполните build_search_index',
+                        settings.SEARCH_INDEX_PATH,
+                    )
+                _index = SearchIndex(settings.SEARCH_INDEX_PATH)
+    else:
+        _index.reload_if_changed()
+    return _index
+
+
+def reset_search_index():
+    """Сбрасывает индекс процесса (будет загружен заново при следующем запросе)"""
+    global _index
+    with _index_lock:
+        _index = None
@@ -51,7 +51,7 @@ class GenreSerializer(serializers.ModelSerializer):
 class BookSerializer(serializers.ModelSerializer):
     class Meta:
         model = Book
-        fields = "__all__"
+        exclude = ("search_vector", "version", "rating_sum", "rating_count")
 
 
 class StationerySerializer(serializers.ModelSerializer):
@@ -171,7 +171,9 @@ class SupportMessageSerializer(serializers.ModelSerializer):
 
 class AuditLogSerializer(serializers.ModelSerializer):
     user_email = serializers.CharField(source='user.email', read_only=True, allow_null=True)
+    url_path = serializers.CharField(read_only=True, allow_null=True)
+    user_agent = serializers.CharField(read_only=True, allow_null=True)
     
     class Meta:
         model = AuditLog
-        fields = "__all__"
+        exclude = ('path', 'agent')
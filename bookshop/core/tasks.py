@@ -0,0 +1,48 @@
+"""
+Фоновые задачи магазина (выполняются командой run_workers, см. core.jobs)
+
+Постобработка заказа вынесена из запроса оформления: начисление бонусов и
+запись в журнал аудита ставятся в очередь в транзакции заказа и выполняются
+после ее коммита. Письма отправляет диспетчер core.outbox.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+
+from .jobs import register
+from .models import AuditLog, LoyaltyCard, Order
+from .search_index import iter_book_documents, write_index_file
+
+
+@register('accrue_loyalty')
+def accrue_loyalty(card_id, amount, bonus, order_id=None):
+    """Начисляет обещанные при оформлении бонусы и увеличивает сумму покупок карты"""
+    card = LoyaltyCard.objects.filter(pk=card_id).first()
+    if card is not None:
+        card.add_purchase(Decimal(amount), bonus=Decimal(bonus))
+
+
+@register('log_order_created')
+def log_order_created(order_id, user_id=None, ip_address=None, user_agent=None, url_path=None):
+    """Запись о создании заказа в журнале аудита (с данными запроса оформления)"""
+    order = Order.objects.filter(pk=order_id).first()
+    if order is None:
+        return
+    AuditLog(
+        user_id=user_id,
+        action='create',
+        model_name='Order',
+        object_id=order.pk,
+        object_repr=f'Заказ #{order.pk}',
+        description=f'Создан заказ #{order.pk} на сумму {order.total_amount} руб. ({order.get_fulfillment_type_display()})',
+        url_path=url_path,
+        ip_address=ip_address,
+        user_agent=user_agent,
+        created_at=order.created_at,
+    ).save()
+
+
+@register('rebuild_search_index')
+def rebuild_search_index():
+    """Перестраивает файл встроенного поискового индекса (все процессы перечитают его)"""
+    write_index_file(settings.SEARCH_INDEX_PATH, iter_book_documents())
@@ -0,0 +1,37 @@
+from django import template
+
+from core.fragment_cache import get_card_fragment, set_card_fragment
+
+register = template.Library()
+
+
+class BookCardNode(template.Node):
+    def __init__(self, nodelist, book, variant):
+        self.nodelist = nodelist
+        self.book = book
+        self.variant = variant
+
+    def render(self, context):
+        book = self.book.resolve(context)
+        variant = self.variant.resolve(context)
+        html = get_card_fragment(book, variant)
+        if html is None:
+            html = self.nodelist.render(context)
+            set_card_fragment(book, variant, html)
+        return html
+
+
+@register.tag
+def bookcard(parser, token):
+    """
+    Кэширует часть карточки книги (см. core.fragment_cache).
+
+    Использование: {% bookcard book "list" %} ... {% endbookcard %}
+    Внутри не должно быть ничего, что зависит от пользователя (формы, csrf_token).
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' принимает книгу и вариант карточки")
+    nodelist = parser.parse(('endbookcard',))
+    parser.delete_first_token()
+    return BookCardNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
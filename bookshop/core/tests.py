@@ -1,3 +1,1286 @@
-from django.test import TestCase
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from smtplib import SMTPException
+from unittest import skipIf, skipUnless
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.http import QueryDict
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import audit_partitions, autocomplete, outbox
+from .audit import explicit_audit, get_current_request, reset_current_request, set_current_request
+from .audit_archive import AuditArchive, archive_before, archived_entry
+from .audit_lookups import LookupCache, encode_entries
+from .audit_metadata import get_filter_metadata, get_log_stats
+from .audit_writer import AuditWriter
+from .autocomplete import PrefixIndex
+from .book_counts import reconcile_books_counts
+from .card_numbers import card_numbers, format_card_number, is_valid, issue_cards, luhn_check_digit
+from .cart import SESSION_KEY as CART_SESSION_KEY, add_line, revalidate
+from .caching import get_wishlist_count
+from .checkout import DuplicateCheckout, OutOfStock, decrement_stock, existing_order_id, place_order
+from .context_processors import categories_context, wishlist_context
+from .facets import apply_facet_filters, compute_facets
+from .fragment_cache import card_stats, prefetch_book_cards
+from .jobs import claim, enqueue, execute, register, requeue_stale, retry_failed
+from .models import (
+    AuditLog, AuditPath, AuditUserAgent, Author, Book, Cart, Genre, Job, LoyaltyCard, Order, OutboxEmail, Publisher,
+    Review, StockHold, User, ViewCounter, Wishlist,
+)
+from .pagination import KeysetPaginator
+from .ratings import recompute_ratings
+from .reservations import reconcile_reserved, release_expired, set_hold
+from .search import build_search_query, get_search_backend, search_books_queryset
+from .search_index import (
+    SearchIndex, get_search_index, iter_book_documents, normalize_word, reset_search_index, tokenize,
+    write_index_file,
+)
+from .view_counters import ViewCounterBuffer, most_viewed, save_counts, view_totals
+
+
+_isbn_numbers = itertools.count(1)
+
+
+def create_book(title='Книга', stock=10, price='100.00', **fields):
+    return Book.objects.create(
+        title=title, isbn13=f'978{next(_isbn_numbers):010d}', language='ru',
+        price=Decimal(price), stock_quantity=stock, **fields
+    )
+
+
+def create_user(name='buyer'):
+    return User.objects.create_user(username=name, email=f'{name}@example.com', password='password')
+
+
+class IsolatedSearchIndexMixin:
+    """
+    Встроенный индекс теста: пустой файл во временном каталоге, свой экземпляр процесса.
+
+    Изменения попадают в индекс после коммита (captureOnCommitCallbacks), поэтому
+    журнал аудита пишется сразу, а не фоновым потоком.
+    """
+
+    def setUp(self):
+        super().setUp()
+        audit = self.settings(AUDIT_ASYNC=False)
+        audit.enable()
+        self.addCleanup(audit.disable)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.index_path = f'{directory}/search_index.bin'
+        write_index_file(self.index_path, [])
+        override = self.settings(SEARCH_INDEX_PATH=self.index_path)
+        override.enable()
+        self.addCleanup(override.disable)
+        reset_search_index()
+        self.addCleanup(reset_search_index)
+
+
+ORDER_FIELDS = {
+    'full_name': 'Иван Иванов',
+    'email': 'buyer@example.com',
+    'phone': '+70000000000',
+    'fulfillment_type': Order.FulfillmentType.PICKUP,
+}
+
+
+class PlaceOrderTests(TestCase):
+    """Оформление заказа (core.checkout.place_order)"""
+
+    def setUp(self):
+        self.user = create_user()
+        self.book = create_book(stock=5)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def checkout(self, quantity, **kwargs):
+        self.assertTrue(add_line(self.cart, 'book', self.book.pk, quantity, self.book.price))
+        items, total, _, _ = revalidate(self.cart)
+        return place_order(items, total, ORDER_FIELDS, user=self.user, cart=self.cart, **kwargs)
+
+    def test_sale_consumes_cart_hold(self):
+        order, _, _, _ = self.checkout(2)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.stock_quantity, self.book.reserved_quantity), (3, 0))
+        self.assertEqual(order.items.get().quantity, 2)
+        self.assertFalse(StockHold.objects.filter(cart=self.cart).exists())
+
+    def test_out_of_stock_rolls_back(self):
+        other = create_book('Другая книга', stock=1)
+        add_line(self.cart, 'book', self.book.pk, 2, self.book.price)
+        items, total, _, _ = revalidate(self.cart)
+        items.append({
+            'product_type': 'book', 'product_id': other.pk, 'name': other.title,
+            'price': other.price, 'quantity': 3, 'subtotal': other.price * 3,
+        })
+
+        with self.assertRaises(OutOfStock):
+            place_order(items, total, ORDER_FIELDS, user=self.user, cart=self.cart)
+
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.stock_quantity, self.book.reserved_quantity), (5, 2))
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Job.objects.filter(name='accrue_loyalty').exists())
+
+    def test_bonuses_spent_and_promised_bonus_queued(self):
+        LoyaltyCard.objects.create(user=self.user, balance=Decimal('50'))
+        order, used, bonus, created = self.checkout(2, use_bonuses=Decimal('30'))
+
+        card = LoyaltyCard.objects.get(user=self.user)
+        self.assertFalse(created)
+        self.assertEqual(used, Decimal('30'))
+        self.assertEqual(order.total_amount, Decimal('170.00'))
+        self.assertEqual(card.balance, Decimal('20.00'))
+
+        # Начисляется ровно обещанный при оформлении бонус
+        job = Job.objects.get(name='accrue_loyalty')
+        self.assertEqual(Decimal(job.payload['bonus']), bonus)
+        claimed = next(claimed for claimed in claim('test-worker') if claimed.pk == job.pk)
+        self.assertEqual(execute(claimed), Job.Status.DONE)
+        card.refresh_from_db()
+        self.assertEqual(card.balance, Decimal('20.00') + bonus)
+
+    def test_bonuses_not_spent_beyond_balance(self):
+        LoyaltyCard.objects.create(user=self.user, balance=Decimal('10'))
+        order, used, _, _ = self.checkout(1, use_bonuses=Decimal('30'))
+        self.assertEqual(used, Decimal('0'))
+        self.assertEqual(order.total_amount, Decimal('100.00'))
+
+    def test_repeated_key_returns_existing_order(self):
+        order, _, _, _ = self.checkout(1, key='checkout-key')
+        self.assertEqual(existing_order_id('checkout-key'), order.pk)
+        items, total, _, _ = revalidate(self.cart)
+
+        with self.assertRaises(DuplicateCheckout) as raised:
+            place_order(items, total, ORDER_FIELDS, user=self.user, cart=self.cart, key='checkout-key')
+
+        self.assertEqual(raised.exception.order_id, order.pk)
+        self.assertEqual(Order.objects.count(), 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock_quantity, 4)
+
+    def test_repeated_form_redirects_to_order(self):
+        order, _, _, _ = self.checkout(1, key='checkout-key')
+        response = self.client.post(reverse('checkout'), {'idempotency_key': 'checkout-key'})
+        self.assertRedirects(response, reverse('order_success', args=[order.pk]), fetch_redirect_response=False)
+
+
+class KeysetPaginatorTests(TestCase):
+    """Курсорная пагинация (core.pagination)"""
+
+    def test_round_trip(self):
+        for number in range(23):
+            create_book(f'Книга {number:02d}', rating=Decimal(number % 4))
+        paginator = KeysetPaginator(('-rating', 'title', 'id'), per_page=5)
+        expected = list(Book.objects.order_by('-rating', 'title', 'id').values_list('pk', flat=True))
+
+        pages, cursor = [], None
+        while True:
+            page = paginator.paginate(Book.objects.all(), cursor)
+            pages.append(page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual([book.pk for page in pages for book in page], expected)
+        self.assertEqual(len(pages), 5)
+
+        # Назад с последней страницы — те же страницы в обратном порядке
+        page = pages[-1]
+        for previous in reversed(pages[:-1]):
+            page = paginator.paginate(Book.objects.all(), page.previous_cursor)
+            self.assertEqual([book.pk for book in page], [book.pk for book in previous])
+        self.assertFalse(page.has_previous)
+
+    def test_nullable_field_sorted_last(self):
+        for number, year in enumerate((2001, None, 1999, None, 2005)):
+            create_book(f'Книга {number}', publication_year=year)
+        paginator = KeysetPaginator(('publication_year', 'title', 'id'), per_page=2, nullable=('publication_year',))
+
+        years, cursor = [], None
+        while True:
+            page = paginator.paginate(Book.objects.all(), cursor)
+            years += [book.publication_year for book in page]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(years, [1999, 2001, 2005, None, None])
+
+    def test_foreign_or_broken_cursor_starts_from_beginning(self):
+        create_book('Первая')
+        create_book('Вторая')
+        cursor = KeysetPaginator(('title', 'id'), per_page=1).paginate(Book.objects.all()).next_cursor
+        self.assertIsNotNone(cursor)
+        paginator = KeysetPaginator(('-rating', 'title', 'id'), per_page=1)
+        self.assertFalse(paginator.paginate(Book.objects.all(), cursor).has_previous)
+        self.assertFalse(paginator.paginate(Book.objects.all(), 'не-курсор').has_previous)
+
+
+@override_settings(CATALOG_PAGE_SIZE=2)
+class CatalogPaginationViewTests(TestCase):
+    """Курсорная пагинация страниц каталога"""
+
+    def setUp(self):
+        cache.clear()
+        for number in range(5):
+            create_book(f'Книга {number}', rating=Decimal(number))
+
+    def test_cursor_walks_all_books(self):
+        titles, cursor = [], None
+        while True:
+            response = self.client.get(reverse('books_list'), {'cursor': cursor} if cursor else {})
+            self.assertEqual(response.status_code, 200)
+            page = response.context['page']
+            titles += [book.title for book in page]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(titles, [f'Книга {number}' for number in range(4, -1, -1)])
+
+
+class FullTextSearchTests(IsolatedSearchIndexMixin, TestCase):
+    """Поиск книг (core.search): PostgreSQL или встроенный индекс на других СУБД"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        # Встроенный индекс процесса применяет изменения после коммита
+        with self.captureOnCommitCallbacks(execute=True):
+            tolstoy = Author.objects.create(first_name='Лев', last_name='Толстой')
+            novel = Genre.objects.create(name='Роман')
+            self.war = create_book('Война и мир', publisher=Publisher.objects.create(name='Эксмо'))
+            self.anna = create_book('Анна Каренина')
+            self.other = create_book('Мастер и Маргарита')
+            self.war.authors.add(tolstoy)
+            self.anna.authors.add(tolstoy)
+            novel.books.add(self.war, self.other)
+
+    def found(self, text):
+        return set(search_books_queryset(text).values_list('title', flat=True))
+
+    def test_backend_falls_back_off_postgres(self):
+        with self.settings(SEARCH_BACKEND='postgres'):
+            expected = 'postgres' if connection.vendor == 'postgresql' else 'index'
+            self.assertEqual(get_search_backend(), expected)
+
+    def test_query_words_are_prefixes(self):
+        self.assertIsNone(build_search_query(' !? '))
+        self.assertIsNotNone(build_search_query('толст, мир'))
+
+    def test_matches_title_author_genre_and_publisher(self):
+        self.assertEqual(self.found('толст'), {'Война и мир', 'Анна Каренина'})
+        self.assertEqual(self.found('толст мир'), {'Война и мир'})
+        self.assertEqual(self.found('войн'), {'Война и мир'})
+        self.assertEqual(self.found('роман'), {'Война и мир', 'Мастер и Маргарита'})
+        self.assertEqual(self.found('эксмо'), {'Война и мир'})
+        self.assertEqual(self.found(''), set())
+
+    def test_documents_follow_related_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Author.objects.filter(last_name='Толстой').get().books.remove(self.anna)
+            Genre.objects.get(name='Роман').delete()
+        self.assertEqual(self.found('толст'), {'Война и мир'})
+        self.assertEqual(self.found('роман'), set())
+
+    def test_search_page_ranks_title_matches_first(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_book('Роман о романе')
+        response = self.client.get(reverse('search_books'), {'q': 'роман'})
+        self.assertEqual(response.status_code, 200)
+        titles = [book.title for book in response.context['books']]
+        self.assertEqual(titles[0], 'Роман о романе')
+        self.assertEqual(set(titles), {'Роман о романе', 'Война и мир', 'Мастер и Маргарита'})
+
+
+class SearchIndexTests(IsolatedSearchIndexMixin, TestCase):
+    """Встроенный поисковый индекс (core.search_index)"""
+
+    DOCUMENTS = [
+        (1, Counter({'войн': 2, 'мир': 2, 'толст': 1})),
+        (2, Counter({'мир': 1, 'мастер': 2})),
+        (5, Counter({'мирн': 2, 'жизн': 2})),
+    ]
+
+    def test_tokenize_stems_and_drops_stop_words(self):
+        self.assertEqual(tokenize('Война и мир'), ['войн', 'мир'])
+        self.assertEqual(normalize_word('Книги'), normalize_word('книга'))
+        self.assertEqual(tokenize('The Lord of the Rings'), ['lord', 'rings'])
+
+    def test_all_words_required_and_prefixes_expanded(self):
+        index = SearchIndex.from_documents(self.DOCUMENTS)
+        self.assertEqual({book_id for book_id, _ in index.search('мир')}, {1, 2, 5})
+        self.assertEqual([book_id for book_id, _ in index.search('войн мир')], [1])
+        self.assertEqual(index.search('войн жизн'), [])
+
+    def test_bm25_prefers_frequent_terms(self):
+        index = SearchIndex.from_documents(self.DOCUMENTS)
+        ranked = [book_id for book_id, _ in index.search('мастер')]
+        self.assertEqual(ranked, [2])
+        scores = dict(index.search('мир'))
+        self.assertGreater(scores[1], scores[2])
+
+    def test_file_round_trip_and_delta(self):
+        self.assertEqual(write_index_file(self.index_path, self.DOCUMENTS), 3)
+        index = SearchIndex(self.index_path)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.search('мастер'), SearchIndex.from_documents(self.DOCUMENTS).search('мастер'))
+
+        index.update(2, Counter({'роман': 1}))
+        index.update(7, Counter({'мастер': 1}))
+        index.remove(1)
+        self.assertEqual([book_id for book_id, _ in index.search('мастер')], [7])
+        self.assertEqual({book_id for book_id, _ in index.search('мир')}, {5})
+        self.assertEqual(len(index), 3)
+
+    def test_rebuilt_file_replaces_delta(self):
+        write_index_file(self.index_path, self.DOCUMENTS[:1])
+        index = SearchIndex(self.index_path)
+        index.update(9, Counter({'мастер': 1}))
+
+        write_index_file(self.index_path, self.DOCUMENTS)
+        os.utime(self.index_path, ns=(1, 1))
+        index.reload_if_changed()
+        self.assertEqual([book_id for book_id, _ in index.search('мастер')], [2])
+
+    def test_missing_file_is_not_built_in_request(self):
+        os.remove(self.index_path)
+        reset_search_index()
+        create_book('Война и мир')
+        with self.assertLogs('core.search_index', 'WARNING'), self.assertNumQueries(0):
+            self.assertEqual(get_search_index().search('войн'), [])
+
+        write_index_file(self.index_path, iter_book_documents())
+        self.assertEqual(len(get_search_index().search('войн')), 1)
+
+    @override_settings(SEARCH_BACKEND='index')
+    def test_changes_schedule_one_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            book = create_book('Мастер и Маргарита')
+            guard = create_book('Белая гвардия')
+        self.assertEqual(Job.objects.filter(name='rebuild_search_index', status=Job.Status.PENDING).count(), 1)
+        # Процесс, изменивший книгу, видит ее сразу (дельта)
+        self.assertEqual([book_id for book_id, _ in get_search_index().search('маргарит')], [book.pk])
+
+        Job.objects.filter(name='rebuild_search_index').update(run_at=timezone.now())
+        self.assertEqual(execute(claim('test-worker')[0]), Job.Status.DONE)
+        fresh = SearchIndex(self.index_path)
+        self.assertEqual([book_id for book_id, _ in fresh.search('гварди')], [guard.pk])
+
+
+class AutocompleteTests(TestCase):
+    """Подсказки поиска (core.autocomplete)"""
+
+    def setUp(self):
+        autocomplete._index = None
+        self.addCleanup(setattr, autocomplete, '_index', None)
+
+    def test_prefix_matches_any_word(self):
+        index = PrefixIndex([
+            ('books', 1, 'Война и мир', '/b/1', 4.5),
+            ('books', 2, 'Мир Полудня', '/b/2', 3.0),
+            ('authors', 3, 'Толстой Лев', '/a/3', 2),
+            ('genres', 4, 'Ёлочные игрушки', '/g/4', 1),
+        ], limit=5)
+        self.assertEqual([entry[1] for entry in index.lookup('мир')['books']], [1, 2])
+        self.assertEqual([entry[1] for entry in index.lookup('и мир')['books']], [1])
+        self.assertEqual([entry[1] for entry in index.lookup('Лев')['authors']], [3])
+        self.assertEqual([entry[1] for entry in index.lookup('елоч')['genres']], [4])
+        self.assertEqual(index.lookup('  ')['books'], [])
+
+    def test_short_prefix_top_by_weight(self):
+        entries = [('books', pk, f'Книга {pk}', f'/b/{pk}', pk % 7) for pk in range(1, 30)]
+        index = PrefixIndex(entries, limit=3)
+        top = index.lookup('кн')['books']
+        self.assertEqual([entry[4] for entry in top], [6, 6, 6])
+        self.assertEqual(len(index.lookup('книга 1', limit=10)['books']), 3)
+
+    def test_endpoint_without_queries_after_first_build(self):
+        tolstoy = Author.objects.create(first_name='Лев', last_name='Толстой')
+        book = create_book('Война и мир', rating=Decimal('4.50'))
+        book.authors.add(tolstoy)
+
+        self.client.get(reverse('search_autocomplete'), {'q': 'в'})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('search_autocomplete'), {'q': 'войн', 'limit': 5})
+        data = response.json()
+        self.assertEqual(data['books'], [{
+            'id': book.pk, 'label': 'Война и мир', 'url': reverse('product_detail', args=['book', book.pk]),
+        }])
+        authors = self.client.get(reverse('search_autocomplete'), {'q': 'толс'}).json()['authors']
+        self.assertEqual([author['id'] for author in authors], [tolstoy.pk])
+
+
+@override_settings(FACET_PRICE_BOUNDS=[300, 1000])
+class FacetTests(TestCase):
+    """Фасеты каталога (core.facets)"""
+
+    def setUp(self):
+        self.tolstoy = Author.objects.create(first_name='Лев', last_name='Толстой')
+        self.novel = Genre.objects.create(name='Роман')
+        self.drama = Genre.objects.create(name='Драма')
+        publisher = Publisher.objects.create(name='Эксмо')
+        self.books = [
+            create_book('Война и мир', price='1200', publication_year=1869, publisher=publisher),
+            create_book('Анна Каренина', price='500', publication_year=1877, publisher=publisher),
+            create_book('Живой труп', price='250', publication_year=1911),
+        ]
+        for book in self.books:
+            book.authors.add(self.tolstoy)
+        self.novel.books.add(*self.books[:2])
+        self.drama.books.add(self.books[2])
+
+    def counts(self, values):
+        return {value.label: value.count for value in values}
+
+    def test_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            facets = compute_facets(Book.objects.all())
+        self.assertEqual(facets.total, 3)
+        self.assertEqual(self.counts(facets.genres), {'Роман': 2, 'Драма': 1})
+        self.assertEqual(self.counts(facets.authors), {'Толстой Лев': 3})
+        self.assertEqual(self.counts(facets.publishers), {'Эксмо': 2})
+        self.assertEqual([value.label for value in facets.years], ['1911', '1877', '1869'])
+        self.assertEqual(self.counts(facets.prices), {'до 300 ₽': 1, '300–1000 ₽': 1, 'от 1000 ₽': 1})
+
+    def test_selected_values_filter_and_toggle_links(self):
+        params = QueryDict(f'genre={self.novel.pk}&price=9&cursor=abc')
+        books, selected = apply_facet_filters(Book.objects.all(), params)
+        self.assertEqual(selected, {'genre': self.novel.pk})
+
+        facets = compute_facets(books, selected, params)
+        self.assertEqual(facets.total, 2)
+        novel = next(value for value in facets.genres if value.key == self.novel.pk)
+        self.assertTrue(novel.selected)
+        self.assertEqual(novel.url, '?')
+        cheap = facets.prices[0]
+        self.assertEqual(QueryDict(cheap.url[1:]).dict(), {'genre': str(self.novel.pk), 'price': str(cheap.key)})
+
+    def test_catalog_page_shows_facets(self):
+        cache.clear()
+        response = self.client.get(reverse('books_by_genre', args=[self.novel.pk]), {'year': 1877})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([book.title for book in response.context['books']], ['Анна Каренина'])
+        self.assertEqual(response.context['facets'].total, 1)
+
+
+class BooksCountTests(TestCase):
+    """Счетчики books_count у жанров, авторов и издателей (core.book_counts)"""
+
+    def counts(self):
+        return (
+            Genre.objects.get(pk=self.genre.pk).books_count,
+            Author.objects.get(pk=self.author.pk).books_count,
+            Publisher.objects.get(pk=self.publisher.pk).books_count,
+        )
+
+    def setUp(self):
+        self.genre = Genre.objects.create(name='Роман')
+        self.author = Author.objects.create(first_name='Лев', last_name='Толстой')
+        self.publisher = Publisher.objects.create(name='Эксмо')
+
+    def test_links_from_both_sides(self):
+        book = create_book(publisher=self.publisher)
+        book.genres.add(self.genre)
+        self.author.books.add(book, create_book())
+        self.assertEqual(self.counts(), (1, 2, 1))
+
+        # Повторное добавление и удаление отсутствующей связи счетчики не меняют
+        book.genres.add(self.genre)
+        self.genre.books.remove(create_book())
+        self.assertEqual(self.counts(), (1, 2, 1))
+
+        self.author.books.clear()
+        book.genres.remove(self.genre)
+        self.assertEqual(self.counts(), (0, 0, 1))
+
+    def test_publisher_change_and_delete(self):
+        other = Publisher.objects.create(name='АСТ')
+        book = create_book(publisher=self.publisher)
+        book.genres.add(self.genre)
+        book.authors.add(self.author)
+
+        book.publisher = other
+        book.save()
+        self.assertEqual(Publisher.objects.get(pk=other.pk).books_count, 1)
+        self.assertEqual(self.counts(), (1, 1, 0))
+
+        book.delete()
+        self.assertEqual(Publisher.objects.get(pk=other.pk).books_count, 0)
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_reconcile_fixes_drift(self):
+        self.genre.books.add(create_book(), create_book())
+        Genre.objects.filter(pk=self.genre.pk).update(books_count=7)
+        fixed = reconcile_books_counts()
+        self.assertEqual(fixed[Genre], 1)
+        self.assertEqual(fixed[Author], 0)
+        self.assertEqual(self.counts(), (2, 0, 0))
+
+
+@override_settings(AUDIT_ASYNC=False)
+class ContextProcessorTests(TestCase):
+    """Ленивые и кэшируемые значения глобального контекста (core.context_processors)"""
+
+    def setUp(self):
+        cache.clear()
+        self.request = RequestFactory().get('/')
+        self.request.user = create_user()
+
+    def test_values_computed_only_on_access(self):
+        with self.assertNumQueries(0):
+            context = categories_context(self.request)
+            context.update(wishlist_context(self.request))
+        with self.assertNumQueries(4):
+            self.assertEqual(context['books_count'](), 0)
+            self.assertEqual(context['genres_count'](), 0)
+        with self.assertNumQueries(1):
+            self.assertEqual(context['wishlist_count'](), 0)
+            self.assertEqual(context['wishlist_count'](), 0)
+
+    def test_catalog_counts_cached_until_change(self):
+        categories_context(self.request)['books_count']()
+        with self.assertNumQueries(0):
+            self.assertEqual(categories_context(self.request)['books_count'](), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_book()
+        self.assertEqual(categories_context(self.request)['books_count'](), 1)
+
+    def test_wishlist_count_cached_per_user(self):
+        user = self.request.user
+        self.assertEqual(get_wishlist_count(user), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Wishlist.objects.create(user=user, book=create_book())
+        with self.assertNumQueries(1):
+            self.assertEqual(get_wishlist_count(user), 1)
+            self.assertEqual(get_wishlist_count(user), 1)
+        self.assertEqual(get_wishlist_count(create_user('other')), 0)
+
+
+@override_settings(AUDIT_ASYNC=False, PAGE_CACHE_TIMEOUT=300)
+class PageCacheTests(TestCase):
+    """Страницы каталога для анонимных посетителей и данные посетителя (core.page_cache)"""
+
+    def setUp(self):
+        cache.clear()
+        self.book = create_book('Война и мир', stock=5)
+
+    def test_anonymous_page_served_from_cache(self):
+        url = reverse('books_list')
+        first = self.client.get(url)
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+        self.assertIn('public', first['Cache-Control'])
+        self.assertContains(first, 'Война и мир')
+
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        self.assertEqual(second.content, first.content)
+
+        self.client.force_login(create_user())
+        self.assertNotIn('X-Page-Cache', self.client.get(url))
+
+    def test_stock_and_hold_changes_reset_cached_pages(self):
+        url = reverse('books_list')
+        self.assertContains(self.client.get(url), 'max="5"')
+
+        # Резерв и продажа меняют остаток через update() без post_save
+        with self.captureOnCommitCallbacks(execute=True):
+            set_hold(Cart.objects.create(), 'book', self.book.pk, 2)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'max="3"')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            decrement_stock([{'product_type': 'book', 'product_id': self.book.pk, 'quantity': 1, 'name': ''}])
+        self.assertContains(self.client.get(url), 'max="2"')
+
+    def test_personalization(self):
+        user = create_user()
+        Wishlist.objects.create(user=user, book=self.book)
+        self.client.force_login(user)
+        response = self.client.get(reverse('page_personalization'), {'book': f'{self.book.pk},x,0'})
+        data = response.json()
+        self.assertTrue(data['authenticated'])
+        self.assertEqual(data['wishlist_count'], 1)
+        self.assertEqual(data['wishlist'], {'book': [self.book.pk], 'stationery': []})
+        self.assertEqual(data['cart_total_quantity'], 0)
+        self.assertTrue(data['csrf_token'])
+
+
+class FragmentCacheTests(TestCase):
+    """Кэш фрагментов карточек книг (core.fragment_cache)"""
+
+    CARD = Template('{% load fragment_tags %}{% bookcard book "list" %}{{ book.title }}{% endbookcard %}')
+
+    def setUp(self):
+        cache.clear()
+        self.book = create_book('Война и мир')
+
+    def test_version_follows_book_and_links(self):
+        genre = Genre.objects.create(name='Роман')
+        version = self.book.version
+        self.book.save()
+        self.assertEqual(self.book.version, version + 1)
+
+        self.book.genres.add(genre)
+        genre.books.clear()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.version, version + 3)
+
+    def test_stale_save_keeps_version(self):
+        stale = Book.objects.get(pk=self.book.pk)
+        self.book.genres.add(Genre.objects.create(name='Роман'))
+        self.book.refresh_from_db()
+
+        stale.title = 'Новое название'
+        stale.save()
+        self.assertGreater(stale.version, self.book.version)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).version, stale.version)
+
+    def test_card_rendered_once_per_version(self):
+        self.assertEqual(self.CARD.render(Context({'book': self.book})), 'Война и мир')
+        books = prefetch_book_cards(Book.objects.filter(pk=self.book.pk), 'list')
+        self.assertEqual(self.CARD.render(Context({'book': books[0]})), 'Война и мир')
+        self.assertEqual(card_stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+        self.book.title = 'Анна Каренина'
+        self.book.save()
+        self.assertEqual(self.CARD.render(Context({'book': self.book})), 'Анна Каренина')
+
+
+class RatingTests(TestCase):
+    """Рейтинг книг (core.ratings)"""
+
+    def review(self, book, rating, name):
+        user = create_user(name)
+        order = Order.objects.create(user=user, total_amount=Decimal('1'), **ORDER_FIELDS)
+        return Review.objects.create(user=user, order=order, book=book, rating=rating, comment='Отзыв')
+
+    def test_counters_follow_reviews(self):
+        book = create_book()
+        first = self.review(book, 5, 'first')
+        self.review(book, 4, 'second')
+        first.rating = 3
+        first.save()
+        book.refresh_from_db()
+        self.assertEqual((book.rating_sum, book.rating_count, book.rating), (7, 2, Decimal('3.50')))
+
+        first.delete()
+        book.refresh_from_db()
+        self.assertEqual((book.rating_sum, book.rating_count, book.rating), (4, 1, Decimal('4.00')))
+
+    def test_stale_save_keeps_counters(self):
+        book = create_book()
+        stale = Book.objects.get(pk=book.pk)
+        for number, rating in enumerate((5, 4, 4)):
+            self.review(book, rating, f'reviewer{number}')
+
+        stale.title = 'Новое название'
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual(stale.title, 'Новое название')
+        self.assertEqual((stale.rating_sum, stale.rating_count, stale.rating), (13, 3, Decimal('4.33')))
+
+    def test_recompute_fixes_drift(self):
+        book = create_book()
+        self.review(book, 5, 'first')
+        self.review(book, 2, 'second')
+        Book.objects.filter(pk=book.pk).update(rating_sum=0, rating_count=0, rating=0)
+        self.assertEqual(recompute_ratings(), 1)
+        book.refresh_from_db()
+        self.assertEqual((book.rating_sum, book.rating_count, book.rating), (7, 2, Decimal('3.50')))
+
+
+class PausedAuditWriter(AuditWriter):
+    """Фоновый поток начинает разбирать очередь только после resume.set()"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.resume = threading.Event()
+
+    def _run(self):
+        self.resume.wait(5)
+        super()._run()
+
+
+class AuditWriterTests(TransactionTestCase):
+    """Фоновая запись журнала аудита (core.audit_writer); поток пишет своим соединением"""
+
+    def start(self, **kwargs):
+        writer = PausedAuditWriter(flush_interval=10, **kwargs)
+        self.addCleanup(writer.stop)
+        self.addCleanup(writer.resume.set)
+        return writer
+
+    def entry(self, number):
+        return AuditLog(action='view', description=f'запись {number}')
+
+    def test_batches_and_flush(self):
+        writer = self.start(batch_size=2)
+        for number in range(3):
+            writer.write(self.entry(number))
+        writer.resume.set()
+        self.assertTrue(writer.flush(timeout=5))
+
+        self.assertEqual(AuditLog.objects.count(), 3)
+        stats = writer.stats()
+        self.assertEqual((stats['enqueued'], stats['written'], stats['batches']), (3, 3, 2))
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_overflow_policies(self):
+        for overflow, counter, saved in (('drop', 'dropped', 0), ('block', 'dropped', 0), ('sync', 'sync', 1)):
+            with self.subTest(overflow=overflow):
+                AuditLog.objects.all().delete()
+                writer = self.start(max_queue=1, overflow=overflow, block_timeout=0.01)
+                writer.write(self.entry(1))
+                writer.write(self.entry(2))
+                self.assertEqual(writer.stats()[counter], 1)
+                self.assertEqual(AuditLog.objects.count(), saved)
+
+                writer.resume.set()
+                writer.stop()
+                self.assertEqual(AuditLog.objects.count(), saved + 1)
+
+    def test_unknown_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            AuditWriter(overflow='retry')
+
+
+class ViewCounterTests(TestCase):
+    """Счетчики просмотров (core.view_counters)"""
+
+    def test_upsert_adds_views(self):
+        today = timezone.localdate()
+        save_counts({('Book', 1, today): 2, ('Book', 2, today): 1})
+        save_counts({('Book', 1, today): 3, ('Book', 1, today - timedelta(days=1)): 4})
+        self.assertEqual(ViewCounter.objects.count(), 3)
+        self.assertEqual(ViewCounter.objects.get(model_name='Book', object_id=1, date=today).views, 5)
+        self.assertEqual(view_totals('Book'), [{'object_id': 1, 'views': 9}, {'object_id': 2, 'views': 1}])
+        self.assertEqual(view_totals('Book', date_from=today, limit=1), [{'object_id': 1, 'views': 5}])
+
+    def test_buffer_flush(self):
+        counters = ViewCounterBuffer(flush_interval=3600)
+        self.addCleanup(counters.stop)
+        for object_id in (1, 1, 2):
+            counters.add('Author', object_id)
+        self.assertEqual(counters.pending(), 3)
+        self.assertEqual(ViewCounter.objects.count(), 0)
+
+        self.assertTrue(counters.flush())
+        self.assertEqual(counters.pending(), 0)
+        self.assertEqual(dict(ViewCounter.objects.values_list('object_id', 'views')), {1: 2, 2: 1})
+
+    def test_most_viewed_skips_deleted_objects(self):
+        cache.clear()
+        book = create_book('Война и мир')
+        save_counts({('Book', book.pk, timezone.localdate()): 3, ('Book', book.pk + 1000, timezone.localdate()): 5})
+        self.assertEqual(most_viewed('Book'), [{'object': book, 'views': 3}])
+
+
+@override_settings(AUDIT_ASYNC=False)
+class AuditSignalTests(TestCase):
+    """Записи аудита изменений моделей (core.signals) и контекст запроса (core.audit)"""
+
+    def test_only_tracked_models_logged_once(self):
+        book = create_book('Война и мир')
+        Genre.objects.create(name='Роман')
+        self.assertEqual(list(AuditLog.objects.values_list('action', 'model_name', 'object_id')),
+                         [('create', 'Book', book.pk)])
+
+        book.title = 'Анна Каренина'
+        book.save()
+        book.delete()
+        self.assertEqual(list(AuditLog.objects.order_by('pk').values_list('action', flat=True)),
+                         ['create', 'update', 'delete'])
+
+    def test_ignored_and_explicit_saves(self):
+        user = create_user()
+        book = create_book()
+        AuditLog.objects.all().delete()
+
+        user.last_login = timezone.now()
+        user.save(update_fields=['last_login'])
+        with explicit_audit():
+            book.save()
+        # Админка передает пустой словарь, если поля не менялись
+        book._audit_changes = {}
+        book.save()
+        self.assertFalse(AuditLog.objects.exists())
+
+    def test_request_context(self):
+        request = RequestFactory().get('/manager/books/', REMOTE_ADDR='10.0.0.1', HTTP_USER_AGENT='tests')
+        request.user = create_user()
+        token = set_current_request(request)
+        try:
+            book = create_book()
+        finally:
+            reset_current_request(token)
+        self.assertIsNone(get_current_request())
+
+        entry = AuditLog.objects.get(model_name='Book', object_id=book.pk)
+        self.assertEqual((entry.user, entry.ip_address), (request.user, '10.0.0.1'))
+        self.assertEqual((entry.url_path, entry.user_agent), ('/manager/books/', 'tests'))
+
+
+class AuditPartitionTests(TestCase):
+    """Месячные партиции журнала аудита (core.audit_partitions)"""
+
+    def test_month_arithmetic(self):
+        self.assertEqual(audit_partitions.month_start(date(2025, 12, 31), 1), date(2026, 1, 1))
+        self.assertEqual(audit_partitions.month_start(date(2025, 1, 15), -1), date(2024, 12, 1))
+        self.assertEqual(audit_partitions.partition_name(date(2025, 3, 1)), 'core_auditlog_p2025_03')
+
+    @skipIf(connection.vendor == 'postgresql', 'проверка для других СУБД')
+    def test_command_requires_postgresql(self):
+        self.assertIsNone(audit_partitions.partition_table())
+        with self.assertRaises(CommandError):
+            call_command('audit_partitions', '--list')
+
+    @skipUnless(connection.vendor == 'postgresql', 'партиции есть только на PostgreSQL')
+    def test_create_and_expire(self):
+        self.assertTrue(audit_partitions.is_partitioned())
+        month = date(2040, 1, 1)
+        name = audit_partitions.partition_name(month)
+        # Запись месяца без партиции попадает в партицию по умолчанию
+        AuditLog.objects.create(action='other', created_at=timezone.make_aware(datetime(2040, 1, 15)))
+
+        self.assertEqual(audit_partitions.create_partition(month), name)
+        self.assertIsNone(audit_partitions.create_partition(month))
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {name}')
+            self.assertEqual(cursor.fetchone()[0], 1)
+        self.assertEqual(AuditLog.objects.count(), 1)
+
+        expired = dict(audit_partitions.expired_partitions(2, today=date(2040, 3, 10)))
+        self.assertEqual(expired[month], name)
+        self.assertNotIn(date(2040, 2, 1), expired)
+        self.assertEqual(audit_partitions.expired_partitions(0), [])
+
+        audit_partitions.detach_partition(name)
+        self.assertNotIn(name, dict(audit_partitions.list_partitions()).values())
+        self.assertEqual(AuditLog.objects.count(), 0)
+        audit_partitions.drop_partition(name)
+
+
+class AuditArchiveTests(TestCase):
+    """Архив журнала аудита (core.audit_archive)"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.now = timezone.now()
+        self.entries = [
+            AuditLog.objects.create(
+                action='view', url_path=f'/books/{days}/', user_agent='tests', changes={'days': days},
+                created_at=self.now - timedelta(days=days, microseconds=days),
+            )
+            for days in (40, 35, 30, 1)
+        ]
+
+    def test_round_trip(self):
+        created = archive_before(self.now - timedelta(days=10), directory=self.directory, segment_rows=2)
+        self.assertEqual([segment['rows'] for segment in created], [2, 1])
+        self.assertEqual(list(AuditLog.objects.values_list('pk', flat=True)), [self.entries[-1].pk])
+
+        archive = AuditArchive(self.directory)
+        self.assertEqual(archive.summary()['rows'], 3)
+        row = archive.get(self.entries[0].pk)
+        self.assertEqual(row['created_at'], self.entries[0].created_at)
+        self.assertEqual((row['url_path'], row['user_agent'], row['changes']), ('/books/40/', 'tests', {'days': 40}))
+        self.assertIsNone(archive.get(self.entries[-1].pk))
+
+        entry = archived_entry(row)
+        self.assertTrue(entry.archived)
+        self.assertEqual(entry.url_path, '/books/40/')
+
+    def test_between_returns_each_entry_once(self):
+        # Повторный перенос (например, после сбоя до удаления) дублирует записи в сегментах
+        cutoff = self.now - timedelta(days=10)
+        archive_before(cutoff, directory=self.directory, delete=False)
+        archive_before(cutoff, directory=self.directory)
+        archive = AuditArchive(self.directory)
+        self.assertEqual(len(archive.segments()), 2)
+
+        rows = list(archive.between(self.now - timedelta(days=36), self.now))
+        self.assertEqual([row['id'] for row in rows], [self.entries[1].pk, self.entries[2].pk])
+        self.assertEqual(len(list(archive.between())), 3)
+
+
+class AuditMetadataTests(TestCase):
+    """Значения фильтров журнала аудита (core.audit_metadata)"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+
+    def test_incremental_refresh(self):
+        AuditLog.objects.create(action='view', model_name='Book')
+        self.assertEqual(get_filter_metadata()['model_names'], {'Book'})
+
+        AuditLog.objects.create(action='view', model_name='Author', user=self.user)
+        data = get_filter_metadata()
+        self.assertEqual(data['model_names'], {'Book', 'Author'})
+        self.assertEqual(data['user_ids'], {self.user.pk})
+
+    def test_late_commit_with_smaller_id(self):
+        AuditLog.objects.create(id=1000, action='view', model_name='Book')
+        get_filter_metadata()
+
+        # Запись получила id раньше, а закоммичена после прошлого чтения
+        AuditLog.objects.create(id=10, action='view', model_name='Order')
+        AuditLog.objects.create(id=20, action='view', model_name='Stationery',
+                                created_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(get_filter_metadata()['model_names'], {'Book', 'Order'})
+
+    def test_log_stats_cached_per_filters(self):
+        AuditLog.objects.create(action='view', model_name='Book')
+        AuditLog.objects.create(action='view', model_name='Author')
+        stats = get_log_stats(AuditLog.objects.all(), {'action': 'view'})
+        self.assertEqual(stats['by_action'], [{'action': 'view', 'count': 2}])
+
+        AuditLog.objects.create(action='view', model_name='Book')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_log_stats(AuditLog.objects.all(), {'action': 'view'}), stats)
+
+
+class AuditLookupTests(TestCase):
+    """Справочники URL и User-Agent журнала аудита (core.audit_lookups)"""
+
+    def test_entries_share_lookup_rows(self):
+        entries = [
+            AuditLog(action='view', url_path='/books/', user_agent='Firefox'),
+            AuditLog(action='view', url_path='/books/', user_agent='Chrome'),
+        ]
+        encode_entries(entries)
+        AuditLog.objects.bulk_create(entries)
+        self.assertEqual(AuditPath.objects.count(), 1)
+        self.assertEqual(AuditUserAgent.objects.count(), 2)
+        self.assertEqual(entries[0].path_id, entries[1].path_id)
+
+        entry = AuditLog.objects.get(pk=entries[1].pk)
+        self.assertEqual((entry.url_path, entry.user_agent), ('/books/', 'Chrome'))
+
+    def test_ids_cached_after_commit(self):
+        lookup = LookupCache(AuditPath, max_size=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            ids = lookup.get_ids({'/a/', '/b/'})
+        with self.assertNumQueries(0):
+            self.assertEqual(lookup.get_ids({'/a/', '/b/'}), ids)
+
+        # Давно не использованное значение вытесняется, id в справочнике не меняется
+        lookup.get_ids({'/b/'})
+        with self.captureOnCommitCallbacks(execute=True):
+            lookup.get_ids({'/c/'})
+        with self.assertNumQueries(1):
+            self.assertEqual(lookup.get_ids({'/a/'}), {'/a/': ids['/a/']})
+
+
+class CartTests(TestCase):
+    """Корзина в базе данных (core.cart)"""
+
+    def setUp(self):
+        self.book = create_book('Война и мир', stock=5)
+        self.other = create_book('Анна Каренина', stock=5)
+        self.cart = Cart.objects.create()
+
+    def held(self, book):
+        return Book.objects.get(pk=book.pk).reserved_quantity
+
+    def test_add_line_reserves_stock(self):
+        self.assertTrue(add_line(self.cart, 'book', self.book.pk, 3, self.book.price))
+        self.assertTrue(add_line(self.cart, 'book', self.book.pk, 2, self.book.price))
+        self.assertFalse(add_line(self.cart, 'book', self.book.pk, 1, self.book.price))
+        self.assertEqual(self.cart.lines.get().quantity, 5)
+        self.assertEqual(self.held(self.book), 5)
+
+    def test_merge_on_login(self):
+        user = create_user()
+        user_cart = Cart.objects.create(user=user)
+        add_line(user_cart, 'book', self.book.pk, 1, self.book.price)
+        add_line(self.cart, 'book', self.book.pk, 2, self.book.price)
+        add_line(self.cart, 'book', self.other.pk, 1, self.other.price)
+
+        session = self.client.session
+        session[CART_SESSION_KEY] = self.cart.pk
+        session.save()
+        self.client.force_login(user)
+
+        self.assertFalse(Cart.objects.filter(pk=self.cart.pk).exists())
+        self.assertEqual(self.client.session[CART_SESSION_KEY], user_cart.pk)
+        lines = dict(user_cart.lines.values_list('product_id', 'quantity'))
+        self.assertEqual(lines, {self.book.pk: 3, self.other.pk: 1})
+        self.assertEqual(StockHold.objects.get(cart=user_cart, product_id=self.book.pk).quantity, 3)
+        self.assertEqual((self.held(self.book), self.held(self.other)), (3, 1))
+
+    def test_revalidate(self):
+        add_line(self.cart, 'book', self.book.pk, 2, self.book.price)
+        add_line(self.cart, 'book', self.other.pk, 1, self.other.price)
+        Book.objects.filter(pk=self.book.pk).update(price=Decimal('150.00'))
+        # Резерв истек и снят, а остаток тем временем забрали
+        StockHold.objects.filter(cart=self.cart).update(expires_at=timezone.now() - timedelta(minutes=1))
+        release_expired()
+        Book.objects.filter(pk=self.other.pk).update(stock_quantity=0)
+
+        items, total, quantity, changes = revalidate(self.cart)
+        by_id = {item['product_id']: item for item in items}
+        self.assertEqual((total, quantity), (Decimal('400.00'), 3))
+        self.assertEqual(by_id[self.book.pk]['price'], Decimal('150.00'))
+        self.assertTrue(by_id[self.book.pk]['in_stock'])
+        self.assertFalse(by_id[self.other.pk]['in_stock'])
+        self.assertEqual(len(changes), 1)
+
+        self.other.delete()
+        items, total, quantity, changes = revalidate(self.cart)
+        self.assertEqual([item['product_id'] for item in items], [self.book.pk])
+        self.assertEqual(self.cart.lines.count(), 1)
+
+
+@override_settings(AUDIT_ASYNC=False)
+class CartEndpointTests(TestCase):
+    """JSON-ответы действий с корзиной (X-Requested-With: XMLHttpRequest)"""
+
+    AJAX = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+    def setUp(self):
+        self.book = create_book('Война и мир', stock=3, price='200.00')
+        self.other = create_book('Анна Каренина', stock=3, price='100.00')
+
+    def add(self, book, quantity=1):
+        return self.client.post(reverse('add_to_cart', args=['book', book.pk]), {'quantity': quantity}, **self.AJAX)
+
+    def test_add_returns_line_and_totals(self):
+        self.add(self.other)
+        data = self.add(self.book, 2).json()
+        self.assertEqual(data['lines'], [{
+            'key': f'book:{self.book.pk}', 'product_type': 'book', 'product_id': self.book.pk,
+            'quantity': 2, 'price': '200.00', 'subtotal': '400.00',
+        }])
+        self.assertEqual(data['cart'], {'total_quantity': 3, 'total': '500.00'})
+
+        response = self.add(self.book, 2)
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(response.json()['success'])
+
+    def test_update_and_remove(self):
+        self.add(self.book)
+        url = reverse('update_cart_quantity', args=['book', self.book.pk])
+        data = self.client.post(url, {'quantity': 5}, **self.AJAX).json()
+        self.assertEqual(data['rejected'], [f'book:{self.book.pk}'])
+        self.assertEqual(data['lines'][0]['quantity'], 1)
+        self.assertEqual(self.client.post(url, {'quantity': 'x'}, **self.AJAX).status_code, 400)
+
+        data = self.client.post(reverse('remove_from_cart', args=['book', self.book.pk]), **self.AJAX).json()
+        self.assertEqual(data['lines'][0]['quantity'], 0)
+        self.assertEqual(data['cart'], {'total_quantity': 0, 'total': '0.00'})
+
+    def test_batch_update(self):
+        self.add(self.book)
+        self.add(self.other)
+        lines = [
+            {'product_type': 'book', 'product_id': self.book.pk, 'quantity': 3},
+            {'product_type': 'book', 'product_id': self.other.pk, 'quantity': 0},
+        ]
+        response = self.client.post(reverse('update_cart_batch'), json.dumps({'lines': lines}),
+                                    content_type='application/json')
+        data = response.json()
+        self.assertEqual({line['product_id']: line['quantity'] for line in data['lines']},
+                         {self.book.pk: 3, self.other.pk: 0})
+        self.assertEqual((data['rejected'], data['cart']), ([], {'total_quantity': 3, 'total': '600.00'}))
+
+        response = self.client.post(reverse('update_cart_batch'), '{"lines": [{}]}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ReservationTests(TestCase):
+    """Резервы товаров корзинами (core.reservations)"""
+
+    def setUp(self):
+        self.book = create_book(stock=3)
+        self.first = Cart.objects.create()
+        self.second = Cart.objects.create()
+
+    def reserved(self):
+        self.book.refresh_from_db()
+        return self.book.reserved_quantity
+
+    def test_hold_limited_by_free_stock(self):
+        self.assertTrue(set_hold(self.first, 'book', self.book.pk, 2))
+        self.assertFalse(set_hold(self.second, 'book', self.book.pk, 2))
+        self.assertTrue(set_hold(self.second, 'book', self.book.pk, 1))
+        self.assertEqual(self.reserved(), 3)
+        self.assertEqual(self.book.available_quantity, 0)
+
+    def test_hold_shrinks_and_releases(self):
+        set_hold(self.first, 'book', self.book.pk, 3)
+        set_hold(self.first, 'book', self.book.pk, 1)
+        self.assertEqual(self.reserved(), 1)
+        set_hold(self.first, 'book', self.book.pk, 0)
+        self.assertEqual(self.reserved(), 0)
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_release_expired_and_deleted_carts(self):
+        set_hold(self.first, 'book', self.book.pk, 2)
+        set_hold(self.second, 'book', self.book.pk, 1)
+        StockHold.objects.filter(cart=self.first).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(release_expired(), 1)
+        self.assertEqual(self.reserved(), 1)
+        self.second.delete()
+        self.assertEqual(self.reserved(), 0)
+
+    def test_reconcile_reserved(self):
+        set_hold(self.first, 'book', self.book.pk, 2)
+        Book.objects.filter(pk=self.book.pk).update(reserved_quantity=0)
+        self.assertEqual(reconcile_reserved(), 1)
+        self.assertEqual(self.reserved(), 2)
+        self.assertEqual(reconcile_reserved(), 0)
+
+
+@register('tests_failing')
+def failing_job():
+    raise RuntimeError('ошибка задачи')
+
+
+class JobQueueTests(TestCase):
+    """Очередь фоновых задач (core.jobs)"""
+
+    def run_once(self):
+        jobs = claim('test-worker')
+        self.assertEqual(len(jobs), 1)
+        return execute(jobs[0])
+
+    def test_failed_job_retried_then_dead_lettered(self):
+        job = enqueue('tests_failing', max_attempts=2)
+
+        with self.assertLogs('core.jobs', 'WARNING'):
+            self.assertEqual(self.run_once(), Job.Status.PENDING)
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('ошибка задачи', job.last_error)
+        self.assertEqual(claim('test-worker'), [])
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('core.jobs', 'ERROR'):
+            self.assertEqual(self.run_once(), Job.Status.FAILED)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.FAILED, 2))
+
+        self.assertEqual(retry_failed(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.Status.PENDING, 0))
+
+    def test_unknown_job_rejected(self):
+        with self.assertRaises(ValueError):
+            enqueue('tests_unknown')
+
+    def test_stale_job_requeued_until_attempts_exhausted(self):
+        retried = enqueue('tests_failing', max_attempts=3)
+        exhausted = enqueue('tests_failing', max_attempts=3)
+        stale_since = timezone.now() - timedelta(days=1)
+        Job.objects.filter(pk=retried.pk).update(status=Job.Status.RUNNING, attempts=1, locked_at=stale_since)
+        Job.objects.filter(pk=exhausted.pk).update(status=Job.Status.RUNNING, attempts=3, locked_at=stale_since)
+
+        with self.assertLogs('core.jobs', 'ERROR'):
+            self.assertEqual(requeue_stale(), 1)
+        retried.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual(retried.status, Job.Status.PENDING)
+        self.assertEqual(exhausted.status, Job.Status.FAILED)
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    """Почтовый сервер, который принимает соединение, но не письма"""
+
+    def send_messages(self, email_messages):
+        raise SMTPException('сервер недоступен')
+
+
+@override_settings(EMAIL_OUTBOX_RATE=0, EMAIL_OUTBOX_MAX_ATTEMPTS=2, EMAIL_OUTBOX_RETRY_DELAY=60)
+class OutboxTests(TestCase):
+    """Исходящие письма через таблицу (core.outbox)"""
+
+    def test_email_kept_only_with_transaction(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            outbox.queue_email('Заказ', 'Текст', ['buyer@example.com'])
+            raise RuntimeError('откат')
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_dispatch_sends_batch(self):
+        outbox.queue_email('Заказ\nоформлен', 'Текст', ['buyer@example.com'], html_body='<p>Текст</p>')
+        outbox.queue_email('Пароль', 'Ссылка', ['user@example.com'])
+        self.assertEqual(outbox.drain(batch_size=1), (2, 0))
+
+        self.assertEqual([message.subject for message in mail.outbox], ['Заказоформлен', 'Пароль'])
+        self.assertEqual(mail.outbox[0].alternatives[0].content, '<p>Текст</p>')
+        self.assertEqual(set(OutboxEmail.objects.values_list('status', 'attempts')), {(OutboxEmail.Status.SENT, 1)})
+
+    @override_settings(EMAIL_BACKEND='core.tests.FailingEmailBackend')
+    def test_failed_send_retried_then_failed(self):
+        email = outbox.queue_email('Заказ', 'Текст', ['buyer@example.com'])
+        self.assertEqual(outbox.dispatch(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.Status.PENDING, 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertIsNone(email.locked_at)
+        self.assertEqual(outbox.dispatch(), (0, 0))
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        with self.assertLogs('core.outbox', 'ERROR'):
+            outbox.dispatch()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.last_error), (OutboxEmail.Status.FAILED, 'сервер недоступен'))
+        self.assertEqual(outbox.retry_failed(), 1)
+
+    def test_stale_sending_requeued(self):
+        stale = outbox.queue_email('Заказ', 'Текст', ['buyer@example.com'])
+        fresh = outbox.queue_email('Пароль', 'Ссылка', ['user@example.com'])
+        OutboxEmail.objects.filter(pk=stale.pk).update(
+            status=OutboxEmail.Status.SENDING, locked_at=timezone.now() - timedelta(days=1),
+        )
+        OutboxEmail.objects.filter(pk=fresh.pk).update(status=OutboxEmail.Status.SENDING, locked_at=timezone.now())
+
+        self.assertEqual(outbox.requeue_stale(), 1)
+        self.assertEqual(OutboxEmail.objects.get(pk=stale.pk).status, OutboxEmail.Status.PENDING)
+        self.assertEqual(OutboxEmail.objects.get(pk=fresh.pk).status, OutboxEmail.Status.SENDING)
+
+
+class CardNumberTests(TestCase):
+    """Номера карт лояльности (core.card_numbers)"""
+
+    def test_luhn_check_digit(self):
+        self.assertEqual(luhn_check_digit('7992739871'), '3')
+        number = format_card_number(42)
+        self.assertTrue(is_valid(number))
+        wrong = number[:-1] + str((int(number[-1]) + 1) % 10)
+        self.assertFalse(is_valid(wrong))
+
+    def test_numbers_unique_and_valid(self):
+        formatted = {format_card_number(value) for value in range(5000)}
+        self.assertEqual(len(formatted), 5000)
+
+        numbers = card_numbers(50)
+        self.assertEqual(len(set(numbers)), 50)
+        self.assertTrue(all(is_valid(number) for number in numbers))
+
+    def test_cards_issued_once(self):
+        card = LoyaltyCard.objects.create(user=create_user())
+        self.assertTrue(is_valid(card.card_number))
+
+        users = [card.user, create_user('second'), create_user('third')]
+        self.assertEqual(issue_cards(users), 2)
+        self.assertEqual(LoyaltyCard.objects.count(), 3)
+        self.assertTrue(all(is_valid(number) for number in LoyaltyCard.objects.values_list('card_number', flat=True)))
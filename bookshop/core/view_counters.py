@@ -0,0 +1,212 @@
+"""
+Счетчики просмотров страниц
+
+Просмотр страницы книги, товара или автора не пишет строку в журнал аудита:
+процесс накапливает количество просмотров по (модель, объект, день) в памяти,
+а фоновый поток раз в VIEW_COUNTER_FLUSH_INTERVAL секунд прибавляет их
+к таблице ViewCounter одним INSERT ... ON CONFLICT DO UPDATE. При завершении
+процесса накопленное дописывается (atexit).
+
+Подробные записи просмотров в AuditLog можно включить выборочно:
+VIEW_AUDIT_SAMPLE_RATE задает долю просмотров, попадающих в журнал.
+"""
+import atexit
+import logging
+import os
+import random
+import threading
+from collections import Counter
+from datetime import timedelta
+from functools import wraps
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import ViewCounter
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд хранить списки популярных объектов
+MOST_VIEWED_TIMEOUT = 5 * 60
+
+UPSERT_SQL = """
+    INSERT INTO {table} (model_name, object_id, date, views)
+    VALUES {values}
+    ON CONFLICT (model_name, object_id, date)
+    DO UPDATE SET views = {table}.views + EXCLUDED.views
+"""
+
+
+def save_counts(counts):
+    """Прибавляет {(model_name, object_id, date): views} к таблице ViewCounter"""
+    if not counts:
+        return
+    rows = list(counts.items())
+    if connection.vendor in ('postgresql', 'sqlite'):
+        table = connection.ops.quote_name(ViewCounter._meta.db_table)
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), 500):
+                chunk = rows[start:start + 500]
+                params = []
+                for (model_name, object_id, date), views in chunk:
+                    params.extend((model_name, object_id, date, views))
+                values = ', '.join(['(%s, %s, %s, %s)'] * len(chunk))
+                cursor.execute(UPSERT_SQL.format(table=table, values=values), params)
+        return
+
+    for (model_name, object_id, date), views in rows:
+        with transaction.atomic():
+            counter, created = ViewCounter.objects.select_for_update().get_or_create(
+                model_name=model_name, object_id=object_id, date=date, defaults={'views': views},
+            )
+            if not created:
+                ViewCounter.objects.filter(pk=counter.pk).update(views=F('views') + views)
+
+
+class ViewCounterBuffer:
+    """
+    Просмотры, накопленные процессом.
+
+    Args:
+        flush_interval: Как часто сохранять накопленное, секунды
+    """
+
+    def __init__(self, flush_interval=10):
+        self.flush_interval = flush_interval
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, model_name, object_id, views=1):
+        self._ensure_started()
+        key = (model_name, object_id, timezone.localdate())
+        with self._lock:
+            self._counts[key] += views
+
+    def pending(self):
+        """Количество еще не сохраненных просмотров"""
+        with self._lock:
+            return sum(self._counts.values())
+
+    def flush(self):
+        """Сохраняет накопленные просмотры; при ошибке они остаются в буфере"""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        try:
+            save_counts(counts)
+        except Exception:
+            logger.exception('Не удалось сохранить счетчики просмотров')
+            with self._lock:
+                self._counts.update(counts)
+            return False
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(self.flush_interval)
+        self.flush()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            # После fork просмотры родителя сохранит сам родитель
+            self._counts = Counter()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='view-counters', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.flush_interval):
+                if not self.flush():
+                    connection.close()
+        finally:
+            connection.close()
+
+
+# --- Экземпляр процесса ---
+
+buffer = ViewCounterBuffer(flush_interval=settings.VIEW_COUNTER_FLUSH_INTERVAL)
+
+atexit.register(buffer.stop)
+
+
+def record_view(model_name, object_id):
+    """Учитывает просмотр страницы объекта (без обращения к БД)"""
+    buffer.add(model_name, object_id)
+
+
+def count_views(get_target):
+    """
+    Декоратор view: учитывает успешные GET-запросы страницы.
+
+    Просмотр учитывается и тогда, когда страница отдана из кэша (core.page_cache),
+    поэтому декоратор ставится над cache_anonymous_page.
+
+    Args:
+        get_target: Функция (**kwargs view) -> (model_name, object_id)
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if request.method == 'GET' and response.status_code == 200:
+                record_view(*get_target(**kwargs))
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def sample_view_audit():
+    """Нужно ли записать этот просмотр в журнал аудита (VIEW_AUDIT_SAMPLE_RATE)"""
+    rate = settings.VIEW_AUDIT_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+# --- Отчеты ---
+
+def view_totals(model_name, date_from=None, date_to=None, limit=10):
+    """Самые просматриваемые объекты за период: [{'object_id': ..., 'views': ...}]"""
+    counters = ViewCounter.objects.filter(model_name=model_name)
+    if date_from:
+        counters = counters.filter(date__gte=date_from)
+    if date_to:
+        counters = counters.filter(date__lte=date_to)
+    return list(
+        counters.values('object_id').annotate(views=Sum('views')).order_by('-views', 'object_id')[:limit]
+    )
+
+
+def with_objects(model_name, totals):
+    """Добавляет к результату view_totals объекты (удаленные пропускаются)"""
+    model = apps.get_model('core', model_name)
+    objects = model.objects.in_bulk([row['object_id'] for row in totals])
+    return [
+        {'object': objects[row['object_id']], 'views': row['views']}
+        for row in totals if row['object_id'] in objects
+    ]
+
+
+def most_viewed(model_name, days=7, limit=10):
+    """Популярные объекты за последние days дней (кэшируется на MOST_VIEWED_TIMEOUT)"""
+    key = f'most_viewed:{model_name}:{days}:{limit}'
+    result = cache.get(key)
+    if result is None:
+        date_from = timezone.localdate() - timedelta(days=days - 1)
+        result = with_objects(model_name, view_totals(model_name, date_from=date_from, limit=limit))
+        cache.set(key, result, MOST_VIEWED_TIMEOUT)
+    return result
@@ -1,9 +1,14 @@
+import json
+import secrets
 from decimal import Decimal
 
+from django.conf import settings
 from django.contrib import messages
-from django.http import Http404
+from django.http import Http404, JsonResponse
+from django.middleware.csrf import get_token
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.views.decorators.cache import never_cache
 from django.views.decorators.http import require_POST
 from rest_framework import viewsets
 
@@ -29,11 +34,27 @@ from .models import (
     FAQ,
     SupportMessage,
     AuditLog,
+    CartLine,
 )
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Count, Q
 
 from .forms import CheckoutForm
-from .audit import log_action
+from .audit import get_client_ip, get_user_agent, log_action
+from .autocomplete import get_autocomplete_index
+from .caching import get_wishlist_count
+from .cart import (
+    add_line, cart_quantity, cart_totals, clear_cart, get_cart, get_product, product_name, remove_line,
+    revalidate, set_quantities,
+)
+from .checkout import DuplicateCheckout, OutOfStock, existing_order_id, place_order
+from .facets import apply_facet_filters, compute_facets
+from .fragment_cache import prefetch_book_cards
+from .jobs import enqueue
+from .page_cache import cache_anonymous_page
+from .pagination import KeysetPaginator
+from .search import search_books_queryset
+from .view_counters import count_views, most_viewed, sample_view_audit
 from .serializers import (
     CategorySerializer,
     PublisherSerializer,
@@ -75,6 +96,14 @@ class BookViewSet(viewsets.ModelViewSet):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # ?q=... — поиск через активный поисковый движок (core.search)
+        query = self.request.query_params.get('q', '').strip()
+        if query and self.action == 'list':
+            queryset = search_books_queryset(query, queryset).order_by('-rank', '-rating', 'title', 'id')
+        return queryset
+
 
 class StationeryViewSet(viewsets.ModelViewSet):
     queryset = Stationery.objects.all()
@@ -162,7 +191,7 @@ class SupportMessageViewSet(viewsets.ModelViewSet):
 
 
 class AuditLogViewSet(viewsets.ReadOnlyModelViewSet):  # Только чтение для логов
-    queryset = AuditLog.objects.all()
+    queryset = AuditLog.objects.select_related('user', 'path', 'agent')
     serializer_class = AuditLogSerializer
 
 
@@ -172,43 +201,26 @@ def home(request):
     return render(request, "index.html")
 
 
+@cache_anonymous_page
 def books_list(request):
     """Главная страница каталога книг с выбором фильтра"""
-    # Получаем все жанры, авторы и издатели для меню
-    genres = Genre.objects.all().annotate(
-        books_count=Count('books')
-    ).order_by('name')
-    authors = Author.objects.all().annotate(
-        books_count=Count('books')
-    ).order_by('last_name', 'first_name')
-    publishers = Publisher.objects.all().annotate(
-        books_count=Count('books')
-    ).order_by('name')
-    
     # Получаем все книги для страницы "Все книги"
     books = Book.objects.select_related("publisher").prefetch_related("authors", "genres").all()
     
-    # Параметры сортировки
-    sort_by = request.GET.get('sort', 'rating')  # rating, year
-    order = request.GET.get('order', 'desc')  # asc, desc
+    # Жанры, авторы и издатели для меню: количество книг хранится в books_count
+    genres = Genre.objects.filter(books_count__gt=0).order_by('name')
+    authors = Author.objects.filter(books_count__gt=0).order_by('last_name', 'first_name')
+    publishers = Publisher.objects.filter(books_count__gt=0).order_by('name')
     
-    # Применяем сортировку
-    if sort_by == 'year':
-        if order == 'desc':
-            books = books.order_by('-publication_year', 'title')
-        else:
-            books = books.order_by('publication_year', 'title')
-    else:  # sort_by == 'rating' (по умолчанию)
-        if order == 'desc':
-            books = books.order_by('-rating', 'title')
-        else:
-            books = books.order_by('rating', 'title')
+    page, sort_by, order = _paginate_books(request, books, card_variant='list')
     
     context = {
-        'books': books,
+        'books': page.object_list,
+        'page': page,
         'genres': genres,
         'authors': authors,
         'publishers': publishers,
+        'popular_books': most_viewed('Book', days=7, limit=6),
         'sort_by': sort_by,
         'order': order,
         'filter_type': 'all',  # all, genre, author, publisher
@@ -220,26 +232,18 @@ def books_by_genre(request, genre_id):
     """Страница книг по жанру"""
     genre = get_object_or_404(Genre, pk=genre_id)
     
-    # Параметры сортировки
-    sort_by = request.GET.get('sort', 'rating')
-    order = request.GET.get('order', 'desc')
-    
     books = Book.objects.filter(genres=genre).select_related("publisher").prefetch_related("authors", "genres")
     
-    # Применяем сортировку
-    if sort_by == 'year':
-        if order == 'desc':
-            books = books.order_by('-publication_year', 'title')
-        else:
-            books = books.order_by('publication_year', 'title')
-    else:  # sort_by == 'rating' (по умолчанию)
-        if order == 'desc':
-            books = books.order_by('-rating', 'title')
-        else:
-            books = books.order_by('rating', 'title')
+    books, selected = apply_facet_filters(books, request.GET)
+    facets = compute_facets(books, selected, request.GET)
+    
+    page, sort_by, order = _paginate_books(request, books)
     
     context = {
-        'books': books,
+        'books': page.object_list,
+        'page': page,
+        'books_total': facets.total,
+        'facets': facets,
         'genre': genre,
         'sort_by': sort_by,
         'order': order,
@@ -248,6 +252,8 @@ def books_by_genre(request, genre_id):
     return render(request, "books_filtered.html", context)
 
 
+@count_views(lambda author_id: ('Author', author_id))
+@cache_anonymous_page
 def author_detail(request, author_id):
     """Страница с подробной информацией об авторе"""
     author = get_object_or_404(Author.objects.prefetch_related('books'), pk=author_id)
@@ -255,16 +261,17 @@ def author_detail(request, author_id):
     # Получаем все книги автора с рейтингами
     books = author.books.all().select_related('publisher').prefetch_related('genres').order_by('-rating', 'title')
     
-    # Логируем просмотр автора
-    log_action(
-        action='view',
-        user=request.user if request.user.is_authenticated else None,
-        request=request,
-        model_name='Author',
-        object_id=author.id,
-        object_repr=str(author),
-        description=f'Просмотр страницы автора: {author}',
-    )
+    # Просмотры считаются в core.view_counters; в журнал — только выборочно
+    if sample_view_audit():
+        log_action(
+            action='view',
+            user=request.user if request.user.is_authenticated else None,
+            request=request,
+            model_name='Author',
+            object_id=author.id,
+            object_repr=str(author),
+            description=f'Просмотр страницы автора: {author}',
+        )
     
     context = {
         'author': author,
@@ -277,26 +284,18 @@ def books_by_author(request, author_id):
     """Страница книг по автору (старая версия - для совместимости)"""
     author = get_object_or_404(Author, pk=author_id)
     
-    # Параметры сортировки
-    sort_by = request.GET.get('sort', 'rating')
-    order = request.GET.get('order', 'desc')
-    
     books = Book.objects.filter(authors=author).select_related("publisher").prefetch_related("authors", "genres")
     
-    # Применяем сортировку
-    if sort_by == 'year':
-        if order == 'desc':
-            books = books.order_by('-publication_year', 'title')
-        else:
-            books = books.order_by('publication_year', 'title')
-    else:  # sort_by == 'rating' (по умолчанию)
-        if order == 'desc':
-            books = books.order_by('-rating', 'title')
-        else:
-            books = books.order_by('rating', 'title')
+    books, selected = apply_facet_filters(books, request.GET)
+    facets = compute_facets(books, selected, request.GET)
+    
+    page, sort_by, order = _paginate_books(request, books)
     
     context = {
-        'books': books,
+        'books': page.object_list,
+        'page': page,
+        'books_total': facets.total,
+        'facets': facets,
         'author': author,
         'sort_by': sort_by,
         'order': order,
@@ -309,26 +308,18 @@ def books_by_publisher(request, publisher_id):
     """Страница книг по издателю"""
     publisher = get_object_or_404(Publisher, pk=publisher_id)
     
-    # Параметры сортировки
-    sort_by = request.GET.get('sort', 'rating')
-    order = request.GET.get('order', 'desc')
-    
     books = Book.objects.filter(publisher=publisher).select_related("publisher").prefetch_related("authors", "genres")
     
-    # Применяем сортировку
-    if sort_by == 'year':
-        if order == 'desc':
-            books = books.order_by('-publication_year', 'title')
-        else:
-            books = books.order_by('publication_year', 'title')
-    else:  # sort_by == 'rating' (по умолчанию)
-        if order == 'desc':
-            books = books.order_by('-rating', 'title')
-        else:
-            books = books.order_by('rating', 'title')
+    books, selected = apply_facet_filters(books, request.GET)
+    facets = compute_facets(books, selected, request.GET)
+    
+    page, sort_by, order = _paginate_books(request, books)
     
     context = {
-        'books': books,
+        'books': page.object_list,
+        'page': page,
+        'books_total': facets.total,
+        'facets': facets,
         'publisher': publisher,
         'sort_by': sort_by,
         'order': order,
@@ -340,38 +331,23 @@ def books_by_publisher(request, publisher_id):
 def search_books(request):
     """Глобальный поиск книг по названию, автору, жанру и издателю"""
     query = request.GET.get('q', '').strip()
-    books = Book.objects.none()
     
-    if query:
-        from django.db.models import Q
-        # Объединяем все условия поиска в один Q объект
-        books = Book.objects.filter(
-            Q(title__icontains=query) |
-            Q(authors__first_name__icontains=query) |
-            Q(authors__last_name__icontains=query) |
-            Q(authors__middle_name__icontains=query) |
-            Q(genres__name__icontains=query) |
-            Q(publisher__name__icontains=query)
-        ).select_related("publisher").prefetch_related("authors", "genres").distinct()
+    # Поиск через активный поисковый движок (см. core.search); пустой запрос — пустой результат
+    books = search_books_queryset(query).select_related("publisher").prefetch_related("authors", "genres")
     
-    # Параметры сортировки
-    sort_by = request.GET.get('sort', 'rating')
-    order = request.GET.get('order', 'desc')
+    books, selected = apply_facet_filters(books, request.GET)
+    facets = compute_facets(books, selected, request.GET)
     
-    # Применяем сортировку
-    if sort_by == 'year':
-        if order == 'desc':
-            books = books.order_by('-publication_year', 'title')
-        else:
-            books = books.order_by('publication_year', 'title')
-    else:  # sort_by == 'rating'
-        if order == 'desc':
-            books = books.order_by('-rating', 'title')
-        else:
-            books = books.order_by('rating', 'title')
+    # По умолчанию — по релевантности (ts_rank), при равенстве — по рейтингу
+    page, sort_by, order = _paginate_books(
+        request, books, default_sort='relevance', extra_orderings=SEARCH_ORDERINGS,
+    )
     
     context = {
-        'books': books,
+        'books': page.object_list,
+        'page': page,
+        'books_total': facets.total,
+        'facets': facets,
         'query': query,
         'sort_by': sort_by,
         'order': order,
@@ -380,6 +356,64 @@ def search_books(request):
     return render(request, "books_filtered.html", context)
 
 
+def search_autocomplete(request):
+    """Подсказки для строки поиска (JSON): книги, авторы, жанры и издатели по префиксу"""
+    query = request.GET.get('q', '')
+    try:
+        limit = int(request.GET.get('limit', settings.AUTOCOMPLETE_LIMIT))
+    except (TypeError, ValueError):
+        limit = settings.AUTOCOMPLETE_LIMIT
+
+    suggestions = get_autocomplete_index().lookup(query, limit=max(1, limit))
+    return JsonResponse({
+        'query': query,
+        **{
+            kind: [{'id': pk, 'label': label, 'url': url} for _, pk, label, url, _ in entries]
+            for kind, entries in suggestions.items()
+        },
+    })
+
+
+@never_cache
+def page_personalization(request):
+    """
+    Данные посетителя для страниц, кэшируемых целиком (JSON).
+
+    GET-параметры book и stationery — id товаров на странице через запятую;
+    для них возвращается, какие из них в избранном пользователя.
+    """
+    visible = {}
+    for product_type in ('book', 'stationery'):
+        ids = []
+        for value in request.GET.get(product_type, '').split(',')[:200]:
+            if value.strip().isdigit():
+                ids.append(int(value))
+        visible[product_type] = ids
+
+    wishlist = {'book': [], 'stationery': []}
+    wishlist_count = 0
+    if request.user.is_authenticated:
+        wishlist_count = get_wishlist_count(request.user)
+        if wishlist_count and (visible['book'] or visible['stationery']):
+            items = Wishlist.objects.filter(user=request.user).filter(
+                Q(book_id__in=visible['book']) | Q(stationery_id__in=visible['stationery'])
+            ).values_list('book_id', 'stationery_id')
+            for book_id, stationery_id in items:
+                if book_id:
+                    wishlist['book'].append(book_id)
+                if stationery_id:
+                    wishlist['stationery'].append(stationery_id)
+
+    return JsonResponse({
+        'authenticated': request.user.is_authenticated,
+        'csrf_token': get_token(request),
+        'cart_total_quantity': cart_quantity(request),
+        'wishlist_count': wishlist_count,
+        'wishlist': wishlist,
+    })
+
+
+@cache_anonymous_page
 def stationery_list(request):
     """Список канцтоваров с фильтрацией по категориям и сортировкой"""
     from django.db.models import Q
@@ -427,6 +461,52 @@ def stationery_list(request):
 
 # ---------- Helpers ----------
 
+# Порядок сортировки каталога: (sort, order) -> поля order_by.
+# Обратное направление — точное зеркало прямого, поэтому оба читаются одним
+# составным индексом Book (прямым или обратным проходом).
+BOOK_ORDERINGS = {
+    ('rating', 'desc'): ('-rating', 'title', 'id'),
+    ('rating', 'asc'): ('rating', '-title', '-id'),
+    ('year', 'asc'): ('publication_year', 'title', 'id'),
+    ('year', 'desc'): ('-publication_year', '-title', '-id'),
+}
+
+# Дополнительные сортировки результатов поиска (rank аннотируется в core.search)
+SEARCH_ORDERINGS = {
+    'relevance': ('-rank', '-rating', 'title', 'id'),
+}
+
+
+def _paginate_books(request, books, default_sort='rating', extra_orderings=None, card_variant='filtered'):
+    """
+    Сортирует книги по параметрам запроса и возвращает (page, sort_by, order).
+
+    card_variant — вариант карточки в шаблоне ({% bookcard %}), фрагменты
+    которой загружаются из кэша для всей страницы сразу.
+    """
+    sort_by = request.GET.get('sort', default_sort)  # rating, year (+ extra_orderings)
+    order = request.GET.get('order', 'desc')  # asc, desc
+
+    if extra_orderings and sort_by in extra_orderings:
+        order = 'desc'
+        ordering = extra_orderings[sort_by]
+    else:
+        if sort_by != 'year':
+            sort_by = 'rating'
+        if order != 'desc':
+            order = 'asc'
+        ordering = BOOK_ORDERINGS[(sort_by, order)]
+
+    paginator = KeysetPaginator(
+        ordering,
+        per_page=settings.CATALOG_PAGE_SIZE,
+        nullable=('publication_year',),
+    )
+    page = paginator.paginate(books, request.GET.get('cursor'))
+    prefetch_book_cards(page.object_list, card_variant)
+    return page, sort_by, order
+
+
 def _get_product_or_404(product_type: str, pk: int):
     if product_type == "book":
         queryset = Book.objects.select_related("publisher").prefetch_related("authors", "genres")
@@ -437,61 +517,10 @@ def _get_product_or_404(product_type: str, pk: int):
     return get_object_or_404(queryset, pk=pk)
 
 
-def _get_cart(request):
-    return request.session.setdefault("cart", {})
-
-
-def _serialize_product_for_cart(product_type, product):
-    image_url = None
-
-    if product_type == "book" and product.cover:
-        image_url = product.cover.url
-    elif product_type == "stationery" and getattr(product, "image", None):
-        image_field = getattr(product, "image")
-        if image_field:
-            image_url = image_field.url
-
-    name = product.title if product_type == "book" else product.name
-
-    return {
-        "product_type": product_type,
-        "product_id": product.id,
-        "name": name,
-        "price": str(product.price),
-        "image": image_url,
-        "quantity": 0,
-    }
-
-
-def _cart_items_summary(cart):
-    items = []
-    total = Decimal("0.00")
-    total_quantity = 0
-
-    for key, item in cart.items():
-        price = Decimal(item["price"])
-        quantity = item["quantity"]
-        subtotal = price * quantity
-        total += subtotal
-        total_quantity += quantity
-        items.append(
-            {
-                "key": key,
-                "product_type": item["product_type"],
-                "product_id": item["product_id"],
-                "name": item["name"],
-                "price": price,
-                "quantity": quantity,
-                "subtotal": subtotal,
-                "image": item.get("image"),
-            }
-        )
-
-    return items, total, total_quantity
-
-
 # ---------- Product Detail & Cart ----------
 
+@count_views(lambda product_type, pk: ('Book' if product_type == 'book' else 'Stationery', pk))
+@cache_anonymous_page
 def product_detail(request, product_type: str, pk: int):
     product = _get_product_or_404(product_type, pk)
 
@@ -500,18 +529,19 @@ def product_detail(request, product_type: str, pk: int):
     if product_type == "book":
         reviews = product.reviews.select_related("user").order_by("-created_at").all()
 
-    # Логируем просмотр товара
-    model_name = 'Book' if product_type == 'book' else 'Stationery'
-    product_name = product.title if product_type == 'book' else product.name
-    log_action(
-        action='view',
-        user=request.user if request.user.is_authenticated else None,
-        request=request,
-        model_name=model_name,
-        object_id=product.id,
-        object_repr=product_name,
-        description=f'Просмотр {"книги" if product_type == "book" else "товара"}: {product_name}',
-    )
+    # Просмотры считаются в core.view_counters; в журнал — только выборочно
+    if sample_view_audit():
+        model_name = 'Book' if product_type == 'book' else 'Stationery'
+        product_name = product.title if product_type == 'book' else product.name
+        log_action(
+            action='view',
+            user=request.user if request.user.is_authenticated else None,
+            request=request,
+            model_name=model_name,
+            object_id=product.id,
+            object_repr=product_name,
+            description=f'Просмотр {"книги" if product_type == "book" else "товара"}: {product_name}',
+        )
 
     context = {
         "product_type": product_type,
@@ -521,9 +551,48 @@ def product_detail(request, product_type: str, pk: int):
     return render(request, "product_detail.html", context)
 
 
+def _is_ajax(request):
+    return request.headers.get("X-Requested-With") == "XMLHttpRequest"
+
+
+def _cart_line_json(product_type, product_id, line):
+    """Строка корзины для JSON-ответа (quantity=0 — строки больше нет)"""
+    return {
+        "key": f"{product_type}:{product_id}",
+        "product_type": product_type,
+        "product_id": product_id,
+        "quantity": line.quantity if line else 0,
+        "price": str(line.price) if line else None,
+        "subtotal": str(line.price * line.quantity) if line else "0.00",
+    }
+
+
+def _cart_json(cart, lines, **extra):
+    """JSON-ответ корзины: измененные строки и итоги (без перерисовки страницы)"""
+    total_quantity, total = cart_totals(cart)
+    return JsonResponse({
+        "success": True,
+        "lines": [_cart_line_json(product_type, product_id, line) for (product_type, product_id), line in lines.items()],
+        # SQLite возвращает сумму без дробной части — формат задаем явно
+        "cart": {"total_quantity": total_quantity, "total": f"{total:.2f}"},
+        **extra,
+    })
+
+
+def _rejected_quantities(quantities, lines):
+    """Ключи "тип:id" строк, количество которых не изменилось из-за нехватки товара"""
+    return [
+        f"{product_type}:{product_id}"
+        for (product_type, product_id), line in lines.items()
+        if line is not None and line.quantity != quantities[(product_type, product_id)]
+    ]
+
+
 @require_POST
 def add_to_cart(request, product_type: str, pk: int):
-    product = _get_product_or_404(product_type, pk)
+    product = get_product(product_type, pk)
+    if product is None:
+        raise Http404("Товар не найден")
 
     try:
         quantity = int(request.POST.get("quantity", 1))
@@ -531,25 +600,31 @@ def add_to_cart(request, product_type: str, pk: int):
         quantity = 1
     quantity = max(1, quantity)
 
-    cart = _get_cart(request)
-    key = f"{product_type}:{pk}"
-
-    if key not in cart:
-        cart[key] = _serialize_product_for_cart(product_type, product)
-
-    cart[key]["quantity"] += quantity
-    request.session.modified = True
-
-    product_name = product.title if product_type == "book" else product.name
-    messages.success(request, f'Товар "{product_name}" добавлен в корзину!')
-
+    cart = get_cart(request, create=True)
+    name = product_name(product_type, product)
+    if not add_line(cart, product_type, pk, quantity, product.price):
+        # Свободный остаток уже разобран другими корзинами
+        error = f'Товара "{name}" недостаточно на складе: доступно {product.available_quantity} шт.'
+        if _is_ajax(request):
+            return JsonResponse({"success": False, "error": error}, status=409)
+        messages.warning(request, error)
+        next_url = request.POST.get("next") or request.META.get("HTTP_REFERER") or reverse("cart_view")
+        return redirect(next_url)
+
+    message = f'Товар "{name}" добавлен в корзину!'
+    if _is_ajax(request):
+        line = CartLine.objects.filter(cart=cart, product_type=product_type, product_id=pk).first()
+        return _cart_json(cart, {(product_type, pk): line}, message=message)
+
+    messages.success(request, message)
     next_url = request.POST.get("next") or request.META.get("HTTP_REFERER") or reverse("cart_view")
     return redirect(next_url)
 
 
 def cart_view(request):
-    cart = request.session.get("cart", {})
-    items, total, total_quantity = _cart_items_summary(cart)
+    items, total, total_quantity, changes = revalidate(get_cart(request))
+    for change in changes:
+        messages.warning(request, change)
 
     context = {
         "items": items,
@@ -561,48 +636,79 @@ def cart_view(request):
 
 @require_POST
 def remove_from_cart(request, product_type: str, pk: int):
-    key = f"{product_type}:{pk}"
-    cart = request.session.get("cart", {})
-
-    if key in cart:
-        del cart[key]
-        request.session.modified = True
+    cart = get_cart(request)
+    if cart is not None:
+        remove_line(cart, product_type, pk)
 
+    if _is_ajax(request):
+        return _cart_json(cart, {(product_type, pk): None})
     return redirect("cart_view")
 
 
 @require_POST
 def update_cart_quantity(request, product_type: str, pk: int):
-    key = f"{product_type}:{pk}"
-    cart = request.session.get("cart", {})
-
-    if key not in cart:
-        return redirect("cart_view")
-
+    cart = get_cart(request)
     try:
         quantity = int(request.POST.get("quantity", 1))
     except (TypeError, ValueError):
-        quantity = cart[key]["quantity"]
-
-    if quantity <= 0:
-        del cart[key]
-    else:
-        cart[key]["quantity"] = quantity
+        if _is_ajax(request):
+            return JsonResponse({"success": False, "error": "Неверное количество"}, status=400)
+        return redirect("cart_view")
 
-    request.session.modified = True
+    lines = set_quantities(cart, {(product_type, pk): quantity}) if cart is not None else {}
+    rejected = _rejected_quantities({(product_type, pk): quantity}, lines)
+    if _is_ajax(request):
+        return _cart_json(cart, lines, rejected=rejected)
+    if rejected:
+        messages.warning(request, "Товара недостаточно на складе, количество не изменено.")
     return redirect("cart_view")
 
 
+@require_POST
+def update_cart_batch(request):
+    """
+    Изменение количества нескольких товаров одним запросом (JSON).
+
+    Тело запроса: {"lines": [{"product_type": "book", "product_id": 1, "quantity": 2}, ...]};
+    количество 0 удаляет строку.
+    """
+    try:
+        payload = json.loads(request.body or b"{}")
+        quantities = {
+            (str(line["product_type"]), int(line["product_id"])): int(line["quantity"])
+            for line in payload.get("lines", [])
+        }
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse({"success": False, "error": "Неверный формат запроса"}, status=400)
+
+    cart = get_cart(request)
+    lines = set_quantities(cart, quantities) if cart is not None else {}
+    return _cart_json(cart, lines, rejected=_rejected_quantities(quantities, lines))
+
+
 def checkout(request):
     from .models import DeliveryOption
-    
-    cart = request.session.get("cart", {})
-    if not cart:
+
+    if request.method == "POST":
+        # Повторная отправка уже выполненной формы: корзина пуста, заказ создан
+        order_id = existing_order_id(request.POST.get("idempotency_key"))
+        if order_id:
+            return redirect("order_success", order_id=order_id)
+
+    cart = get_cart(request)
+    items, total, total_quantity, changes = revalidate(cart)
+    out_of_stock = [item for item in items if not item["in_stock"]]
+    if changes or out_of_stock:
+        # Цены или наличие изменились — покупатель должен увидеть корзину заново
+        for change in changes:
+            messages.warning(request, change)
+        if out_of_stock:
+            messages.warning(request, "Некоторых товаров нет в нужном количестве. Измените количество в корзине.")
+        return redirect("cart_view")
+    if not items:
         messages.warning(request, "Корзина пуста. Добавьте товары перед оформлением заказа.")
         return redirect("cart_view")
 
-    items, total, total_quantity = _cart_items_summary(cart)
-
     if request.method == "POST":
         form = CheckoutForm(request.POST, user=request.user if request.user.is_authenticated else None)
         if form.is_valid():
@@ -612,103 +718,78 @@ def checkout(request):
             if delivery_option:
                 order_total_before_bonuses += delivery_option.price
 
-            # Используемые бонусы (если пользователь выбрал использовать бонусы)
-            used_bonuses = Decimal('0')
-            order_total_after_bonuses = order_total_before_bonuses
-            
+            # Бонусы, которые пользователь хочет списать
+            requested_bonuses = Decimal('0')
             if request.user.is_authenticated:
-                used_bonuses_str = request.POST.get('use_bonuses', '0')
                 try:
-                    used_bonuses = Decimal(str(used_bonuses_str))
-                except (ValueError, TypeError):
-                    used_bonuses = Decimal('0')
-                
-                # Применяем бонусы к итоговой сумме (если пользователь авторизован)
-                if used_bonuses > 0:
-                    try:
-                        loyalty_card = LoyaltyCard.objects.get(user=request.user)
-                        if loyalty_card.balance >= used_bonuses:
-                            # Не позволяем использовать бонусов больше, чем сумма заказа
-                            max_bonuses = min(used_bonuses, order_total_before_bonuses)
-                            # Списываем бонусы
-                            loyalty_card.spend_bonus(max_bonuses)
-                            # Уменьшаем итоговую сумму
-                            order_total_after_bonuses = max(Decimal('0'), order_total_before_bonuses - max_bonuses)
-                            used_bonuses = max_bonuses
-                            if used_bonuses < Decimal(str(used_bonuses_str)):
-                                messages.info(request, f"Использовано {used_bonuses} бонусов (максимум для этого заказа)")
-                        else:
-                            used_bonuses = Decimal('0')
-                            messages.warning(request, "Недостаточно бонусов на карте лояльности")
-                    except LoyaltyCard.DoesNotExist:
-                        used_bonuses = Decimal('0')
-
-            order = Order.objects.create(
-                user=request.user if request.user.is_authenticated else None,
-                full_name=form.cleaned_data["full_name"],
-                email=form.cleaned_data["email"],
-                phone=form.cleaned_data["phone"],
-                fulfillment_type=form.cleaned_data["fulfillment_type"],
-                delivery_option=delivery_option,
-                delivery_address=form.cleaned_data.get("delivery_address", ""),
-                pickup_point=form.cleaned_data.get("pickup_point"),
-                comment=form.cleaned_data.get("comment", ""),
-                total_amount=order_total_after_bonuses,
-            )
-
-            for item in items:
-                OrderItem.objects.create(
-                    order=order,
-                    product_type=item["product_type"],
-                    product_id=item["product_id"],
-                    name=item["name"],
-                    unit_price=item["price"],
-                    quantity=item["quantity"],
-                    subtotal=item["subtotal"],
-                )
-
-            # Если выбрана новая карта и пользователь авторизован, сохраняем карту
-            if request.user.is_authenticated and not form.cleaned_data.get("payment_card"):
-                new_card_number = form.cleaned_data.get("new_card_number", "").replace(" ", "")
-                if new_card_number:
-                    PaymentCard.objects.create(
-                        user=request.user,
-                        card_number_last4=new_card_number[-4:],
-                        cardholder_name=form.cleaned_data.get("new_cardholder_name", ""),
-                        expiry_month=form.cleaned_data.get("new_card_expiry_month", 1),
-                        expiry_year=form.cleaned_data.get("new_card_expiry_year", 2024),
-                        is_default=False,
+                    requested_bonuses = Decimal(str(request.POST.get('use_bonuses', '0')))
+                except (ValueError, TypeError, ArithmeticError):
+                    requested_bonuses = Decimal('0')
+
+            # Остатки, бонусы, заказ, карта оплаты и очистка корзины — одна транзакция
+            try:
+                with transaction.atomic():
+                    order, used_bonuses, bonus, card_created = place_order(
+                        items,
+                        order_total_before_bonuses,
+                        {
+                            "full_name": form.cleaned_data["full_name"],
+                            "email": form.cleaned_data["email"],
+                            "phone": form.cleaned_data["phone"],
+                            "fulfillment_type": form.cleaned_data["fulfillment_type"],
+                            "delivery_option": delivery_option,
+                            "delivery_address": form.cleaned_data.get("delivery_address", ""),
+                            "pickup_point": form.cleaned_data.get("pickup_point"),
+                            "comment": form.cleaned_data.get("comment", ""),
+                        },
+                        user=request.user if request.user.is_authenticated else None,
+                        use_bonuses=requested_bonuses,
+                        cart=cart,
+                        key=form.cleaned_data.get("idempotency_key") or None,
                     )
 
-            # Начисляем бонусы на карту лояльности (если пользователь авторизован)
-            # Начисляем на сумму ДО применения бонусов
-            if request.user.is_authenticated:
-                try:
-                    loyalty_card = LoyaltyCard.objects.get(user=request.user)
-                    # Начисляем бонусы на сумму заказа ДО применения бонусов
-                    bonus = loyalty_card.add_purchase(float(order_total_before_bonuses))
-                    if bonus > 0:
-                        messages.info(request, f"Начислено {bonus:.2f} бонусов на вашу карту лояльности!")
-                except LoyaltyCard.DoesNotExist:
-                    # Создаем карту лояльности при первой покупке
-                    loyalty_card = LoyaltyCard.objects.create(user=request.user)
-                    bonus = loyalty_card.add_purchase(float(order_total_before_bonuses))
-                    if bonus > 0:
-                        messages.info(request, f"Создана карта лояльности! Начислено {bonus:.2f} бонусов!")
-
-            request.session["cart"] = {}
-            request.session.modified = True
-
-            # Логируем создание заказа
-            log_action(
-                action='create',
-                user=request.user if request.user.is_authenticated else None,
-                request=request,
-                model_name='Order',
-                object_id=order.id,
-                object_repr=f'Заказ #{order.id}',
-                description=f'Создан заказ #{order.id} на сумму {order.total_amount} руб. ({order.get_fulfillment_type_display()})',
-            )
+                    # Если выбрана новая карта и пользователь авторизован, сохраняем карту
+                    if request.user.is_authenticated and not form.cleaned_data.get("payment_card"):
+                        new_card_number = form.cleaned_data.get("new_card_number", "").replace(" ", "")
+                        if new_card_number:
+                            PaymentCard.objects.create(
+                                user=request.user,
+                                card_number_last4=new_card_number[-4:],
+                                cardholder_name=form.cleaned_data.get("new_cardholder_name", ""),
+                                expiry_month=form.cleaned_data.get("new_card_expiry_month", 1),
+                                expiry_year=form.cleaned_data.get("new_card_expiry_year", 2024),
+                                is_default=False,
+                            )
+
+                    clear_cart(cart)
+
+                    # Запись о заказе в журнал — фоновой задачей (core.tasks)
+                    enqueue(
+                        'log_order_created',
+                        order_id=order.id,
+                        user_id=request.user.pk if request.user.is_authenticated else None,
+                        ip_address=get_client_ip(request),
+                        user_agent=get_user_agent(request),
+                        url_path=request.path,
+                    )
+            except OutOfStock as error:
+                messages.warning(request, str(error))
+                return redirect("cart_view")
+            except DuplicateCheckout as duplicate:
+                # Параллельная отправка той же формы уже создала заказ
+                return redirect("order_success", order_id=duplicate.order_id)
+
+            if requested_bonuses > 0:
+                if not used_bonuses:
+                    messages.warning(request, "Недостаточно бонусов на карте лояльности")
+                elif used_bonuses < requested_bonuses:
+                    messages.info(request, f"Использовано {used_bonuses} бонусов (максимум для этого заказа)")
+            # Бонусы начисляются на сумму ДО применения бонусов, фоновой задачей
+            if bonus > 0:
+                if card_created:
+                    messages.info(request, f"Создана карта лояльности! За заказ будет начислено {bonus:.2f} бонусов!")
+                else:
+                    messages.info(request, f"За заказ на вашу карту лояльности будет начислено {bonus:.2f} бонусов!")
 
             messages.success(request, "Заказ успешно создан!")
             return redirect("order_success", order_id=order.id)
@@ -723,6 +804,7 @@ def checkout(request):
                 }
             )
         initial.setdefault("fulfillment_type", Order.FulfillmentType.DELIVERY)
+        initial["idempotency_key"] = secrets.token_urlsafe(32)
         form = CheckoutForm(initial=initial, user=request.user if request.user.is_authenticated else None)
 
     # Для авторизованных пользователей загружаем сохраненные адреса и карты
@@ -16,7 +16,7 @@ from .models import (
     Order, User, Review, DeliveryOption, PickupPoint,
     SavedAddress, PaymentCard, LoyaltyCard, FAQ, SupportMessage, Role
 )
-from .audit import log_action
+from .audit import explicit_audit, log_action
 
 
 # Маппинг моделей для удобного доступа
@@ -191,7 +191,9 @@ def admin_panel_model_edit(request, model_name, object_id=None):
                 old_obj = model_class.objects.get(pk=obj.pk)
             
             # Сохраняем объект (ManyToMany поля сохраняются автоматически через form.save())
-            saved_obj = form.save()
+            # Запись в журнал с изменениями M2M создается ниже, а не сигналами
+            with explicit_audit():
+                saved_obj = form.save()
             
             # Логируем изменение
             action = 'create' if is_new else 'update'
@@ -345,7 +347,8 @@ def admin_panel_model_delete(request, model_name, object_id):
                     field_name = dep_info.get('field_name', dep_name.replace('m2m_', ''))
                     getattr(obj, field_name).clear()
         
-        obj.delete()
+        with explicit_audit():
+            obj.delete()
         
         # Логируем удаление
         log_action(
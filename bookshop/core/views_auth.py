@@ -8,7 +8,7 @@ from django.http import JsonResponse
 
 from .models import Order, Review, SavedAddress, PaymentCard, Book, OrderItem, LoyaltyCard, Role
 from .forms import UserProfileForm, ReviewForm, SavedAddressForm, PaymentCardForm
-from .audit import log_action
+from .audit import explicit_audit, log_action
 from decimal import Decimal
 from datetime import date
 
@@ -29,19 +29,21 @@ def register_view(request):
             messages.error(request, 'Такой пользователь уже есть')
             return redirect('register')
 
-        # Создаем пользователя с ролью "пользователь" по умолчанию
-        user = User.objects.create_user(email=email, password=password)
-        
-        # Присваиваем роль "пользователь" по умолчанию
-        try:
-            user_role = Role.objects.get(name='пользователь')
-            user.role = user_role
-            user.save()
-        except Role.DoesNotExist:
-            # Если роли нет, создаем её
-            user_role = Role.objects.create(name='пользователь')
-            user.role = user_role
-            user.save()
+        # Создание пользователя записывается в журнал одной записью 'register' ниже
+        with explicit_audit():
+            # Создаем пользователя с ролью "пользователь" по умолчанию
+            user = User.objects.create_user(email=email, password=password)
+            
+            # Присваиваем роль "пользователь" по умолчанию
+            try:
+                user_role = Role.objects.get(name='пользователь')
+                user.role = user_role
+                user.save()
+            except Role.DoesNotExist:
+                # Если роли нет, создаем её
+                user_role = Role.objects.create(name='пользователь')
+                user.role = user_role
+                user.save()
         
         # Логируем регистрацию
         log_action(
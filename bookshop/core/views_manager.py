@@ -5,7 +5,7 @@ from django.contrib import messages
 from django.db.models import Count, Sum, Avg, Q, F, Max, Min
 from django.db.models.functions import TruncDate
 from django.utils import timezone
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
 from django.views.decorators.http import require_http_methods
 from datetime import datetime, timedelta
 from decimal import Decimal
@@ -23,6 +23,12 @@ from .models import (
 )
 from .admin_utils import export_all_data_to_json, import_data_from_json
 from .audit import log_action
+from .audit_archive import AuditArchive, archived_entry
+from .audit_metadata import get_filter_metadata, get_log_stats
+from .audit_writer import writer as audit_writer
+from .fragment_cache import card_stats
+from .pagination import KeysetPaginator, estimate_count
+from .view_counters import view_totals, with_objects
 
 
 def manager_required(user):
@@ -93,6 +99,9 @@ def manager_dashboard(request):
     low_stock_books = Book.objects.filter(stock_quantity__lte=5).count()
     low_stock_stationery = Stationery.objects.filter(stock_quantity__lte=5).count()
     
+    # Эффективность кэша карточек книг в каталоге
+    card_cache_stats = card_stats()
+    
     # Статистика по пользователям
     total_users = User.objects.count()
     total_loyalty_cards = LoyaltyCard.objects.count()
@@ -148,6 +157,7 @@ def manager_dashboard(request):
         'month_revenue': month_revenue,
         'total_books': total_books,
         'total_stationery': total_stationery,
+        'card_cache_stats': card_cache_stats,
         'low_stock_books': low_stock_books,
         'low_stock_stationery': low_stock_stationery,
         'total_users': total_users,
@@ -505,6 +515,22 @@ def manager_reports(request):
         total_revenue=Sum('subtotal')
     ).order_by('-total_quantity')[:10]
     
+    # Самые просматриваемые книги, товары и авторы за тот же период (core.view_counters)
+    try:
+        views_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+    except ValueError:
+        views_from = None
+    try:
+        views_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+    except ValueError:
+        views_to = None
+    if not date_from and not date_to:
+        views_from = (timezone.now() - timedelta(days=30)).date()
+    most_viewed = {
+        model_name: with_objects(model_name, view_totals(model_name, views_from, views_to, limit=10))
+        for model_name in ('Book', 'Stationery', 'Author')
+    }
+    
     # Статистика по дням
     daily_stats = orders.extra(
         select={'day': "DATE(created_at)"}
@@ -579,6 +605,11 @@ def manager_reports(request):
         'status_stats': status_stats,
         'fulfillment_stats': fulfillment_stats,
         'top_products': top_products,
+        'most_viewed_groups': [
+            ('Самые просматриваемые книги', most_viewed['Book']),
+            ('Самые просматриваемые товары', most_viewed['Stationery']),
+            ('Самые просматриваемые авторы', most_viewed['Author']),
+        ],
         'daily_stats': daily_stats,
         'date_from': date_from,
         'date_to': date_to,
@@ -1018,7 +1049,7 @@ def manager_audit_log(request):
     search_query = request.GET.get('q', '')
     
     # Базовый queryset
-    audit_logs = AuditLog.objects.select_related('user').all()
+    audit_logs = AuditLog.objects.select_related('user', 'path', 'agent').all()
     
     # Применяем фильтры
     if model_filter:
@@ -1060,30 +1091,29 @@ def manager_audit_log(request):
         week_ago = timezone.now() - timedelta(days=7)
         audit_logs = audit_logs.filter(created_at__gte=week_ago)
     
-    # Статистика
-    total_logs = audit_logs.count()
-    stats_by_action = audit_logs.values('action').annotate(count=Count('id')).order_by('-count')
-    stats_by_model = audit_logs.values('model_name').annotate(count=Count('id')).order_by('-count')
-    
-    # Получаем уникальные модели для фильтра
-    all_models = AuditLog.objects.values_list('model_name', flat=True).distinct().order_by('model_name')
+    # Статистика: количество — оценка планировщика (точное, если записей немного),
+    # разбивка по действиям и моделям кэшируется для набора фильтров
+    total_logs, total_exact = estimate_count(audit_logs)
+    log_stats = get_log_stats(audit_logs, {
+        'model': model_filter, 'action': action_filter, 'user': user_filter,
+        'date_from': date_from, 'date_to': date_to, 'q': search_query,
+    })
     
-    # Получаем пользователей, которые вносили изменения
-    users_with_changes = User.objects.filter(
-        id__in=AuditLog.objects.values_list('user_id', flat=True).distinct()
-    ).order_by('email')
+    # Модели и пользователи для фильтров (кэш, дополняется новыми записями)
+    filter_metadata = get_filter_metadata()
+    all_models = sorted(filter_metadata['model_names'])
+    users_with_changes = User.objects.filter(id__in=filter_metadata['user_ids']).order_by('email')
     
-    # Пагинация
-    from django.core.paginator import Paginator
-    paginator = Paginator(audit_logs, 50)
-    page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
+    # Курсорная пагинация: без COUNT(*) и OFFSET, страница — диапазон индекса (created_at, id)
+    paginator = KeysetPaginator(('-created_at', '-id'), per_page=50)
+    page_obj = paginator.paginate(audit_logs, request.GET.get('cursor'))
     
     context = {
         'audit_logs': page_obj,
         'total_logs': total_logs,
-        'stats_by_action': stats_by_action,
-        'stats_by_model': stats_by_model,
+        'total_exact': total_exact,
+        'stats_by_action': log_stats['by_action'],
+        'stats_by_model': log_stats['by_model'],
         'all_models': all_models,
         'users_with_changes': users_with_changes,
         'model_filter': model_filter,
@@ -1093,6 +1123,10 @@ def manager_audit_log(request):
         'date_to': date_to,
         'search_query': search_query,
         'action_choices': AuditLog.ACTION_TYPES,
+        # Очередь фоновой записи журнала в этом процессе
+        'audit_writer_stats': audit_writer.stats(),
+        # Записи, перенесенные в архив (команда archive_audit_log)
+        'audit_archive': AuditArchive().summary(),
     }
     
     return render(request, 'manager/audit_log.html', context)
@@ -1101,10 +1135,15 @@ def manager_audit_log(request):
 @login_required
 @user_passes_test(admin_required, login_url='/login/')
 def manager_audit_log_details(request, log_id):
-    """Детали записи аудита (AJAX)"""
+    """Детали записи аудита (AJAX); перенесенные в архив записи читаются из архива"""
     from .models import AuditLog
     
-    log = get_object_or_404(AuditLog, pk=log_id)
+    log = AuditLog.objects.select_related('user', 'path', 'agent').filter(pk=log_id).first()
+    if log is None:
+        row = AuditArchive().get(log_id)
+        if row is None:
+            raise Http404('Запись аудита не найдена')
+        log = archived_entry(row)
     
     return render(request, 'manager/audit_log_details.html', {'log': log})
 